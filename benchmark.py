@@ -0,0 +1,199 @@
+"""
+Immich Uploader - Benchmark
+Uploads synthetic media trees to a local mock Immich server across
+concurrency levels and file-size mixes, and reports throughput.
+
+    python benchmark.py                              # default sweep
+    python benchmark.py --workers 1,4,8 --mix photos --latency 0.05
+    python benchmark.py --transport threads,async --workers 8,64,256 --latency 0.2
+    python benchmark.py --json results.json          # save for later
+    python benchmark.py --baseline results.json      # exit 1 on a regression
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from immich_engine import UploadEngine, UPLOAD_TRANSPORTS
+from mock_immich_server import MockImmich, MockImmichServer
+
+MB = 1024 * 1024
+
+# File-size mixes as (share of files, extension, min bytes, max bytes)
+SIZE_MIXES = {
+    'small': [(1.0, '.jpg', 50 * 1024, 300 * 1024)],
+    'photos': [(0.9, '.jpg', 1 * MB, 6 * MB), (0.1, '.heic', 1 * MB, 3 * MB)],
+    'mixed': [(0.85, '.jpg', 1 * MB, 6 * MB), (0.15, '.mp4', 20 * MB, 100 * MB)],
+}
+
+
+def make_media_tree(root, count, mix, scale=1.0, seed=0, per_folder=50):
+    """Write count files of random content under root, returning their total size
+
+    Contents are random so the duplicate check never collapses files; sizes
+    are multiplied by scale to make quick runs cheaper.
+    """
+    rng = random.Random(seed)
+    shares, specs = zip(*[(share, spec) for share, *spec in SIZE_MIXES[mix]])
+    total = 0
+    for i in range(count):
+        extension, low, high = rng.choices(specs, weights=shares)[0]
+        size = max(1, int(rng.randint(low, high) * scale))
+        folder = os.path.join(root, f"{i // per_folder:03d}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"IMG_{i:05d}{extension}"), 'wb') as f:
+            remaining = size
+            while remaining:
+                chunk = min(remaining, 4 * MB)
+                f.write(os.urandom(chunk))
+                remaining -= chunk
+        total += size
+    return total
+
+
+def run_once(tree, workers, mock_options, adaptive=False, transport='threads'):
+    """Upload tree to a fresh mock server, returning the result row"""
+    mock = MockImmich(**mock_options)
+    server = MockImmichServer(mock)
+    state_dir = tempfile.mkdtemp(prefix='immich-bench-')
+    engine = None
+    try:
+        engine = UploadEngine(log=lambda message: None,
+                              config_file=os.path.join(state_dir, 'config.json'),
+                              index_file=os.path.join(state_dir, 'index.db'),
+                              journal_dir=os.path.join(state_dir, 'jobs'))
+        engine.set_server(server.start(), 'benchmark')
+        engine.upload_workers = workers
+        engine.adaptive_concurrency = adaptive
+        engine.transport = transport
+
+        started = time.monotonic()
+        # One album for the whole tree, as a single run would use
+        engine.upload_folders([tree], album_name='Benchmark')
+        seconds = time.monotonic() - started
+
+        metrics = engine.metrics.snapshot()
+        assets = metrics['requests'].get('assets', {})
+        uploaded = metrics['files'].get('uploaded', 0)
+        return {
+            'transport': transport,
+            'workers': workers,
+            'files': uploaded,
+            'failed_files': metrics['files'].get('failed', 0),
+            'mb': round(metrics['bytes'].get('uploaded', 0) / MB, 1),
+            'seconds': round(seconds, 2),
+            'files_per_second': round(uploaded / seconds, 2),
+            'mb_per_second': round(metrics['bytes'].get('uploaded', 0) / MB / seconds, 2),
+            'assets_p50': assets.get('p50'),
+            'assets_p95': assets.get('p95'),
+            'retries': metrics['retries'],
+            'server_assets': len(mock.assets),
+        }
+    finally:
+        if engine and engine.session:
+            engine.session.close()
+        if engine and engine.index:
+            engine.index.db.close()
+        server.stop()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+def print_table(results):
+    columns = ('mix', 'transport', 'workers', 'files', 'mb', 'seconds', 'files_per_second', 'mb_per_second',
+               'assets_p50', 'assets_p95', 'retries', 'failed_files')
+    widths = {column: max(len(column), *(len(str(row[column])) for row in results)) for column in columns}
+    print("  ".join(column.rjust(widths[column]) for column in columns))
+    for row in results:
+        print("  ".join(str(row[column]).rjust(widths[column]) for column in columns))
+
+
+def compare(results, baseline, tolerance):
+    """Rows more than tolerance slower than the baseline (MB/s), as messages"""
+    # Results saved before there was a choice of transport used threads
+    previous = {(row['mix'], row.get('transport', 'threads'), row['workers']): row for row in baseline}
+    regressions = []
+    for row in results:
+        old = previous.get((row['mix'], row['transport'], row['workers']))
+        if not old or not old['mb_per_second']:
+            continue
+        change = row['mb_per_second'] / old['mb_per_second'] - 1
+        if change < -tolerance:
+            regressions.append(f"{row['mix']} {row['transport']} x{row['workers']}: {old['mb_per_second']} → "
+                               f"{row['mb_per_second']} MB/s ({change:+.0%})")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the upload engine against a mock Immich server")
+    parser.add_argument('--workers', default='1,2,4,8', help="comma separated upload worker counts")
+    parser.add_argument('--mix', default='small,photos', help=f"comma separated size mixes ({', '.join(SIZE_MIXES)})")
+    parser.add_argument('--files', type=int, default=200, help="files per mix")
+    parser.add_argument('--scale', type=float, default=0.25, help="multiply every file size by this")
+    parser.add_argument('--adaptive', action='store_true', help="let the engine adapt its concurrency")
+    parser.add_argument('--transport', default='threads',
+                        help=f"comma separated upload transports ({', '.join(UPLOAD_TRANSPORTS)})")
+    parser.add_argument('--latency', type=float, default=0.02, help="mock server seconds per request")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random extra seconds per request")
+    parser.add_argument('--bandwidth-mbps', type=float, default=0, help="mock server MB/s (0 = unlimited)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument('--tree', help="keep the generated trees in this folder and reuse them")
+    parser.add_argument('--json', metavar='PATH', help="save results to this file")
+    parser.add_argument('--baseline', metavar='PATH', help="compare with saved results")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="allowed MB/s drop against the baseline (default 0.15)")
+    args = parser.parse_args(argv)
+    args.workers = [int(value) for value in args.workers.split(',')]
+    args.mix = args.mix.split(',')
+    args.transport = args.transport.split(',')
+    for transport in args.transport:
+        if transport not in UPLOAD_TRANSPORTS:
+            parser.error(f"unknown transport {transport}")
+    for mix in args.mix:
+        if mix not in SIZE_MIXES:
+            parser.error(f"unknown mix {mix}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mock_options = {'latency': args.latency, 'jitter': args.jitter,
+                    'bandwidth_mbps': args.bandwidth_mbps, 'error_rate': args.error_rate, 'seed': 1}
+    tree_root = args.tree or tempfile.mkdtemp(prefix='immich-bench-tree-')
+    results = []
+    try:
+        for mix in args.mix:
+            tree = os.path.join(tree_root, f"{mix}-{args.files}-{args.scale}")
+            if not os.path.isdir(tree):
+                total = make_media_tree(tree, args.files, mix, args.scale)
+                print(f"Generated {args.files} {mix} files ({total / MB:.0f} MB) in {tree}", file=sys.stderr)
+            for transport in args.transport:
+                for workers in args.workers:
+                    row = dict(run_once(tree, workers, mock_options, args.adaptive, transport), mix=mix)
+                    print(f"  {mix} {transport} x{workers}: {row['mb_per_second']} MB/s, "
+                          f"{row['files_per_second']} files/s", file=sys.stderr)
+                    results.append(row)
+    finally:
+        if not args.tree:
+            shutil.rmtree(tree_root, ignore_errors=True)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,381 @@
+"""
+Immich Uploader - Async Transport
+A small HTTP/1.1 client on one asyncio event loop thread, so hundreds of
+uploads can be in flight without a thread each. Only the standard library is
+used, with certifi's CA bundle when it is installed. Proxies and CA bundles
+are taken from the environment the way requests takes them.
+"""
+
+import os
+import ssl
+import json
+import time
+import base64
+import asyncio
+import threading
+from datetime import timedelta
+from urllib.parse import urlsplit, unquote
+
+# Longest a single response header line may be
+MAX_LINE_BYTES = 64 * 1024
+# How long close() waits for the loop to shut down
+CLOSE_TIMEOUT = 5
+# Requests silently sent again when a pooled connection turns out to be dead,
+# as the threaded session's urllib3 Retry(allowed_methods) allows; a POST may
+# have been acted on already (a second album, a second upload)
+RESEND_METHODS = frozenset({'GET', 'PUT', 'HEAD'})
+
+
+class HTTPError(ConnectionError):
+    """The server sent something that isn't a valid HTTP/1.1 response"""
+
+
+class ResponseHeaders(dict):
+    """Response headers by lower case name, looked up case-insensitively"""
+
+    def get(self, name, default=None):
+        return super().get(name.lower(), default)
+
+    def __getitem__(self, name):
+        return super().__getitem__(name.lower())
+
+    def __contains__(self, name):
+        return super().__contains__(name.lower())
+
+
+class AsyncResponse:
+    """The parts of a requests.Response the engine reads"""
+
+    def __init__(self, status_code, reason, headers, content, elapsed):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.elapsed = elapsed
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def ca_bundle():
+    """The CA certificates requests would verify with: REQUESTS_CA_BUNDLE or
+    CURL_CA_BUNDLE, else certifi's bundle, else None for the system store"""
+    bundle = os.environ.get('REQUESTS_CA_BUNDLE') or os.environ.get('CURL_CA_BUNDLE')
+    if bundle:
+        return bundle
+    try:
+        import certifi
+    except ImportError:
+        return None
+    return certifi.where()
+
+
+def create_ssl_context():
+    """A verifying SSL context trusting ca_bundle()"""
+    bundle = ca_bundle()
+    if bundle and os.path.isdir(bundle):
+        return ssl.create_default_context(capath=bundle)
+    return ssl.create_default_context(cafile=bundle)
+
+
+def proxy_for(scheme, host):
+    """The proxy URL for requests to host from HTTP(S)_PROXY, ALL_PROXY and
+    NO_PROXY (or the system settings), or None to connect directly"""
+    from urllib.request import getproxies, proxy_bypass
+    proxies = getproxies()
+    proxy = proxies.get(scheme) or proxies.get('all')
+    if not proxy or proxy_bypass(host):
+        return None
+    # 'proxy:3128' means an HTTP proxy, as it does for requests
+    return proxy if '://' in proxy else f'http://{proxy}'
+
+
+def host_header(parts):
+    """Host header of a split URL: no user info, IPv6 addresses in brackets"""
+    host = parts.hostname
+    if ':' in host:
+        host = f'[{host}]'
+    return f'{host}:{parts.port}' if parts.port else host
+
+
+def proxy_authorization(proxy):
+    """Proxy-Authorization header value for a proxy URL with user info, or None"""
+    parts = urlsplit(proxy)
+    if parts.username is None:
+        return None
+    credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}"
+    return 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+
+
+def split_timeout(timeout):
+    """(connect, read) seconds from a number or a pair, like requests"""
+    if isinstance(timeout, tuple):
+        return timeout
+    return timeout, timeout
+
+
+class AsyncSession:
+    """Keep-alive HTTP client whose requests all run on one event loop thread
+
+    Coroutines are handed to the loop with submit(). get/post/put block the
+    calling thread like a requests.Session, so code written for requests works
+    unchanged; they must not be called from the loop thread itself.
+    """
+
+    transport = 'async'
+    # Failures of the connection itself, worth retrying
+    network_errors = (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError)
+
+    def __init__(self, api_key, pool_size, metrics=None):
+        self.headers = {'x-api-key': api_key}
+        self.pool_size = pool_size
+        self.metrics = metrics
+        # (scheme, host, port, proxy) → idle (reader, writer) pairs
+        self.idle = {}
+        # (scheme, host) → proxy URL or None, looked up once
+        self.proxies = {}
+        self.ssl_context = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='immich-async', daemon=True)
+        self.thread.start()
+
+    def submit(self, coroutine):
+        """Run coroutine on the loop, returning a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def request_sync(self, method, url, **kwargs):
+        if threading.current_thread() is self.thread:
+            raise RuntimeError("blocking request made from the event loop thread")
+        return self.submit(self.request(method, url, **kwargs)).result()
+
+    def get(self, url, **kwargs):
+        return self.request_sync('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request_sync('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request_sync('PUT', url, **kwargs)
+
+    def close(self):
+        """Close idle connections and stop the loop"""
+        if self.loop.is_closed():
+            return
+        if self.loop.is_running():
+            try:
+                self.submit(self.close_idle()).result(CLOSE_TIMEOUT)
+            except Exception:
+                pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(CLOSE_TIMEOUT)
+        if not self.loop.is_running():
+            self.loop.close()
+
+    async def close_idle(self):
+        for connections in self.idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self.idle.clear()
+
+    async def connect(self, key, timeout):
+        """An idle connection to key if there is one, else a new one; returns (reader, writer, reused)"""
+        connections = self.idle.get(key)
+        while connections:
+            reader, writer = connections.pop()
+            # The server may have closed it while it sat in the pool
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        scheme, host, port, proxy = key
+        context = None
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = create_ssl_context()
+            context = self.ssl_context
+        if proxy is None:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=context, limit=MAX_LINE_BYTES), timeout)
+            return reader, writer, False
+        
+        proxy_parts = urlsplit(proxy)
+        if proxy_parts.scheme != 'http':
+            raise OSError(f"the async transport only supports http:// proxies, not {proxy}; "
+                          f"use the threads transport")
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(proxy_parts.hostname, proxy_parts.port or 80, limit=MAX_LINE_BYTES),
+            timeout)
+        if context is not None:
+            try:
+                await self.open_tunnel(reader, writer, host, port, proxy, context, timeout)
+            except BaseException:
+                writer.close()
+                raise
+        return reader, writer, False
+    
+    async def open_tunnel(self, reader, writer, host, port, proxy, context, timeout):
+        """Turn a proxy connection into a TLS connection to host with CONNECT"""
+        if not hasattr(writer, 'start_tls'):
+            raise OSError("HTTPS through a proxy needs Python 3.11 or later with the async transport; "
+                          "use the threads transport")
+        target = f'[{host}]:{port}' if ':' in host else f'{host}:{port}'
+        lines = [f'CONNECT {target} HTTP/1.1', f'Host: {target}']
+        authorization = proxy_authorization(proxy)
+        if authorization:
+            lines.append(f'Proxy-Authorization: {authorization}')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await asyncio.wait_for(writer.drain(), timeout)
+        response, _ = await self.read_response(reader, 'CONNECT', timeout)
+        if response.status_code != 200:
+            raise OSError(f"proxy refused to connect to {target}: {response.status_code} {response.reason}")
+        await asyncio.wait_for(writer.start_tls(context, server_hostname=host), timeout)
+
+    def release(self, key, reader, writer):
+        connections = self.idle.setdefault(key, [])
+        if len(connections) < self.pool_size:
+            connections.append((reader, writer))
+        else:
+            writer.close()
+
+    async def request(self, method, url, headers=None, json=None, data=None, file_body=None,
+                      pace=None, timeout=30):
+        """Send a request and read the whole response
+
+        file_body is a MultipartFileBody streamed from disk; pace(nbytes)
+        returns how long to wait before sending each of its chunks.
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'http'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        if (scheme, parts.hostname) not in self.proxies:
+            self.proxies[scheme, parts.hostname] = proxy_for(scheme, parts.hostname)
+        proxy = self.proxies[scheme, parts.hostname]
+        key = (scheme, parts.hostname, port, proxy)
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        connect_timeout, read_timeout = split_timeout(timeout)
+
+        request_headers = {'Host': host_header(parts), 'User-Agent': 'ImmichUploader',
+                           'Accept': '*/*', **self.headers, **(headers or {})}
+        if proxy and scheme == 'http':
+            # A plain HTTP proxy is sent the whole URL instead of tunnelling
+            path = f'{scheme}://{host_header(parts)}{path}'
+            authorization = proxy_authorization(proxy)
+            if authorization:
+                request_headers['Proxy-Authorization'] = authorization
+        body = data
+        if json is not None:
+            body = encode_json(json)
+            request_headers['Content-Type'] = 'application/json'
+        if file_body is not None:
+            request_headers['Content-Length'] = str(len(file_body))
+        elif body is not None or method in ('POST', 'PUT'):
+            request_headers['Content-Length'] = str(len(body or b''))
+        head = ''.join([f'{method} {path} HTTP/1.1\r\n'] +
+                       [f'{name}: {value}\r\n' for name, value in request_headers.items()] +
+                       ['\r\n']).encode('latin-1')
+
+        started = time.monotonic()
+        while True:
+            reader, writer, reused = await self.connect(key, connect_timeout)
+            try:
+                writer.write(head)
+                if file_body is not None:
+                    await self.send_file(writer, file_body, pace, read_timeout)
+                elif body:
+                    writer.write(body)
+                await asyncio.wait_for(writer.drain(), read_timeout)
+                response, keep_alive = await self.read_response(reader, method, read_timeout)
+                break
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                writer.close()
+                # A pooled connection the server dropped: try the next one, unless the
+                # server was just slow or the request isn't safe to send twice
+                timed_out = isinstance(e, (asyncio.TimeoutError, TimeoutError))
+                if reused and not timed_out and method in RESEND_METHODS:
+                    continue
+                raise
+
+        if keep_alive:
+            self.release(key, reader, writer)
+        else:
+            writer.close()
+        response.elapsed = timedelta(seconds=time.monotonic() - started)
+        if self.metrics:
+            self.metrics.observe_response(method, url, response.status_code, response.elapsed.total_seconds())
+        return response
+
+    async def send_file(self, writer, file_body, pace, timeout):
+        """Stream a MultipartFileBody, reading the file off the loop thread"""
+        loop = asyncio.get_running_loop()
+        writer.write(file_body.preamble)
+        with file_body.open() as f:
+            while file_body.sent < file_body.size:
+                # A fresh bytes object per chunk: the transport may hold on to it
+                chunk = await loop.run_in_executor(None, file_body.read_chunk, f)
+                delay = pace(len(chunk)) if pace else 0
+                if delay:
+                    await asyncio.sleep(delay)
+                writer.write(chunk)
+                await asyncio.wait_for(writer.drain(), timeout)
+        writer.write(file_body.epilogue)
+        file_body.complete = True
+
+    async def read_response(self, reader, method, timeout):
+        """Return (AsyncResponse, whether the connection can be reused)"""
+        while True:
+            status_line = await asyncio.wait_for(reader.readline(), timeout)
+            if not status_line:
+                raise ConnectionResetError("server closed the connection")
+            try:
+                version, status, *reason = status_line.decode('latin-1').split(' ', 2)
+                status = int(status)
+            except ValueError:
+                raise HTTPError(f"bad status line {status_line[:100]!r}")
+            headers = ResponseHeaders()
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            # Skip interim responses such as 100 Continue
+            if status >= 200 or status == 101:
+                break
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if method == 'HEAD' or status in (204, 304) or (method == 'CONNECT' and status == 200):
+            content = b''
+        elif 'chunked' in headers.get('transfer-encoding', '').lower():
+            content = await self.read_chunked(reader, timeout)
+        elif 'content-length' in headers:
+            content = await asyncio.wait_for(reader.readexactly(int(headers['content-length'])), timeout)
+        else:
+            # Body runs until the server closes the connection
+            content = await asyncio.wait_for(reader.read(), timeout)
+            keep_alive = False
+        reason = reason[0].strip() if reason else ''
+        return AsyncResponse(status, reason, headers, content, None), keep_alive
+
+    async def read_chunked(self, reader, timeout):
+        parts = []
+        while True:
+            size_line = await asyncio.wait_for(reader.readline(), timeout)
+            try:
+                size = int(size_line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise HTTPError(f"bad chunk size {size_line[:100]!r}")
+            if size == 0:
+                # Trailers end with an empty line
+                while await asyncio.wait_for(reader.readline(), timeout) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(parts)
+            parts.append(await asyncio.wait_for(reader.readexactly(size), timeout))
+            await asyncio.wait_for(reader.readexactly(2), timeout)
+
+
+def encode_json(value):
+    """Request body for a json= argument (the name shadows the module inside request)"""
+    return json.dumps(value).encode('utf-8')
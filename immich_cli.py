@@ -0,0 +1,258 @@
+"""
+Immich Uploader - Command Line Version
+Runs the same upload engine as the GUI without a display, for servers, NAS boxes and cron
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+from datetime import datetime
+from immich_engine import UploadEngine, CONFIG_FILE, INDEX_FILE, UPLOAD_ORDERS, UPLOAD_TRANSPORTS
+from immich_journal import JOURNAL_DIR
+from immich_filter import DEFAULT_EXCLUDE_DIRS, parse_size, parse_date
+from immich_watch import watch_folders, SETTLE_SECONDS, POLL_SECONDS
+
+
+def size_arg(text):
+    try:
+        return parse_size(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def date_arg(text):
+    """Check a date argument, keeping it as text like the saved filters"""
+    try:
+        parse_date(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+
+def filter_settings(args, saved):
+    """The saved file filters with this run's command line rules added"""
+    filters = dict(saved)
+    for key, values in (('exclude', args.exclude), ('exclude_regex', args.exclude_regex),
+                        ('exclude_dirs', args.exclude_dir)):
+        if values:
+            filters[key] = list(filters.get(key, [])) + values
+    for key in ('min_size', 'max_size', 'newer_than', 'older_than'):
+        if getattr(args, key) is not None:
+            filters[key] = getattr(args, key)
+    if args.raw:
+        filters['raw'] = True
+    if args.no_default_excludes:
+        filters['default_excludes'] = False
+    return filters
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Upload folders to Immich. Settings default to the ones saved by the GUI.")
+    parser.add_argument('folders', nargs='*', help="folders to upload")
+    parser.add_argument('--server', help="Immich server URL ending with /api")
+    parser.add_argument('--api-key', help="API key (or set IMMICH_API_KEY)")
+    parser.add_argument('--mirror', nargs=2, action='append', metavar=('URL', 'KEY'),
+                        help="also upload everything to this server (repeatable); the folders are "
+                             "scanned and each file read once for all servers")
+    parser.add_argument('--no-mirrors', action='store_true',
+                        help="ignore mirror servers saved in the config")
+    parser.add_argument('--album', metavar='NAME',
+                        help="put every folder in this album instead of one album per folder name")
+    parser.add_argument('--workers', type=int, help="parallel uploads")
+    parser.add_argument('--hash-workers', type=int, help="parallel checksum readers")
+    parser.add_argument('--transport', choices=UPLOAD_TRANSPORTS,
+                        help="'async' sends every upload from one event loop thread, so --workers "
+                             "can be in the hundreds for many small files on a slow link")
+    parser.add_argument('--adaptive', action='store_true', default=None,
+                        help="adjust parallel uploads (up to --workers) to server latency and errors")
+    parser.add_argument('--no-adaptive', dest='adaptive', action='store_false',
+                        help="keep --workers uploads in flight even if adaptive is saved in the config")
+    parser.add_argument('--limit-mbps', type=float, metavar='MB',
+                        help="cap upload bandwidth in MB/s (0 = unlimited)")
+    parser.add_argument('--limit-rps', type=float, metavar='N',
+                        help="cap server requests per second (0 = unlimited)")
+    parser.add_argument('--order', choices=UPLOAD_ORDERS,
+                        help="how files from several folders are queued: folder by folder (default), "
+                             "round-robin, smallest-first or newest-first")
+    parser.add_argument('--exclude', action='append', metavar='GLOB',
+                        help="skip files matching this name pattern, or path pattern if it has a '/' "
+                             "(repeatable, e.g. 'IMG_*_thumb.jpg' or '*/Exports/*')")
+    parser.add_argument('--exclude-regex', action='append', metavar='REGEX',
+                        help="skip files whose path contains a match (repeatable)")
+    parser.add_argument('--exclude-dir', action='append', metavar='NAME',
+                        help="don't look inside folders with this name or pattern (repeatable); "
+                             f"{', '.join(DEFAULT_EXCLUDE_DIRS[:3])} and similar NAS/OS folders are skipped by default")
+    parser.add_argument('--no-default-excludes', action='store_true',
+                        help="also upload from NAS thumbnail, recycle bin and OS metadata folders")
+    parser.add_argument('--min-size', type=size_arg, metavar='SIZE',
+                        help="skip files smaller than this (e.g. 100k)")
+    parser.add_argument('--max-size', type=size_arg, metavar='SIZE',
+                        help="skip files larger than this (e.g. 4G)")
+    parser.add_argument('--newer-than', type=date_arg, metavar='DATE',
+                        help="only files modified on or after this date (YYYY-MM-DD)")
+    parser.add_argument('--older-than', type=date_arg, metavar='DATE',
+                        help="only files modified before this date (YYYY-MM-DD)")
+    parser.add_argument('--raw', action='store_true',
+                        help="also upload camera RAW files (.dng, .cr2, .nef, .arw, ...)")
+    parser.add_argument('--no-dedup', action='store_true',
+                        help="don't ask the server which files it already has")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="only re-send files that failed in earlier runs")
+    parser.add_argument('--resume', action='store_true',
+                        help="finish the last upload that was cut short (crash, sleep, closed window)")
+    parser.add_argument('--watch', action='store_true',
+                        help="after uploading, keep uploading new files as they appear (Ctrl+C to stop)")
+    parser.add_argument('--settle', type=float, default=SETTLE_SECONDS, metavar='SECONDS',
+                        help=f"with --watch, wait until a file is unchanged this long (default {SETTLE_SECONDS:.0f})")
+    parser.add_argument('--poll', type=float, default=POLL_SECONDS, metavar='SECONDS',
+                        help=f"with --watch where inotify is unavailable, rescan this often (default {POLL_SECONDS:.0f})")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="show what would be uploaded without changing anything")
+    parser.add_argument('--json', action='store_true',
+                        help="print progress as JSON lines on stdout (log goes to stderr)")
+    parser.add_argument('--metrics-json', metavar='PATH',
+                        help="write throughput and latency metrics to this file when done")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="serve Prometheus metrics at http://HOST:PORT/metrics while running")
+    parser.add_argument('--metrics-host', default='127.0.0.1',
+                        help="address for --metrics-port (default 127.0.0.1)")
+    parser.add_argument('--config', default=str(CONFIG_FILE), help="config file to read")
+    parser.add_argument('--index', default=str(INDEX_FILE),
+                        help="upload index database ('' to disable)")
+    parser.add_argument('--journal-dir', default=str(JOURNAL_DIR),
+                        help="where job journals for --resume are kept ('' to disable)")
+    args = parser.parse_args(argv)
+    if not args.folders and not args.retry_failed and not args.resume:
+        parser.error("give at least one folder, --retry-failed or --resume")
+    if args.watch and not args.folders:
+        parser.error("--watch needs at least one folder")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    lock = threading.Lock()
+
+    def log(message):
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        with lock:
+            print(f"[{timestamp}] {message}", file=sys.stderr if args.json else sys.stdout, flush=True)
+
+    def on_event(event, fields):
+        with lock:
+            print(json.dumps({'event': event, **fields}), flush=True)
+
+    engine = UploadEngine(log=log, on_event=on_event if args.json else None,
+                          config_file=args.config, index_file=args.index or None,
+                          journal_dir=args.journal_dir or None)
+    engine.load_config()
+
+    # Command line settings win over the saved ones, but are not saved
+    server_url = args.server or engine.server_url
+    api_key = args.api_key or os.environ.get('IMMICH_API_KEY') or engine.api_key
+    if not server_url or not api_key:
+        print("Error: no server URL / API key. Pass --server and --api-key, "
+              "or connect once from the GUI.", file=sys.stderr)
+        return 2
+    engine.set_server(server_url, api_key)
+    if args.no_mirrors or args.mirror:
+        saved = [] if args.no_mirrors else engine.mirror_servers
+        engine.set_mirrors(saved + [{'server_url': url, 'api_key': key} for url, key in args.mirror or []])
+    filters = filter_settings(args, engine.filters)
+    if filters != engine.filters:
+        try:
+            engine.set_filters(filters)
+        except ValueError as e:
+            print(f"Error: {str(e)}", file=sys.stderr)
+            return 2
+    if args.workers:
+        engine.upload_workers = max(1, args.workers)
+    if args.hash_workers:
+        engine.hash_workers = max(1, args.hash_workers)
+    if args.transport:
+        engine.transport = args.transport
+    if args.adaptive is not None:
+        engine.adaptive_concurrency = args.adaptive
+    if args.order:
+        engine.upload_order = args.order
+    engine.set_limits(engine.max_upload_mbps if args.limit_mbps is None else args.limit_mbps,
+                      engine.max_requests_per_second if args.limit_rps is None else args.limit_rps)
+    engine.dry_run = args.dry_run
+    if args.metrics_port is not None:
+        engine.start_metrics_server(args.metrics_port, args.metrics_host)
+    elif engine.metrics_port:
+        engine.start_metrics_server(host=args.metrics_host)
+
+    try:
+        return run(engine, args, log)
+    finally:
+        if args.metrics_json:
+            engine.dump_metrics(args.metrics_json)
+            log(f"Metrics written to {args.metrics_json}")
+
+
+def run(engine, args, log):
+    """Retry failed uploads and/or upload folders, returning the exit code"""
+    retry_fail_count = 0
+    if args.retry_failed:
+        uploaded, retry_fail_count = engine.retry_failed(check_duplicates=not args.no_dedup)
+        log(f"=== Retry Complete === Uploaded: {uploaded}, Still failing: {retry_fail_count}")
+        if not args.folders and not args.resume:
+            return 1 if retry_fail_count else 0
+    
+    if args.resume:
+        journal = engine.interrupted_job()
+        if journal:
+            try:
+                success_count, fail_count = engine.resume_job(journal)
+            except KeyboardInterrupt:
+                return interrupted(engine, log)
+            log(f"=== Resume Complete === Success: {success_count}, Failed: {fail_count}")
+            retry_fail_count += fail_count
+        else:
+            log("No interrupted upload to resume")
+        if not args.folders:
+            return 1 if retry_fail_count else 0
+
+    folders = []
+    for folder in args.folders:
+        if os.path.isdir(folder):
+            folders.append(os.path.abspath(folder))
+        else:
+            log(f"Skipping {folder}: not a folder")
+    if not folders:
+        return 2
+
+    if args.watch:
+        try:
+            success_count, fail_count = watch_folders(
+                engine, folders, album_name=args.album, check_duplicates=not args.no_dedup,
+                settle_seconds=args.settle, poll_seconds=args.poll)
+        except KeyboardInterrupt:
+            log("Stopped watching")
+            return 0
+    else:
+        try:
+            success_count, fail_count = engine.upload_folders(
+                folders, album_name=args.album, check_duplicates=not args.no_dedup)
+        except KeyboardInterrupt:
+            return interrupted(engine, log)
+
+    log(f"=== Upload Complete === Success: {success_count}, Failed: {fail_count}")
+    return 1 if fail_count or retry_fail_count else 0
+
+
+def interrupted(engine, log):
+    """Tell the user how to finish an upload stopped with Ctrl+C, returning the exit code"""
+    if engine.journal_dir and not engine.dry_run:
+        log("Upload interrupted. Run again with --resume to finish it")
+    else:
+        log("Upload interrupted")
+    return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
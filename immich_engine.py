@@ -0,0 +1,2246 @@
+"""
+Immich Uploader - Upload Engine
+Scanning, hashing, duplicate checks, uploads and albums, independent of any GUI
+"""
+
+import os
+import json
+import hashlib
+import time
+import queue
+import threading
+import sqlite3
+import uuid
+import math
+import random
+from collections import Counter, namedtuple
+from pathlib import Path
+from datetime import datetime, timezone
+from immich_metrics import UploadMetrics, serve_metrics
+from immich_metadata import read_capture_time
+from immich_journal import JobJournal, JOURNAL_DIR, DONE_STATUSES, recorded_stat, interrupted_job
+from immich_filter import FileFilter, DEFAULT_FILTER
+# requests, mimetypes, asyncio and the async transport are imported where
+# they are first needed, so the GUI window opens without waiting for them
+
+CONFIG_FILE = Path.home() / ".immich_uploader_config.json"
+INDEX_FILE = Path.home() / ".immich_uploader_index.db"
+# Metrics of the last GUI run, for finding where an import was slow
+METRICS_FILE = Path.home() / ".immich_uploader_metrics.json"
+
+# Album used for every folder when folder names aren't used
+DEFAULT_ALBUM_NAME = "Uploaded Photos"
+
+# Files hashed and sent to /assets/bulk-upload-check per request
+DEDUP_BATCH_SIZE = 200
+
+# Album membership updates are sent once this many ids are queued, or after this delay
+ALBUM_BATCH_SIZE = 200
+ALBUM_FLUSH_SECONDS = 2.0
+ALBUM_FLUSH_ATTEMPTS = 3
+
+# Every file is read once per upload in chunks of this size, through a single
+# buffer, so memory per in-flight upload doesn't grow with the file
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# When a file goes to several servers at once, the fastest upload may run this
+# many chunks ahead of the slowest before the slowest reads the file on its own
+TEE_MAX_AHEAD = 8
+# Checksums are computed with reads of this size
+HASH_CHUNK_BYTES = 1024 * 1024
+# Files at least this big get byte progress and a longer server timeout
+LARGE_FILE_BYTES = 64 * 1024 * 1024
+# Failed uploads are retried with exponential backoff and jitter before being
+# parked in the failed list
+UPLOAD_ATTEMPTS = 4
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 60.0
+# The server hashes big videos before answering, so allow it time after the last byte
+LARGE_FILE_READ_TIMEOUT = 600
+# Byte progress of large uploads is reported at this interval
+PROGRESS_EVERY_BYTES = 16 * 1024 * 1024
+
+# Adaptive concurrency compares each upload's time per byte with the best seen;
+# files smaller than this count as this size so request overhead doesn't dominate
+ADAPTIVE_MIN_SAMPLE_BYTES = 1024 * 1024
+# Share of the in-flight limit kept after a server error
+ADAPTIVE_BACKOFF = 0.7
+
+# How files from several folders are merged into one upload job
+UPLOAD_ORDERS = ('folders', 'round-robin', 'smallest-first', 'newest-first')
+
+# 'threads' uploads with one requests connection per worker, 'async' runs every
+# upload on one asyncio event loop so hundreds can be in flight
+UPLOAD_TRANSPORTS = ('threads', 'async')
+
+# How long the existence check waits to fill a batch before sending a partial one
+CHECK_BATCH_WAIT = 0.2
+# How often a stage waiting on a full or empty queue checks whether the run was stopped
+STAGE_POLL_SECONDS = 0.2
+
+# Running totals of a folder count are reported this often
+COUNT_PROGRESS_SECONDS = 0.25
+
+
+# A scanned media file with the stat result cached from the directory walk
+MediaFile = namedtuple('MediaFile', ['path', 'stat'])
+
+
+def choice(allowed):
+    """A config_value converter accepting only the given values"""
+    def convert(value):
+        if value not in allowed:
+            raise ValueError(f"{value!r} is not one of {', '.join(allowed)}")
+        return value
+    return convert
+
+
+def utc_timestamp(moment):
+    """An aware datetime as the ISO 8601 UTC text Immich expects"""
+    return moment.astimezone(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def media_entries(folder_path, file_filter=DEFAULT_FILTER):
+    """Yield the os.DirEntry of every media file under folder_path that file_filter wants, as it is found
+
+    Only the directory listings are read, so this is cheap even on network
+    shares, and folders the filter excludes are never listed at all. Files
+    are only stat'ed when the filter has size or date limits.
+    """
+    dirs = [folder_path]
+    while dirs:
+        current = dirs.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError:
+            continue
+        subdirs = []
+        with entries:
+            for entry in entries:
+                try:
+                    # Symlinked directories are not followed, same as os.walk
+                    if entry.is_dir(follow_symlinks=False):
+                        if file_filter.wants_dir(entry.name, entry.path):
+                            subdirs.append(entry.path)
+                    elif file_filter.wants_name(entry.name, entry.path):
+                        if not entry.is_file():
+                            continue
+                        # The stat result is cached on the entry for scan_media_files
+                        if not file_filter.checks_stat or file_filter.wants_stat(entry.stat()):
+                            yield entry
+                except OSError:
+                    continue
+        # Visit subdirectories in listing order
+        dirs.extend(reversed(subdirs))
+
+
+def scan_media_files(folder_path, file_filter=DEFAULT_FILTER):
+    """Yield media files under folder_path as they are found"""
+    for entry in media_entries(folder_path, file_filter):
+        try:
+            yield MediaFile(entry.path, entry.stat())
+        except OSError:
+            continue
+
+
+class InFlightLimiter:
+    """Bounds the number of files and bytes handed to the upload pool at once"""
+
+    def __init__(self, max_bytes, max_files):
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.bytes = 0
+        self.files = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, size):
+        with self.cond:
+            # A file larger than the whole budget is let through once the pool is empty
+            while self.files and (self.files >= self.max_files or
+                                  self.bytes + size > self.max_bytes):
+                self.cond.wait()
+            self.bytes += size
+            self.files += 1
+
+    def release(self, size):
+        with self.cond:
+            self.bytes -= size
+            self.files -= 1
+            self.cond.notify_all()
+
+    def set_max_files(self, max_files):
+        with self.cond:
+            self.max_files = max_files
+            self.cond.notify_all()
+
+
+class TokenBucket:
+    """Lets through rate units per second on average, in bursts of up to one second's worth"""
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+            self.tokens = min(self.tokens, rate)
+            self.updated = time.monotonic()
+
+    def reserve(self, amount):
+        """Spend amount units, returning the seconds to wait before using them"""
+        with self.lock:
+            if self.rate <= 0:
+                return 0
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Going into debt lets a chunk bigger than the burst through at the right average rate
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def take(self, amount):
+        """Block until amount units may be spent (no wait when the rate is 0)"""
+        delay = self.reserve(amount)
+        if delay:
+            time.sleep(delay)
+
+
+class RateLimiter:
+    """Caps upload bandwidth and request rate across all workers (0 = unlimited)"""
+
+    def __init__(self, bytes_per_second=0, requests_per_second=0):
+        self.bytes = TokenBucket(bytes_per_second)
+        self.requests = TokenBucket(requests_per_second)
+
+    def set_limits(self, bytes_per_second, requests_per_second):
+        self.bytes.set_rate(bytes_per_second)
+        self.requests.set_rate(requests_per_second)
+
+    def request(self):
+        """Wait for a request slot"""
+        self.requests.take(1)
+
+    def send(self, nbytes):
+        """Wait until nbytes may go out"""
+        self.bytes.take(nbytes)
+
+    def request_delay(self):
+        """Take a request slot without blocking, returning the seconds to wait for it"""
+        return self.requests.reserve(1)
+
+    def send_delay(self, nbytes):
+        return self.bytes.reserve(nbytes)
+
+
+class AdaptiveConcurrency:
+    """Grows or shrinks the in-flight upload limit from observed latency and errors
+
+    Each finished upload is compared, as time per byte, with the best seen so
+    far: while uploads stay as fast as that the limit grows, as they slow down
+    (the link or server is queueing) it settles lower, and a server error cuts
+    it back sharply.
+    """
+
+    def __init__(self, limiter, max_limit, min_limit=1, on_change=None):
+        self.limiter = limiter
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.on_change = on_change
+        # Start in the middle so there is room to grow and to shrink
+        self.limit = float(max(min_limit, self.max_limit // 2))
+        self.best = None
+        self.smoothed = None
+        self.lock = threading.Lock()
+        self.apply()
+
+    def on_success(self, duration, size):
+        sample = duration / max(size, ADAPTIVE_MIN_SAMPLE_BYTES)
+        with self.lock:
+            # Let the best time drift up slowly so an outlier doesn't pin the limit down
+            self.best = sample if self.best is None else min(sample, self.best * 1.002)
+            self.smoothed = sample if self.smoothed is None else 0.8 * self.smoothed + 0.2 * sample
+            gradient = max(0.5, min(1.0, self.best / self.smoothed))
+            target = self.limit * gradient + math.sqrt(self.limit)
+            self.limit = max(self.min_limit, min(self.max_limit, 0.8 * self.limit + 0.2 * target))
+            self.apply()
+
+    def on_error(self):
+        with self.lock:
+            self.limit = max(self.min_limit, self.limit * ADAPTIVE_BACKOFF)
+            self.apply()
+
+    def apply(self):
+        limit = int(self.limit)
+        if limit != self.limiter.max_files:
+            self.limiter.set_max_files(limit)
+            if self.on_change:
+                self.on_change(limit)
+
+
+class UploadError(Exception):
+    """An upload the server or network rejected; transient ones are worth retrying"""
+
+    def __init__(self, message, transient=False, retry_after=None):
+        super().__init__(message)
+        self.transient = transient
+        self.retry_after = retry_after
+
+
+def upload_error_from(response):
+    """Build an UploadError for a failed response, honouring Retry-After"""
+    status = response.status_code
+    transient = status == 429 or status >= 500
+    return UploadError(f"{status} - {response.text[:200]}", transient,
+                       parse_retry_after(response.headers.get('Retry-After')))
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delay or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryScheduler:
+    """Backoff with jitter shared by all upload workers
+
+    When the server says it is overloaded (429/503 with Retry-After) every
+    worker holds off, not just the one that got the answer.
+    """
+
+    def __init__(self, attempts=UPLOAD_ATTEMPTS, base=RETRY_BASE_SECONDS, cap=RETRY_MAX_SECONDS):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.resume_at = 0.0
+        self.lock = threading.Lock()
+        self.retries = 0
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds before retry number attempt (0-based)"""
+        if retry_after is not None:
+            return min(retry_after, self.cap)
+        backoff = min(self.cap, self.base * 2 ** attempt)
+        # Equal jitter: keep half the backoff, randomise the rest
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    def backoff_delay(self, attempt, error):
+        """Seconds to wait before retrying after error, pausing every worker if the server asked"""
+        delay = self.delay(attempt, error.retry_after)
+        with self.lock:
+            self.retries += 1
+            if error.retry_after is not None:
+                self.resume_at = max(self.resume_at, time.monotonic() + delay)
+        return delay
+
+    def backoff(self, attempt, error):
+        time.sleep(self.backoff_delay(attempt, error))
+
+    def turn_delay(self):
+        """Seconds left while the server has asked everyone to back off"""
+        return max(0.0, self.resume_at - time.monotonic())
+
+    def wait_turn(self):
+        """Block while the server has asked everyone to back off"""
+        while (remaining := self.turn_delay()) > 0:
+            time.sleep(remaining)
+
+
+class MultipartFileBody:
+    """Streams a multipart/form-data upload of one file in fixed size chunks
+
+    The file is read into one reused buffer and each chunk is handed out as a
+    view of it, valid until the next chunk is requested (the HTTP client sends
+    it before asking again). The SHA1 of the file is computed as the bytes go
+    out, so the checksum comes free with the upload, and after a failed attempt
+    that sent the whole body the server can be asked whether it kept it.
+    """
+
+    def __init__(self, file_path, size, fields, file_field, mime_type, on_progress=None,
+                 chunk_size=UPLOAD_CHUNK_BYTES, throttle=None, source=None):
+        self.file_path = file_path
+        self.size = size
+        self.on_progress = on_progress
+        self.throttle = throttle
+        # A TeeReader sharing the file's chunks with uploads to other servers
+        self.source = source
+        self.chunk_size = chunk_size
+        self.boundary = uuid.uuid4().hex
+        self.sha1 = hashlib.sha1()
+        self.sent = 0
+        self.reported = 0
+        self.complete = False
+        
+        parts = []
+        for name, value in fields.items():
+            parts.append(f'--{self.boundary}\r\n'
+                         f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                         f'{value}\r\n')
+        file_name = os.path.basename(file_path).replace('"', '%22')
+        parts.append(f'--{self.boundary}\r\n'
+                     f'Content-Disposition: form-data; name="{file_field}"; filename="{file_name}"\r\n'
+                     f'Content-Type: {mime_type}\r\n\r\n')
+        self.preamble = ''.join(parts).encode('utf-8')
+        self.epilogue = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        # A known length makes requests send Content-Length instead of chunked encoding
+        return len(self.preamble) + self.size + len(self.epilogue)
+
+    def read_chunk(self, f, buffer=None):
+        """Read the next chunk of the file, adding it to the checksum and progress
+
+        The chunk is a view of buffer when one is given, else new bytes.
+        """
+        # Never send more than the Content-Length promised
+        want = min(self.chunk_size, self.size - self.sent)
+        if buffer is None:
+            chunk = f.read(want)
+        else:
+            chunk = buffer[:f.readinto(buffer[:want])]
+        if not chunk:
+            raise OSError(f"{os.path.basename(self.file_path)} shrank while uploading")
+        self.sha1.update(chunk)
+        self.sent += len(chunk)
+        if self.on_progress and (self.sent - self.reported >= PROGRESS_EVERY_BYTES or
+                                 self.sent == self.size):
+            self.reported = self.sent
+            self.on_progress(self.sent, self.size)
+        return chunk
+
+    def open(self):
+        """The file, or the shared source its chunks come from"""
+        return self.source or open(self.file_path, 'rb', buffering=0)
+
+    def __iter__(self):
+        yield self.preamble
+        # A shared source hands out chunks other uploads send too, so there is no buffer to reuse
+        buffer = None if self.source else memoryview(bytearray(self.chunk_size))
+        with self.open() as f:
+            while self.sent < self.size:
+                chunk = self.read_chunk(f, buffer)
+                if self.throttle:
+                    self.throttle(len(chunk))
+                yield chunk
+        yield self.epilogue
+        self.complete = True
+
+
+class FileTee:
+    """Reads a file once for uploads of it to several servers
+
+    Each upload gets a TeeReader. Whichever is furthest ahead reads the next
+    chunk from disk and the others are handed the same bytes; a chunk is
+    dropped once every reader has had it. A reader that falls more than
+    TEE_MAX_AHEAD chunks behind is cut loose to read the file on its own, so
+    memory stays bounded and no upload ever waits for another.
+    """
+
+    def __init__(self, file_path, readers):
+        self.file_path = file_path
+        self.file = open(file_path, 'rb', buffering=0)
+        # File offset → chunk some reader still needs
+        self.chunks = {}
+        # Next offset each reader wants, None once it is closed or cut loose
+        self.offsets = [0] * readers
+        self.lock = threading.Lock()
+
+    def reader(self, index):
+        return TeeReader(self, index)
+
+    def read(self, reader, size):
+        """The reader's next chunk, or None once it has to read the file itself"""
+        with self.lock:
+            offset = self.offsets[reader]
+            if offset is None:
+                return None
+            chunk = self.chunks.get(offset)
+            if chunk is None:
+                # Only the reader furthest ahead can be missing its chunk
+                chunk = self.chunks[offset] = self.file.read(size)
+            self.offsets[reader] = offset + len(chunk)
+            self.drop_read()
+            return chunk
+
+    def close(self, reader):
+        with self.lock:
+            self.offsets[reader] = None
+            self.drop_read()
+
+    def drop_read(self):
+        """Forget chunks every reader has had, cutting loose the slowest while too many are kept"""
+        while True:
+            offsets = [offset for offset in self.offsets if offset is not None]
+            if not offsets:
+                self.chunks.clear()
+                self.file.close()
+                return
+            slowest = min(offsets)
+            for offset in [offset for offset in self.chunks if offset < slowest]:
+                del self.chunks[offset]
+            if len(self.chunks) <= TEE_MAX_AHEAD:
+                return
+            self.offsets = [None if offset == slowest else offset for offset in self.offsets]
+
+
+class TeeReader:
+    """One upload's file-like view of a FileTee"""
+
+    def __init__(self, tee, index):
+        self.tee = tee
+        self.index = index
+        self.offset = 0
+        self.file = None
+
+    def read(self, size):
+        if self.file is None:
+            chunk = self.tee.read(self.index, size)
+            if chunk is not None:
+                self.offset += len(chunk)
+                return chunk
+            # Too far behind the other uploads: go on from the file itself
+            self.file = open(self.tee.file_path, 'rb', buffering=0)
+            self.file.seek(self.offset)
+        return self.file.read(size)
+
+    def close(self):
+        self.tee.close(self.index)
+        if self.file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# A file moving through the upload pipeline; targets are the (engine, album id)
+# pairs of the servers that still need it, album_id the primary server's album,
+# and job whatever the caller passed in with it (upload_jobs: its FolderJob)
+UploadItem = namedtuple('UploadItem', ['media_file', 'album_id', 'checksum', 'created_at', 'targets', 'job'],
+                        defaults=(None, (), None))
+
+# Marks the end of a stage's input
+DONE = object()
+
+
+class UploadPipeline:
+    """Scan → hash → server check → upload stages joined by bounded queues
+
+    Each stage runs on its own threads, so reading file N+1 overlaps sending
+    file N, and the bounded queues keep memory flat however large the library.
+    With mirror servers configured every stage works per server, and a file
+    one or more servers lack is read once for all of them.
+    """
+
+    def __init__(self, engine, hash_workers, upload_workers, max_inflight_bytes, check_duplicates,
+                 dry_run=False, async_uploads=False):
+        self.engine = engine
+        self.targets = engine.targets()
+        self.check_duplicates = check_duplicates
+        # Servers whose duplicate check turned out to be unavailable
+        self.unchecked = set()
+        self.dry_run = dry_run
+        self.hash_workers = hash_workers
+        self.upload_workers = upload_workers
+        # With the async transport one thread feeds every upload to the event loop
+        self.async_uploads = async_uploads and not dry_run
+        self.upload_threads = 1 if self.async_uploads else upload_workers
+        self.hash_queue = queue.Queue(maxsize=hash_workers * 4)
+        self.check_queue = queue.Queue(maxsize=DEDUP_BATCH_SIZE * 2)
+        self.upload_queue = queue.Queue(maxsize=upload_workers * 2)
+        self.results = queue.Queue(maxsize=DEDUP_BATCH_SIZE * 2)
+        self.limiter = InFlightLimiter(max_inflight_bytes, upload_workers)
+        # Set when the caller stops reading results, so every stage winds down
+        self.stopped = threading.Event()
+
+    def run(self, sources, on_result):
+        """Push (media_file, album_ids, job) triples through the stages, calling
+        on_result(status, item) on this thread for every file
+
+        album_ids holds one album per engine.targets(); None skips that server.
+        job comes back as item.job.
+        """
+        threads = [threading.Thread(target=self.scan_stage, args=(sources,))]
+        if self.check_duplicates:
+            threads += [threading.Thread(target=self.hash_stage) for _ in range(self.hash_workers)]
+            threads.append(threading.Thread(target=self.check_stage))
+        if self.async_uploads:
+            threads.append(threading.Thread(target=self.async_upload_stage))
+        else:
+            threads += [threading.Thread(target=self.upload_stage) for _ in range(self.upload_workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        
+        finished = 0
+        try:
+            while finished < self.upload_threads:
+                result = self.results.get()
+                if result is DONE:
+                    finished += 1
+                else:
+                    status, item = result
+                    self.engine.metrics.count_file(status, item.media_file.stat.st_size)
+                    on_result(status, item)
+        finally:
+            if finished < self.upload_threads:
+                # on_result raised or the caller was interrupted: uploads already
+                # started finish, their results are dropped and nothing new starts
+                self.stopped.set()
+            for thread in threads:
+                while thread.is_alive():
+                    self.drain()
+                    thread.join(STAGE_POLL_SECONDS)
+    
+    def put(self, stage_queue, item):
+        """Queue item for the next stage, returning False instead if the run was stopped"""
+        while not self.stopped.is_set():
+            try:
+                stage_queue.put(item, timeout=STAGE_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def get(self, stage_queue, timeout=None):
+        """The next item of a stage's input, DONE once the run was stopped
+
+        Raises queue.Empty if a timeout is given and nothing arrived.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.stopped.is_set():
+            wait = STAGE_POLL_SECONDS if deadline is None else min(STAGE_POLL_SECONDS,
+                                                                   deadline - time.monotonic())
+            try:
+                return stage_queue.get(timeout=max(0, wait))
+            except queue.Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+        return DONE
+    
+    def drain(self):
+        """Throw away the results nobody reads any more"""
+        try:
+            while True:
+                self.results.get_nowait()
+        except queue.Empty:
+            pass
+
+    def scan_stage(self, sources):
+        next_queue = self.hash_queue if self.check_duplicates else self.upload_queue
+        try:
+            for media_file, album_ids, job in sources:
+                if self.stopped.is_set():
+                    break
+                self.engine.metrics.count_scanned()
+                # Files recorded by a previous run only need a stat
+                checksum = None
+                wanted = tuple((engine, album_id) for engine, album_id in zip(self.targets, album_ids)
+                               if album_id is not None)
+                targets = []
+                try:
+                    for engine, album_id in wanted:
+                        indexed, known = engine.indexed_state(media_file, album_id)
+                        checksum = checksum or known
+                        if not indexed:
+                            targets.append((engine, album_id))
+                except Exception as e:
+                    self.fail(UploadItem(media_file, album_ids[0], None, targets=wanted, job=job), e)
+                    continue
+                item = UploadItem(media_file, album_ids[0], checksum, targets=tuple(targets), job=job)
+                if targets:
+                    self.put(next_queue, item)
+                else:
+                    self.put(self.results, ('indexed', item))
+        except Exception as e:
+            self.engine.log(f"Error scanning: {str(e)}")
+        finally:
+            workers = self.hash_workers if self.check_duplicates else self.upload_threads
+            for _ in range(workers):
+                self.put(next_queue, DONE)
+
+    def fail(self, item, error):
+        """Report a file that broke a stage as failed, so the other files carry on"""
+        self.engine.log(f"Error with {os.path.basename(item.media_file.path)}: {str(error)}")
+        for engine, album_id in item.targets:
+            engine.record_failure(item.media_file.path, album_id, str(error))
+        self.put(self.results, ('failed', item))
+
+    def hash_stage(self):
+        try:
+            while (item := self.get(self.hash_queue)) is not DONE:
+                try:
+                    # The header read for the capture time is still cached when hashing starts
+                    item = item._replace(created_at=self.engine.file_created_at(item.media_file))
+                    if not item.checksum:
+                        item = item._replace(checksum=self.engine.file_checksum(item.media_file))
+                        if item.checksum:
+                            self.engine.record_step('hashed', path=item.media_file.path,
+                                                    checksum=item.checksum)
+                except Exception as e:
+                    self.fail(item, e)
+                    continue
+                self.put(self.check_queue, item)
+        finally:
+            self.put(self.check_queue, DONE)
+
+    def check_stage(self):
+        batch = []
+        finished = 0
+        try:
+            while finished < self.hash_workers:
+                try:
+                    # Send a partial batch when hashing can't keep up
+                    item = self.get(self.check_queue, timeout=CHECK_BATCH_WAIT if batch else None)
+                except queue.Empty:
+                    batch = self.check_batch(batch)
+                    continue
+                if item is DONE:
+                    if self.stopped.is_set():
+                        return
+                    finished += 1
+                else:
+                    batch.append(item)
+                    if len(batch) >= DEDUP_BATCH_SIZE:
+                        batch = self.check_batch(batch)
+            
+            self.check_batch(batch)
+        finally:
+            for _ in range(self.upload_threads):
+                self.put(self.upload_queue, DONE)
+
+    def check_batch(self, batch):
+        """Ask each server about a batch, forwarding files to the uploaders only for servers that lack them"""
+        existing = {}
+        for engine in self.targets:
+            items = [item for item in batch if any(target is engine for target, _ in item.targets)]
+            if not items or engine in self.unchecked:
+                continue
+            found = engine.check_existing(items)
+            if found is None:
+                # Older servers lack the endpoint: upload everything to it from here on
+                self.unchecked.add(engine)
+                continue
+            for path, asset_id in found.items():
+                existing[engine, path] = asset_id
+        
+        for item in batch:
+            targets = []
+            try:
+                for engine, album_id in item.targets:
+                    asset_id = existing.get((engine, item.media_file.path))
+                    if asset_id:
+                        engine.add_existing(item, asset_id, album_id)
+                    else:
+                        targets.append((engine, album_id))
+            except Exception as e:
+                self.fail(item, e)
+                continue
+            if targets:
+                self.put(self.upload_queue, item._replace(targets=tuple(targets)))
+            else:
+                self.put(self.results, ('existing', item))
+        return []
+
+    def upload_stage(self):
+        try:
+            while (item := self.get(self.upload_queue)) is not DONE:
+                if self.dry_run:
+                    self.put(self.results, ('pending', item))
+                    continue
+                size = item.media_file.stat.st_size
+                self.limiter.acquire(size)
+                started = time.monotonic()
+                try:
+                    ok = self.engine.upload_targets(item)
+                except Exception as e:
+                    self.fail(item, e)
+                    continue
+                finally:
+                    self.limiter.release(size)
+                    self.engine.metrics.observe_upload(time.monotonic() - started)
+                self.put(self.results, ('uploaded' if ok else 'failed', item))
+        finally:
+            self.put(self.results, DONE)
+
+    def async_upload_stage(self):
+        """Hand files to the event loop as the in-flight limit allows, then wait for the last one"""
+        import concurrent.futures
+        session = self.engine.get_session()
+        pending = set()
+        lock = threading.Lock()
+        
+        def finished(future):
+            with lock:
+                pending.discard(future)
+        
+        try:
+            while (item := self.get(self.upload_queue)) is not DONE:
+                size = item.media_file.stat.st_size
+                self.limiter.acquire(size)
+                future = session.submit(self.upload_async(session, item, size))
+                with lock:
+                    pending.add(future)
+                future.add_done_callback(finished)
+        finally:
+            with lock:
+                waiting = list(pending)
+            concurrent.futures.wait(waiting)
+            self.put(self.results, DONE)
+
+    async def upload_async(self, session, item, size):
+        import asyncio
+        started = time.monotonic()
+        try:
+            ok = await self.engine.upload_targets_async(session, item)
+        except Exception as e:
+            self.engine.log(f"Upload failed: {os.path.basename(item.media_file.path)} - {str(e)}")
+            ok = False
+        finally:
+            self.limiter.release(size)
+            self.engine.metrics.observe_upload(time.monotonic() - started)
+        # The results queue may be full; only an executor thread waits for it, not the loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.put, self.results, ('uploaded' if ok else 'failed', item))
+
+
+class FolderJob:
+    """One selected folder's share of a combined upload run"""
+
+    def __init__(self, folder, album_name, album_ids, expected=None, files=None):
+        self.folder = folder
+        self.album_name = album_name
+        # One per server in engine.targets(), None where the album couldn't be made
+        self.album_ids = album_ids
+        self.files = files
+        self.progress = Counter(expected=expected or '?')
+        self.scanned = 0
+        self.finished = 0
+        self.scan_done = False
+        self.ok = None
+
+
+def ordered_files(jobs, order='folders', file_filter=DEFAULT_FILTER):
+    """Yield (job, media_file) for every file of every job in the given order
+
+    'folders' streams each folder in turn and 'round-robin' takes one file from
+    each folder in turn; both start uploading while scanning continues.
+    'smallest-first' and 'newest-first' have to list everything first.
+    """
+    def files_of(job):
+        for media_file in job.files if job.files is not None else scan_media_files(job.folder, file_filter):
+            job.scanned += 1
+            yield job, media_file
+        job.scan_done = True
+    
+    if order == 'round-robin':
+        iterators = [files_of(job) for job in jobs]
+        while iterators:
+            for iterator in list(iterators):
+                try:
+                    yield next(iterator)
+                except StopIteration:
+                    iterators.remove(iterator)
+    elif order in ('smallest-first', 'newest-first'):
+        entries = [entry for job in jobs for entry in files_of(job)]
+        if order == 'smallest-first':
+            entries.sort(key=lambda entry: entry[1].stat.st_size)
+        else:
+            entries.sort(key=lambda entry: entry[1].stat.st_mtime_ns, reverse=True)
+        yield from entries
+    else:
+        for job in jobs:
+            yield from files_of(job)
+
+
+class AlbumBatcher:
+    """Collects uploaded asset ids per album and adds them with one PUT per batch"""
+
+    def __init__(self, flush_fn, batch_size=ALBUM_BATCH_SIZE, max_delay=ALBUM_FLUSH_SECONDS):
+        self.flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.pending = {}
+        self.first_added = {}
+        self.failed = False
+        self.failed_albums = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.timer = threading.Thread(target=self.flush_aged, daemon=True)
+        self.timer.start()
+
+    def add(self, album_id, asset_id):
+        with self.lock:
+            ids = self.pending.setdefault(album_id, [])
+            if not ids:
+                self.first_added[album_id] = time.monotonic()
+            ids.append(asset_id)
+            batch = self.take(album_id) if len(ids) >= self.batch_size else None
+        if batch:
+            self.send(album_id, batch)
+
+    def take(self, album_id):
+        """Remove and return an album's queued ids (lock must be held)"""
+        self.first_added.pop(album_id, None)
+        return self.pending.pop(album_id, [])
+
+    def send(self, album_id, ids):
+        """Send one batch, retrying the whole batch on failure"""
+        for attempt in range(ALBUM_FLUSH_ATTEMPTS):
+            if self.flush_fn(album_id, ids):
+                return True
+            time.sleep(0.5 * 2 ** attempt + random.uniform(0, 0.5))
+        self.failed = True
+        self.failed_albums.add(album_id)
+        return False
+
+    def flush(self, album_id):
+        """Send an album's queued ids now; False if any of its batches failed"""
+        with self.lock:
+            ids = self.take(album_id)
+        if ids:
+            self.send(album_id, ids)
+        return album_id not in self.failed_albums
+
+    def flush_aged(self):
+        while not self.stopped.wait(self.max_delay / 2):
+            now = time.monotonic()
+            with self.lock:
+                aged = [album_id for album_id, added in self.first_added.items()
+                        if now - added >= self.max_delay]
+                batches = [(album_id, self.take(album_id)) for album_id in aged]
+            for album_id, ids in batches:
+                self.send(album_id, ids)
+
+    def close(self):
+        """Stop the timer and send everything still queued; False if any batch failed"""
+        self.stopped.set()
+        self.timer.join()
+        with self.lock:
+            batches = [(album_id, self.take(album_id)) for album_id in list(self.pending)]
+        for album_id, ids in batches:
+            if ids:
+                self.send(album_id, ids)
+        return not self.failed
+
+
+class UploadIndex:
+    """On-disk record of uploaded files so re-runs only send what changed"""
+
+    def __init__(self, db_path, read_only=False):
+        self.lock = threading.Lock()
+        if read_only:
+            # Only looked up (dry runs): the file must exist and is never changed
+            uri = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+            self.db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            return
+        self.db = sqlite3.connect(str(db_path), check_same_thread=False)
+        # WAL keeps per-file commits cheap, so an interrupted run loses nothing
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS files (
+            server_url TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            checksum TEXT,
+            asset_id TEXT,
+            PRIMARY KEY (server_url, path))""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS album_assets (
+            album_id TEXT NOT NULL,
+            asset_id TEXT NOT NULL,
+            PRIMARY KEY (album_id, asset_id))""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS failed (
+            server_url TEXT NOT NULL,
+            path TEXT NOT NULL,
+            album_id TEXT NOT NULL,
+            error TEXT,
+            failed_at TEXT,
+            PRIMARY KEY (server_url, path))""")
+        # Checksums by device and inode, valid for any server and surviving renames
+        self.db.execute("""CREATE TABLE IF NOT EXISTS hashes (
+            file_id TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            checksum TEXT NOT NULL)""")
+        # Capture times read from file headers, NULL when a file has none
+        self.db.execute("""CREATE TABLE IF NOT EXISTS capture_times (
+            file_id TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            captured_at TEXT)""")
+        self.db.commit()
+
+    def lookup(self, server_url, path, st):
+        """Return (checksum, asset_id) if the file is unchanged since it was recorded"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT checksum, asset_id FROM files WHERE server_url = ? AND path = ? "
+                "AND size = ? AND mtime_ns = ?",
+                (server_url, path, st.st_size, st.st_mtime_ns)).fetchone()
+        return row
+
+    def cached_hash(self, file_id, st):
+        """Return the checksum of file_id if its size and mtime haven't changed"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT checksum FROM hashes WHERE file_id = ? AND size = ? AND mtime_ns = ?",
+                (file_id, st.st_size, st.st_mtime_ns)).fetchone()
+        return row[0] if row else None
+
+    def record_hash(self, file_id, st, checksum):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)",
+                            (file_id, st.st_size, st.st_mtime_ns, checksum))
+            self.db.commit()
+
+    def cached_capture_time(self, file_id, st):
+        """Return a (captured_at,) row if file_id was read since it last changed, else None"""
+        with self.lock:
+            return self.db.execute(
+                "SELECT captured_at FROM capture_times WHERE file_id = ? AND size = ? AND mtime_ns = ?",
+                (file_id, st.st_size, st.st_mtime_ns)).fetchone()
+
+    def record_capture_time(self, file_id, st, captured_at):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO capture_times VALUES (?, ?, ?, ?)",
+                            (file_id, st.st_size, st.st_mtime_ns, captured_at))
+            self.db.commit()
+
+    def in_album(self, album_id, asset_id):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT 1 FROM album_assets WHERE album_id = ? AND asset_id = ?",
+                (album_id, asset_id)).fetchone()
+        return row is not None
+
+    def record_file(self, server_url, path, st, checksum, asset_id):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (server_url, path, st.st_size, st.st_mtime_ns, checksum, asset_id))
+            # A file that made it is no longer failed
+            self.db.execute("DELETE FROM failed WHERE server_url = ? AND path = ?",
+                            (server_url, path))
+            self.db.commit()
+
+    def record_failure(self, server_url, path, album_id, error):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO failed VALUES (?, ?, ?, ?, ?)",
+                (server_url, path, album_id, error, datetime.now().isoformat()))
+            self.db.commit()
+
+    def failed_files(self, server_url):
+        """Return [(path, album_id, error)] of uploads that gave up"""
+        with self.lock:
+            return self.db.execute(
+                "SELECT path, album_id, error FROM failed WHERE server_url = ? ORDER BY path",
+                (server_url,)).fetchall()
+
+    def forget_failure(self, server_url, path):
+        with self.lock:
+            self.db.execute("DELETE FROM failed WHERE server_url = ? AND path = ?",
+                            (server_url, path))
+            self.db.commit()
+
+    def record_album(self, album_id, asset_ids):
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO album_assets VALUES (?, ?)",
+                [(album_id, asset_id) for asset_id in asset_ids])
+            self.db.commit()
+
+
+class UploadEngine:
+    """Uploads folders to an Immich server, and to any mirror servers from the same scan
+
+    Progress is reported through two callbacks so any front end can drive it:
+    log(message) for human readable lines and on_event(event, fields) for
+    structured updates ('folder_start', 'file', 'folder_done', 'metrics', 'done').
+    """
+
+    def __init__(self, log=print, on_event=None, config_file=CONFIG_FILE, index_file=INDEX_FILE,
+                 journal_dir=JOURNAL_DIR):
+        self.log = log
+        self.on_event = on_event
+        self.config_file = Path(config_file)
+        self.index_file = Path(index_file) if index_file else None
+        # Job journals for resuming interrupted uploads, None for none
+        self.journal_dir = Path(journal_dir) if journal_dir else None
+        
+        # Settings
+        self.server_url = ""
+        self.api_key = ""
+        self.upload_workers = 4
+        self.max_inflight_mb = 256
+        self.hash_workers = 2
+        self.http_retries = 3
+        # Upload bandwidth in MB/s and requests per second, 0 for no limit
+        self.max_upload_mbps = 0
+        self.max_requests_per_second = 0
+        # Let upload_workers be the ceiling and adjust to how the server copes
+        self.adaptive_concurrency = False
+        # Serve Prometheus metrics on this localhost port, 0 for off
+        self.metrics_port = 0
+        # One of UPLOAD_ORDERS
+        self.upload_order = 'folders'
+        # One of UPLOAD_TRANSPORTS
+        self.transport = 'threads'
+        # Other servers every file also goes to: [{'name', 'server_url', 'api_key'}]
+        self.mirror_servers = []
+        # Which files are uploaded, as saved: see FileFilter.from_config
+        self.filters = {}
+        
+        # State
+        self.dry_run = False
+        self.session = None
+        self.session_lock = threading.Lock()
+        self.album_cache = None
+        self.album_lock = threading.Lock()
+        # Stale album id → the id of the album that replaced it on the server
+        self.moved_albums = {}
+        self.album_replace_lock = threading.Lock()
+        self.album_batcher = None
+        self.index = None
+        # The compiled filters
+        self.file_filter = DEFAULT_FILTER
+        # JobJournal of the running upload_folders job
+        self.journal = None
+        self.retry = RetryScheduler()
+        self.rate_limiter = RateLimiter()
+        self.concurrency = None
+        self.metrics = UploadMetrics()
+        self.metrics_server = None
+        # An UploadEngine per mirror server
+        self.mirrors = []
+    
+    def emit(self, event, **fields):
+        """Send a structured progress event to the front end"""
+        if self.on_event:
+            self.on_event(event, fields)
+    
+    def load_config(self):
+        """Load saved configuration, logging and skipping any setting that can't be used"""
+        if not self.config_file.exists():
+            return
+        try:
+            with open(self.config_file, 'r') as f:
+                config = json.load(f)
+            if not isinstance(config, dict):
+                raise ValueError("expected a JSON object")
+        except (OSError, ValueError) as e:
+            self.log(f"Could not read settings from {self.config_file}: {str(e)}")
+            return
+        
+        self.server_url = self.config_value(config, 'server_url', str, self.server_url)
+        self.api_key = self.config_value(config, 'api_key', str, self.api_key)
+        self.upload_workers = self.config_value(config, 'upload_workers', int, self.upload_workers)
+        self.max_inflight_mb = self.config_value(config, 'max_inflight_mb', int, self.max_inflight_mb)
+        self.http_retries = self.config_value(config, 'http_retries', int, self.http_retries)
+        self.hash_workers = self.config_value(config, 'hash_workers', int, self.hash_workers)
+        self.max_upload_mbps = self.config_value(config, 'max_upload_mbps', float, self.max_upload_mbps)
+        self.max_requests_per_second = self.config_value(config, 'max_requests_per_second', float,
+                                                         self.max_requests_per_second)
+        self.adaptive_concurrency = self.config_value(config, 'adaptive_concurrency', bool,
+                                                      self.adaptive_concurrency)
+        self.metrics_port = self.config_value(config, 'metrics_port', int, self.metrics_port)
+        self.upload_order = self.config_value(config, 'upload_order', choice(UPLOAD_ORDERS), self.upload_order)
+        self.transport = self.config_value(config, 'transport', choice(UPLOAD_TRANSPORTS), self.transport)
+        
+        mirrors = config.get('mirrors', [])
+        if isinstance(mirrors, list) and all(isinstance(server, dict) for server in mirrors):
+            self.set_mirrors(mirrors)
+        else:
+            self.log("Ignoring the saved mirrors setting: expected a list of servers")
+        try:
+            self.set_filters(config.get('filters', {}))
+        except ValueError as e:
+            self.log(f"Ignoring the saved file filters: {str(e)}")
+    
+    def config_value(self, config, key, convert, default):
+        """A saved setting passed through convert, or default (and a log line) if it doesn't fit"""
+        if key not in config:
+            return default
+        try:
+            return convert(config[key])
+        except (TypeError, ValueError) as e:
+            self.log(f"Ignoring the saved {key} setting: {str(e)}")
+            return default
+    
+    def save_config(self):
+        """Save configuration"""
+        config = {
+            'server_url': self.server_url,
+            'api_key': self.api_key,
+            'upload_workers': self.upload_workers,
+            'max_inflight_mb': self.max_inflight_mb,
+            'http_retries': self.http_retries,
+            'hash_workers': self.hash_workers,
+            'max_upload_mbps': self.max_upload_mbps,
+            'max_requests_per_second': self.max_requests_per_second,
+            'adaptive_concurrency': self.adaptive_concurrency,
+            'metrics_port': self.metrics_port,
+            'upload_order': self.upload_order,
+            'transport': self.transport,
+            'mirrors': self.mirror_servers,
+            'filters': self.filters
+        }
+        with open(self.config_file, 'w') as f:
+            json.dump(config, f)
+    
+    def set_limits(self, max_upload_mbps, max_requests_per_second):
+        """Change the bandwidth and request rate limits, also during a run"""
+        self.max_upload_mbps = max(0, max_upload_mbps)
+        self.max_requests_per_second = max(0, max_requests_per_second)
+        self.rate_limiter.set_limits(self.max_upload_mbps * 1024 * 1024, self.max_requests_per_second)
+    
+    def start_metrics_server(self, port=None, host='127.0.0.1'):
+        """Serve Prometheus metrics at http://host:port/metrics, returning False if it can't"""
+        port = self.metrics_port if port is None else port
+        if not port or self.metrics_server:
+            return bool(self.metrics_server)
+        try:
+            self.metrics_server = serve_metrics(self.metrics, port, host)
+        except OSError as e:
+            self.log(f"Could not serve metrics on port {port}: {str(e)}")
+            return False
+        self.log(f"Serving metrics at http://{host}:{port}/metrics")
+        return True
+    
+    def dump_metrics(self, path):
+        """Write the last run's metrics to a JSON file"""
+        with open(path, 'w') as f:
+            json.dump(self.metrics.snapshot(), f, indent=2)
+    
+    def open_index(self):
+        """Open the upload index (uploads still work without it)
+
+        A dry run only reads an existing index and doesn't create one.
+        """
+        if self.index or not self.index_file:
+            return
+        if self.dry_run and not self.index_file.exists():
+            return
+        try:
+            self.index = UploadIndex(self.index_file, read_only=self.dry_run)
+        except sqlite3.Error as e:
+            self.log(f"Upload index unavailable: {str(e)}")
+            self.index = None
+    
+    def create_session(self, api_key):
+        """Create a keep-alive HTTP session pooled for the upload workers"""
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        
+        session = requests.Session()
+        session.headers['x-api-key'] = api_key
+        
+        # Connection failures are retried for every method, bad gateway
+        # responses only for idempotent calls (uploads are not resent blindly)
+        retry = Retry(total=self.http_retries, backoff_factor=0.5,
+                      status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset({'GET', 'PUT'}),
+                      raise_on_status=False)
+        # Each worker holds one connection for /assets and reuses it for the album PUT
+        pool_size = self.upload_workers + 2
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=retry, pool_block=True)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.pool_size = pool_size
+        session.transport = 'threads'
+        # Failures of the connection itself, worth retrying (the async session has its own)
+        session.network_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                                  requests.exceptions.ChunkedEncodingError)
+        # Every response feeds the latency histograms
+        session.hooks['response'].append(self.metrics.on_response)
+        return session
+    
+    def get_session(self):
+        """Return the shared session, rebuilding it if the pool size or transport changed"""
+        with self.session_lock:
+            if (self.session is None or self.session.pool_size != self.upload_workers + 2 or
+                    getattr(self.session, 'transport', 'threads') != self.transport):
+                if self.session is not None:
+                    self.session.close()
+                if self.transport == 'async':
+                    from immich_async import AsyncSession
+                    self.session = AsyncSession(self.api_key, self.upload_workers + 2, self.metrics)
+                else:
+                    self.session = self.create_session(self.api_key)
+            return self.session
+    
+    def set_server(self, server_url, api_key, session=None):
+        """Switch to another server, optionally keeping an already tested session"""
+        with self.session_lock:
+            if self.session is not None and self.session is not session:
+                self.session.close()
+            self.server_url = server_url.rstrip('/')
+            self.api_key = api_key
+            self.session = session
+        self.album_cache = None
+        self.moved_albums = {}
+    
+    def set_mirrors(self, mirror_servers):
+        """Also upload everything to these servers, given as [{'name', 'server_url', 'api_key'}]"""
+        for mirror in self.mirrors:
+            mirror.set_server('', '')
+        self.mirror_servers = [dict(server) for server in mirror_servers
+                               if server.get('server_url') and server.get('api_key')]
+        self.mirrors = [self.new_mirror(server) for server in self.mirror_servers]
+    
+    def set_filters(self, filters):
+        """Upload only the files these rules allow, raising ValueError for a bad pattern, size or date"""
+        self.file_filter = FileFilter.from_config(filters)
+        self.filters = dict(filters)
+    
+    def new_mirror(self, server):
+        """An engine for one mirror server that logs with its name in front"""
+        name = server.get('name') or server['server_url']
+        # Progress events come from the uploads to this server only
+        mirror = UploadEngine(log=lambda message: self.log(f"[{name}] {message}"),
+                              config_file=self.config_file, index_file=None, journal_dir=None)
+        # Limits and measurements cover everything sent, whichever server it goes to
+        mirror.rate_limiter = self.rate_limiter
+        mirror.metrics = self.metrics
+        mirror.set_server(server['server_url'], server['api_key'])
+        return mirror
+    
+    def targets(self):
+        """Every server a run uploads to: this one, then the mirrors"""
+        return [self] + self.mirrors
+    
+    def prepare_mirrors(self):
+        """Give the mirrors this engine's index and run settings"""
+        for mirror in self.mirrors:
+            mirror.index = self.index
+            mirror.journal = self.journal
+            mirror.dry_run = self.dry_run
+            mirror.upload_workers = self.upload_workers
+            mirror.transport = self.transport
+            mirror.http_retries = self.http_retries
+    
+    def count_media_files(self, folder_path, on_progress=None, cancel=None):
+        """Count media files in folder, or None if cancel is set before the count is done
+
+        on_progress(count) gets the running total every COUNT_PROGRESS_SECONDS.
+        """
+        count = 0
+        reported = time.monotonic()
+        for _ in media_entries(folder_path, self.file_filter):
+            if cancel and cancel.is_set():
+                return None
+            count += 1
+            if on_progress and time.monotonic() - reported >= COUNT_PROGRESS_SECONDS:
+                reported = time.monotonic()
+                on_progress(count)
+        return count
+    
+    def upload_folders(self, folders, album_name=None, check_duplicates=True,
+                       expected_counts=None, files_by_folder=None):
+        """Upload folders as one job, returning (successful, failed) folder counts
+
+        Each folder goes to an album named after it unless album_name is given.
+        Files of all folders share one pipeline, merged as upload_order says,
+        so a huge folder doesn't hold up small ones and the workers stay busy
+        until the whole job ends. files_by_folder maps a folder to the
+        MediaFiles to send instead of scanning it (used by watch mode).
+        
+        Unless files are given, the job keeps a journal in journal_dir, so
+        resume_job() can finish it if this run is cut short.
+        """
+        total_folders = len(folders)
+        expected_counts = expected_counts or {}
+        if self.journal is None and files_by_folder is None:
+            self.journal = self.start_journal(folders, album_name, check_duplicates)
+        files_by_folder = files_by_folder or {}
+        fail_count = 0
+        
+        self.open_index()
+        self.prepare_mirrors()
+        self.metrics.reset()
+        
+        jobs = []
+        for i, folder_path in enumerate(folders):
+            folder_name = os.path.basename(os.path.normpath(folder_path))
+            folder_album = album_name or folder_name
+            
+            self.emit('folder_start', folder=folder_path, album=folder_album,
+                      index=i, total=total_folders)
+            self.log(f"Starting upload: {folder_name} → Album: {folder_album}")
+            
+            # A server without the album is left out of this folder, the others still get it
+            album_ids = []
+            for target in self.targets():
+                album_id = target.get_or_create_album(folder_album)
+                if not album_id:
+                    target.log(f"Failed to create/find album: {folder_album}")
+                album_ids.append(album_id)
+            if not any(album_ids):
+                self.log(f"✗ Failed to upload {folder_name}")
+                fail_count += 1
+                self.emit('folder_done', folder=folder_path, album=folder_album, ok=False)
+                continue
+            files = files_by_folder.get(folder_path)
+            if self.journal:
+                files = self.journaled_files(folder_path, files)
+            jobs.append(FolderJob(folder_path, folder_album, album_ids,
+                                  expected_counts.get(folder_path), files))
+        
+        # Only cleared when upload_jobs returns normally: Ctrl+C or any other
+        # exception leaves the journal on disk for resume_job() and is re-raised
+        error = True
+        try:
+            error = self.upload_jobs(jobs, check_duplicates) if jobs else False
+        finally:
+            if self.journal:
+                # An interrupted job is left to resume; a finished one, failures and all, is done
+                self.journal.close(complete=not error)
+                self.journal = None
+        success_count = sum(1 for job in jobs if job.ok)
+        fail_count += len(jobs) - success_count
+        
+        self.metrics.finish()
+        self.emit('metrics', **self.metrics.snapshot())
+        self.emit('done', success=success_count, failed=fail_count)
+        return success_count, fail_count
+    
+    def upload_jobs(self, jobs, check_duplicates=True):
+        """Send the files of all jobs through one pipeline, finishing each job with its last file
+
+        Returns True if the pipeline broke down before every file was done.
+        """
+        def sources():
+            for job, media_file in ordered_files(jobs, self.upload_order, self.file_filter):
+                yield media_file, job.album_ids, job
+        
+        def on_result(status, item):
+            # The job travels with the file, so a path under two selected folders counts for each
+            job = item.job
+            self.record_step('finished', path=item.media_file.path, status=status)
+            job.finished += 1
+            self.report_result(status, item, job.progress, job.folder)
+            if job.scan_done and job.finished == job.scanned:
+                self.finish_job(job)
+        
+        # Stays set unless the pipeline runs to the end, so an interrupt (Ctrl+C)
+        # doesn't report the folders it cut short as uploaded
+        error = True
+        targets = self.targets()
+        for target in targets:
+            target.album_batcher = AlbumBatcher(target.add_to_album)
+        try:
+            # Scanning, hashing, checking and uploading all run at once
+            pipeline = self.new_pipeline(check_duplicates)
+            pipeline.run(sources(), on_result)
+            error = False
+        except Exception as e:
+            self.log(f"Error uploading folders: {str(e)}")
+        finally:
+            # Empty folders, any whose last file beat the end of its scan, and
+            # after an error the ones that never finished
+            for job in jobs:
+                if job.ok is None:
+                    self.finish_job(job, error)
+            for target in targets:
+                target.album_batcher.close()
+                target.album_batcher = None
+        return error
+    
+    def finish_job(self, job, error=False):
+        """Log a folder's totals, send its album updates and report it done"""
+        progress = job.progress
+        folder_name = os.path.basename(os.path.normpath(job.folder))
+        found_count = sum(progress[status] for status in ('indexed', 'existing', 'uploaded',
+                                                          'failed', 'pending'))
+        self.log(f"{folder_name}: found {found_count} media files")
+        if progress['indexed']:
+            self.log(f"{folder_name}: skipped {progress['indexed']} unchanged files from previous uploads")
+        if progress['existing']:
+            self.log(f"{folder_name}: skipped {progress['existing']} files already on the server")
+        
+        job.ok = not error
+        if self.dry_run:
+            self.log(f"Dry run: {progress['pending']}/{found_count} files would be uploaded "
+                     f"to album '{job.album_name}'")
+        else:
+            uploaded_count = found_count - progress['failed']
+            self.log(f"Uploaded {uploaded_count}/{found_count} files to album '{job.album_name}'")
+            for target, album_id in zip(self.targets(), job.album_ids):
+                if album_id is None:
+                    job.ok = False
+                elif not target.album_batcher.flush(album_id):
+                    target.log(f"Some files could not be added to album '{job.album_name}'")
+                    job.ok = False
+        
+        if job.ok:
+            self.log(f"✓ Successfully uploaded {folder_name}")
+        else:
+            self.log(f"✗ Failed to upload {folder_name}")
+        progress.pop('expected')
+        self.emit('folder_done', folder=job.folder, album=job.album_name, ok=job.ok, **progress)
+    
+    def start_journal(self, folders, album_name, check_duplicates):
+        """A JobJournal for a new job, or None if journals are off or can't be written"""
+        if not self.journal_dir or self.dry_run:
+            return None
+        try:
+            return JobJournal.create(self.journal_dir, folders, album_name, check_duplicates)
+        except OSError as e:
+            self.log(f"Job journal unavailable, this upload can't be resumed: {str(e)}")
+            return None
+    
+    def record_step(self, step, **fields):
+        """Add a step of the running job to its journal, if it keeps one"""
+        if self.journal:
+            self.journal.record(step, **fields)
+    
+    def journaled_files(self, folder, files=None):
+        """Yield the files of folder (scanning it unless given), recording each in the journal"""
+        for media_file in scan_media_files(folder, self.file_filter) if files is None else files:
+            self.record_step('scanned', path=media_file.path, folder=folder,
+                             size=media_file.stat.st_size, mtime_ns=media_file.stat.st_mtime_ns)
+            yield media_file
+        self.record_step('scan_done', folder=folder)
+    
+    def interrupted_job(self):
+        """The journal of the newest job that was cut short and no other run is resuming, or None
+        
+        The journal stays locked by this engine until resume_job() or discard_job() is called.
+        """
+        if not self.journal_dir:
+            return None
+        return interrupted_job(self.journal_dir)
+    
+    def discard_job(self, journal):
+        """Forget an interrupted job instead of resuming it"""
+        journal.close(complete=True)
+    
+    def resume_job(self, journal):
+        """Finish an interrupted job, returning (successful, failed) folder counts
+
+        Files the journal has as done are skipped without touching the disk or
+        the server, checksums it recorded aren't computed again, and folders
+        it finished scanning aren't scanned again.
+        """
+        header = journal.header
+        folders, recorded, finished = journal.summary()
+        self.log(f"Resuming the upload of {folders} folders started {header['started']}: "
+                 f"{finished} of {recorded} files seen so far were done")
+        self.journal = journal
+        files_by_folder = {folder: self.resumed_files(journal, folder) for folder in header['folders']}
+        expected_counts = {folder: len(journal.files_in(folder)) for folder in header['folders']
+                           if folder in journal.scanned_folders}
+        return self.upload_folders(header['folders'], header['album_name'], header['check_duplicates'],
+                                   expected_counts, files_by_folder)
+    
+    def resumed_files(self, journal, folder):
+        """Yield a resumed job's files of folder: the recorded ones, then any its scan hadn't reached"""
+        for path, entry in journal.files_in(folder):
+            if entry['status'] in DONE_STATUSES:
+                yield MediaFile(path, recorded_stat(entry['size'], entry['mtime_ns']))
+                continue
+            try:
+                yield MediaFile(path, os.stat(path))
+            except OSError:
+                # Gone since, nothing to upload
+                continue
+        if folder not in journal.scanned_folders:
+            for media_file in scan_media_files(folder, self.file_filter):
+                if media_file.path not in journal.files:
+                    yield media_file
+    
+    def new_pipeline(self, check_duplicates):
+        """Build an upload pipeline with the current limits applied"""
+        self.set_limits(self.max_upload_mbps, self.max_requests_per_second)
+        pipeline = UploadPipeline(self, self.hash_workers, self.upload_workers,
+                                  self.max_inflight_mb * 1024 * 1024,
+                                  check_duplicates, self.dry_run, self.transport == 'async')
+        self.metrics.watch(pipeline)
+        self.concurrency = None
+        if self.adaptive_concurrency:
+            self.concurrency = AdaptiveConcurrency(
+                pipeline.limiter, self.upload_workers,
+                on_change=lambda limit: self.emit('concurrency', limit=limit))
+        # Mirror uploads count towards the same in-flight limit
+        for mirror in self.mirrors:
+            mirror.concurrency = self.concurrency
+        return pipeline
+    
+    def report_result(self, status, item, progress, folder=None):
+        """Count a finished file and log progress"""
+        progress[status] += 1
+        self.emit('file', status=status, path=item.media_file.path,
+                  size=item.media_file.stat.st_size, folder=folder)
+        if status == 'failed':
+            self.log(f"✗ {os.path.basename(item.media_file.path)}")
+        elif status == 'uploaded' and progress['uploaded'] % 10 == 0:
+            prefix = f"{os.path.basename(os.path.normpath(folder))}: " if folder else ""
+            self.log(f"{prefix}Uploaded {progress['uploaded']}/{progress['expected']} files...")
+    
+    def indexed_state(self, media_file, album_id):
+        """Return (already uploaded, known checksum) from the job journal or the upload index"""
+        known = None
+        if self.journal:
+            server_url = self.server_url.rstrip('/')
+            asset_id = self.journal.asset_id(server_url, media_file.path, media_file.stat)
+            known = self.journal.checksum(media_file.path, media_file.stat)
+            if asset_id:
+                # Uploaded before the job was interrupted
+                if not self.journal.in_album(server_url, album_id, asset_id):
+                    self.album_batcher.add(album_id, asset_id)
+                return True, known
+        if not self.index:
+            return False, known
+        row = self.index.lookup(self.server_url.rstrip('/'), media_file.path, media_file.stat)
+        if row is None:
+            return False, known
+        
+        checksum, asset_id = row
+        if not asset_id:
+            return False, checksum
+        if not self.index.in_album(album_id, asset_id):
+            self.album_batcher.add(album_id, asset_id)
+        return True, checksum
+    
+    def check_existing(self, items):
+        """Map path → asset id for files the server already has, or None if the check is unavailable"""
+        assets = self.check_assets(items)
+        if not assets:
+            return {}
+        
+        try:
+            session = self.get_session()
+            self.rate_limiter.request()
+            response = session.post(f"{self.server_url.rstrip('/')}/assets/bulk-upload-check",
+                                    json={'assets': assets}, timeout=30)
+            return self.existing_from(response)
+        except Exception as e:
+            return self.check_unavailable(e)
+    
+    async def check_existing_async(self, session, items):
+        """check_existing from the event loop of an AsyncSession"""
+        import asyncio
+        assets = self.check_assets(items)
+        if not assets:
+            return {}
+        
+        try:
+            await asyncio.sleep(self.rate_limiter.request_delay())
+            response = await session.request('POST', f"{self.server_url.rstrip('/')}/assets/bulk-upload-check",
+                                             json={'assets': assets}, timeout=30)
+            return self.existing_from(response)
+        except Exception as e:
+            return self.check_unavailable(e)
+    
+    def check_assets(self, items):
+        """bulk-upload-check entries for the items whose checksum is known"""
+        return [{'id': item.media_file.path, 'checksum': item.checksum}
+                for item in items if item.checksum]
+    
+    def existing_from(self, response):
+        """Path → asset id of the files a bulk-upload-check response rejected as duplicates
+
+        Raises unless the server answered 200 with the expected JSON; a
+        proxy's login page can come back as a 200 too.
+        """
+        if response.status_code != 200:
+            raise RuntimeError(f"server returned {response.status_code}")
+        return {result.get('id'): result.get('assetId')
+                for result in response.json().get('results', [])
+                if result.get('action') == 'reject' and result.get('assetId')}
+    
+    def check_unavailable(self, error):
+        """Log why the duplicate check failed and return the None check_existing gives for it"""
+        self.log(f"Duplicate check unavailable ({str(error)}), uploading remaining files")
+        return None
+    
+    def add_existing(self, item, asset_id, album_id):
+        """Record a file the server already has and add it to the album"""
+        self.record_upload(item.media_file.path, item.checksum, asset_id, item.media_file.stat)
+        # Duplicates still belong in this folder's album
+        self.album_batcher.add(album_id, asset_id)
+    
+    def add_to_album(self, album_id, asset_ids):
+        """Add assets to an album in batches"""
+        if self.dry_run:
+            return True
+        session = self.get_session()
+        server_url = self.server_url.rstrip('/')
+        ok = True
+        with self.album_lock:
+            album_id = self.moved_albums.get(album_id, album_id)
+        
+        for start in range(0, len(asset_ids), ALBUM_BATCH_SIZE):
+            ids = asset_ids[start:start + ALBUM_BATCH_SIZE]
+            try:
+                self.rate_limiter.request()
+                response = session.put(f"{server_url}/albums/{album_id}/assets",
+                                       json={'ids': ids}, timeout=30)
+                if response.status_code in [400, 404]:
+                    # Deleted on the server since the album list was loaded: find or make it again
+                    new_id = self.replace_album(album_id)
+                    if new_id:
+                        album_id = new_id
+                        self.rate_limiter.request()
+                        response = session.put(f"{server_url}/albums/{album_id}/assets",
+                                               json={'ids': ids}, timeout=30)
+                if response.status_code in [200, 201]:
+                    self.record_step('album', server=server_url, album_id=album_id, asset_ids=ids)
+                    if self.index:
+                        self.index.record_album(album_id, ids)
+                else:
+                    self.log(f"Error adding files to album: {response.status_code}")
+                    ok = False
+            except Exception as e:
+                self.log(f"Error adding files to album: {str(e)}")
+                ok = False
+        return ok
+    
+    def record_upload(self, file_path, checksum, asset_id, st):
+        """Remember an uploaded file in the index and the job journal"""
+        if self.dry_run:
+            return
+        self.record_step('uploaded', server=self.server_url.rstrip('/'), path=file_path, asset_id=asset_id)
+        if not self.index:
+            return
+        try:
+            self.index.record_file(self.server_url.rstrip('/'), file_path,
+                                   st, checksum, asset_id)
+            file_id = self.file_id(file_path, st)
+            if checksum and file_id:
+                self.index.record_hash(file_id, st, checksum)
+        except (OSError, sqlite3.Error) as e:
+            self.log(f"Error updating upload index: {str(e)}")
+    
+    def record_failure(self, file_path, album_id, error):
+        """Park a file that gave up in the failed list for a later retry_failed()"""
+        if not self.index or self.dry_run:
+            return
+        try:
+            self.index.record_failure(self.server_url.rstrip('/'), file_path, album_id, error)
+        except sqlite3.Error as e:
+            self.log(f"Error updating upload index: {str(e)}")
+    
+    def failed_files(self):
+        """Uploads that gave up on this server, as [(path, album_id, error)]"""
+        self.open_index()
+        if not self.index:
+            return []
+        return self.index.failed_files(self.server_url.rstrip('/'))
+    
+    def forget_failure(self, file_path):
+        """Take a file off this server's failed list"""
+        if self.index:
+            self.index.forget_failure(self.server_url.rstrip('/'), file_path)
+    
+    def failed_count(self):
+        """Files waiting to be retried on this server or any mirror"""
+        self.open_index()
+        self.prepare_mirrors()
+        return len({path for target in self.targets() for path, album_id, error in target.failed_files()})
+    
+    def retry_failed(self, check_duplicates=True):
+        """Upload only the files in the failed list, returning (uploaded, still failed)
+
+        A file that failed on some servers is only sent again to those.
+        """
+        self.open_index()
+        self.prepare_mirrors()
+        self.metrics.reset()
+        targets = self.targets()
+        # path → album per server, None where it didn't fail
+        failed = {}
+        for i, target in enumerate(targets):
+            for path, album_id, error in target.failed_files():
+                failed.setdefault(path, [None] * len(targets))[i] = album_id
+        sources = []
+        for path, album_ids in sorted(failed.items()):
+            try:
+                sources.append((MediaFile(path, os.stat(path)), album_ids, None))
+            except OSError:
+                # Gone from disk, nothing left to retry
+                self.log(f"Dropping {path} from the failed list: file no longer exists")
+                for target in targets:
+                    target.forget_failure(path)
+        
+        self.log(f"Retrying {len(sources)} failed uploads")
+        self.emit('folder_start', folder='(failed uploads)', album=None, index=0, total=1)
+        progress = Counter(expected=len(sources))
+        for target in targets:
+            target.album_batcher = AlbumBatcher(target.add_to_album)
+        try:
+            pipeline = self.new_pipeline(check_duplicates)
+            
+            def on_result(status, item):
+                # Uploaded since it failed (e.g. by a later folder run)
+                if status == 'indexed':
+                    for target in targets:
+                        target.forget_failure(item.media_file.path)
+                self.report_result(status, item, progress)
+            
+            pipeline.run(iter(sources), on_result)
+            for target in targets:
+                if not target.album_batcher.close():
+                    target.log("Some files could not be added to their albums")
+        finally:
+            for target in targets:
+                target.album_batcher = None
+        
+        uploaded = len(sources) - progress['failed'] - progress['pending']
+        self.log(f"Retried {len(sources)} files: {uploaded} done, {progress['failed']} still failing")
+        progress.pop('expected')
+        self.emit('folder_done', folder='(failed uploads)', album=None,
+                  ok=not progress['failed'], **progress)
+        self.metrics.finish()
+        self.emit('metrics', **self.metrics.snapshot())
+        self.emit('done', success=uploaded, failed=progress['failed'])
+        return uploaded, progress['failed']
+    
+    def forget_albums(self):
+        """Have the next album lookup on every server load the album list again"""
+        for target in self.targets():
+            with target.album_lock:
+                target.album_cache = None
+    
+    def refresh_albums(self):
+        """Reload the album name → id cache from the server
+
+        The list is loaded once per connection (set_server clears it) and
+        kept up to date as albums are created, so watch mode and repeated
+        runs don't download it for every batch. It is loaded again for each
+        GUI run (forget_albums) and when an album turns out to be gone
+        (replace_album).
+        """
+        session = self.get_session()
+        server_url = self.server_url.rstrip('/')
+        
+        response = session.get(f"{server_url}/albums", timeout=30)
+        if response.status_code != 200:
+            self.log(f"Could not list albums: {response.status_code}")
+            return False
+        
+        albums = {}
+        for album in response.json():
+            # Keep the first album when names repeat, as the old linear scan did
+            albums.setdefault(album.get('albumName'), album.get('id'))
+        with self.album_lock:
+            self.album_cache = albums
+        return True
+    
+    def replace_album(self, album_id):
+        """The id of the album with the name a stale album_id had, found or created again, or None"""
+        with self.album_replace_lock:
+            with self.album_lock:
+                if album_id in self.moved_albums:
+                    # Another batch for the same album got here first
+                    return self.moved_albums[album_id]
+                names = [name for name, cached_id in (self.album_cache or {}).items() if cached_id == album_id]
+                for name in names:
+                    del self.album_cache[name]
+            if not names:
+                return None
+            self.log(f"Album '{names[0]}' is gone from the server, looking it up again")
+            self.refresh_albums()
+            new_id = self.get_or_create_album(names[0])
+            if not new_id or new_id == album_id:
+                return None
+            with self.album_lock:
+                self.moved_albums[album_id] = new_id
+            return new_id
+    
+    def get_or_create_album(self, album_name):
+        """Get existing album or create new one"""
+        try:
+            session = self.get_session()
+            server_url = self.server_url.rstrip('/')
+            
+            # Try to find existing album
+            if self.album_cache is None:
+                self.refresh_albums()
+            with self.album_lock:
+                album_id = (self.album_cache or {}).get(album_name)
+            if album_id:
+                return album_id
+            
+            if self.dry_run:
+                self.log(f"Dry run: album '{album_name}' would be created")
+                return f"new:{album_name}"
+            
+            # Create new album
+            data = {'albumName': album_name}
+            response = session.post(f"{server_url}/albums", json=data, timeout=10)
+            if response.status_code == 201:
+                album_id = response.json().get('id')
+                with self.album_lock:
+                    if self.album_cache is not None:
+                        self.album_cache[album_name] = album_id
+                return album_id
+            
+            return None
+        except Exception as e:
+            self.log(f"Error with album: {str(e)}")
+            return None
+    
+    def open_tee(self, item):
+        """A FileTee for sending item to all its targets at once, or None to read it per upload"""
+        if len(item.targets) < 2:
+            return None
+        try:
+            return FileTee(item.media_file.path, len(item.targets))
+        except OSError:
+            # Each upload reports the error itself
+            return None
+    
+    def upload_targets(self, item):
+        """Upload a file to every server in item.targets at once, reading it from disk once
+
+        The first server's upload runs on this thread. True if every server took the file.
+        """
+        tee = self.open_tee(item)
+        results = [False] * len(item.targets)
+        
+        def upload(i):
+            engine, album_id = item.targets[i]
+            source = tee.reader(i) if tee else None
+            try:
+                results[i] = engine.upload_file(item.media_file.path, album_id, item.checksum,
+                                                item.media_file.stat, item.created_at, source)
+            finally:
+                if source:
+                    source.close()
+        
+        threads = [threading.Thread(target=upload, args=(i,), daemon=True)
+                   for i in range(1, len(item.targets))]
+        for thread in threads:
+            thread.start()
+        upload(0)
+        for thread in threads:
+            thread.join()
+        return all(results)
+    
+    async def upload_targets_async(self, session, item):
+        """upload_targets on this engine's event loop; each mirror's upload runs on its own loop"""
+        import asyncio
+        tee = self.open_tee(item)
+        sources = [tee.reader(i) if tee else None for i in range(len(item.targets))]
+        uploads = []
+        for (engine, album_id), source in zip(item.targets, sources):
+            target_session = session if engine is self else engine.get_session()
+            upload = engine.upload_file_async(target_session, item.media_file.path, album_id,
+                                              item.checksum, item.media_file.stat, item.created_at,
+                                              source)
+            if target_session is not session:
+                upload = asyncio.wrap_future(target_session.submit(upload))
+            uploads.append(upload)
+        try:
+            results = await asyncio.gather(*uploads)
+        finally:
+            for source in sources:
+                if source:
+                    source.close()
+        return all(results)
+    
+    def upload_file(self, file_path, album_id, checksum=None, st=None, created_at=None, source=None):
+        """Upload a single file, retrying transient failures
+
+        source is a TeeReader to take the first attempt's bytes from.
+        """
+        for attempt in range(self.retry.attempts):
+            try:
+                if st is None:
+                    st = os.stat(file_path)
+                if created_at is None:
+                    created_at = self.file_created_at(MediaFile(file_path, st))
+                
+                self.retry.wait_turn()
+                self.rate_limiter.request()
+                started = time.monotonic()
+                asset_id, checksum = self.upload_stream(file_path, checksum, st, created_at, source)
+                if self.concurrency:
+                    self.concurrency.on_success(time.monotonic() - started, st.st_size)
+                
+                if asset_id:
+                    self.record_upload(file_path, checksum, asset_id, st)
+                    # Album membership is sent in batches
+                    self.album_batcher.add(album_id, asset_id)
+                return True
+            
+            except UploadError as e:
+                error = e
+            except Exception as e:
+                error = UploadError(str(e))
+            
+            if source:
+                # Other servers' uploads go on without this one, and a retry reads the file itself
+                source.close()
+                source = None
+            delay = self.retry_delay(attempt, error, file_path)
+            if delay is None:
+                break
+            time.sleep(delay)
+        
+        self.record_failure(file_path, album_id, str(error))
+        return False
+    
+    def retry_delay(self, attempt, error, file_path):
+        """Seconds to wait before retrying a failed upload attempt, or None to give up
+
+        Used by both transports. Only transient errors are retried; they also
+        slow adaptive concurrency down, and a Retry-After from the server
+        holds every worker back (see RetryScheduler).
+        """
+        if error.transient and self.concurrency:
+            self.concurrency.on_error()
+        if not error.transient or attempt + 1 == self.retry.attempts:
+            self.log(f"Upload failed: {os.path.basename(file_path)} - {str(error)}")
+            return None
+        self.metrics.count_retry()
+        self.log(f"Retrying {os.path.basename(file_path)} after error ({str(error)[:100]})")
+        return self.retry.backoff_delay(attempt, error)
+    
+    def asset_form_data(self, file_path, st, created_at):
+        """Form fields sent with an asset upload"""
+        file_name = os.path.basename(file_path)
+        return {
+            'deviceAssetId': f"{file_name}-{st.st_mtime}",
+            'deviceId': 'ImmichUploader',
+            'fileCreatedAt': created_at,
+            'fileModifiedAt': utc_timestamp(datetime.fromtimestamp(st.st_mtime, timezone.utc)),
+        }
+    
+    def upload_request(self, file_path, checksum, st, created_at, source=None, throttle=None):
+        """(MultipartFileBody, headers, timeout) of an asset upload, for either transport"""
+        import mimetypes
+        mime_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        large = st.st_size >= LARGE_FILE_BYTES
+        
+        def on_progress(sent, size):
+            self.emit('file_progress', path=file_path, sent=sent, size=size)
+        
+        body = MultipartFileBody(file_path, st.st_size, self.asset_form_data(file_path, st, created_at),
+                                 'assetData', mime_type, on_progress if large else None,
+                                 throttle=throttle, source=source)
+        headers = {'Content-Type': body.content_type}
+        # A known checksum lets the server reject duplicates before reading the body
+        if checksum:
+            headers['x-immich-checksum'] = checksum
+        return body, headers, (10, LARGE_FILE_READ_TIMEOUT if large else 120)
+    
+    def asset_id_from(self, response):
+        """Asset id of a finished upload ('' for a duplicate), raising UploadError on failure"""
+        if response.status_code in [200, 201]:
+            return response.json().get('id') or ''
+        elif response.status_code == 409:
+            # Duplicate - that's okay if we're skipping
+            return ''
+        raise upload_error_from(response)
+    
+    def lost_upload(self, body, file_path, checksum, st):
+        """The item to look up on the server after a failed attempt that sent the whole body, else None
+
+        The server may have stored the file with only its answer lost.
+        """
+        if not body.complete:
+            return None
+        return UploadItem(MediaFile(file_path, st), None, checksum or body.sha1.hexdigest())
+    
+    def recovered_asset(self, item, existing):
+        """Asset id the lookup of a lost upload found, or None if it has to be sent again"""
+        asset_id = (existing or {}).get(item.media_file.path)
+        if asset_id:
+            self.log(f"{os.path.basename(item.media_file.path)} reached the server despite the error")
+        return asset_id
+    
+    def attempt_error(self, error, body, st):
+        """The UploadError a failed attempt raises; network errors are transient"""
+        if not isinstance(error, UploadError):
+            self.metrics.count_request_error('assets')
+            error = UploadError(str(error) or type(error).__name__, transient=True)
+        if st.st_size >= LARGE_FILE_BYTES:
+            error = UploadError(f"{str(error)} after {body.sent // (1024 * 1024)} of "
+                                f"{st.st_size // (1024 * 1024)} MB", error.transient, error.retry_after)
+        return error
+    
+    def upload_stream(self, file_path, checksum, st, created_at, source=None):
+        """Stream a file in chunks, returning (asset id, checksum)
+
+        Immich has no byte-range upload, so a retry resends the file. Before
+        that, a failed attempt that sent the whole body checks whether the
+        server stored it anyway and only the answer was lost.
+        """
+        session = self.get_session()
+        body, headers, timeout = self.upload_request(file_path, checksum, st, created_at, source,
+                                                     throttle=self.rate_limiter.send)
+        try:
+            # Upload asset - note: no 'upload' in path, just /assets
+            response = session.post(f"{self.server_url.rstrip('/')}/assets", headers=headers,
+                                    data=body, timeout=timeout)
+            return self.asset_id_from(response), checksum or body.sha1.hexdigest()
+        except session.network_errors + (UploadError,) as e:
+            lost = self.lost_upload(body, file_path, checksum, st)
+            if lost:
+                asset_id = self.recovered_asset(lost, self.check_existing([lost]))
+                if asset_id:
+                    return asset_id, lost.checksum
+            raise self.attempt_error(e, body, st)
+    
+    async def upload_file_async(self, session, file_path, album_id, checksum, st, created_at=None,
+                                source=None):
+        """upload_file for the async transport, run on the session's event loop
+
+        Waits are awaited instead of slept, and anything that may block
+        (disk, the index, album batches) runs in the loop's executor.
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retry.attempts):
+            try:
+                if created_at is None:
+                    created_at = await loop.run_in_executor(None, self.file_created_at,
+                                                            MediaFile(file_path, st))
+                while (remaining := self.retry.turn_delay()) > 0:
+                    await asyncio.sleep(remaining)
+                await asyncio.sleep(self.rate_limiter.request_delay())
+                started = time.monotonic()
+                asset_id, checksum = await self.upload_stream_async(session, file_path, checksum, st,
+                                                                    created_at, source)
+                if self.concurrency:
+                    self.concurrency.on_success(time.monotonic() - started, st.st_size)
+                
+                if asset_id:
+                    await loop.run_in_executor(None, self.record_upload, file_path, checksum, asset_id, st)
+                    # A full batch is sent right away, so add it off the loop
+                    await loop.run_in_executor(None, self.album_batcher.add, album_id, asset_id)
+                return True
+            
+            except UploadError as e:
+                error = e
+            except Exception as e:
+                error = UploadError(str(e))
+            
+            if source:
+                source.close()
+                source = None
+            delay = self.retry_delay(attempt, error, file_path)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+        
+        await loop.run_in_executor(None, self.record_failure, file_path, album_id, str(error))
+        return False
+    
+    async def upload_stream_async(self, session, file_path, checksum, st, created_at, source=None):
+        """upload_stream over an AsyncSession, returning (asset id, checksum)"""
+        body, headers, timeout = self.upload_request(file_path, checksum, st, created_at, source)
+        try:
+            response = await session.request('POST', f"{self.server_url.rstrip('/')}/assets",
+                                             headers=headers, file_body=body,
+                                             pace=self.rate_limiter.send_delay, timeout=timeout)
+            return self.asset_id_from(response), checksum or body.sha1.hexdigest()
+        except session.network_errors + (UploadError,) as e:
+            lost = self.lost_upload(body, file_path, checksum, st)
+            if lost:
+                asset_id = self.recovered_asset(lost, await self.check_existing_async(session, [lost]))
+                if asset_id:
+                    return asset_id, lost.checksum
+            raise self.attempt_error(e, body, st)
+    
+    def file_id(self, file_path, st):
+        """Device and inode of a file as a hash cache key, or None if unknown"""
+        if not st.st_ino:
+            # scandir on Windows leaves the file id out of its cached stat
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                return None
+        return f"{st.st_dev}:{st.st_ino}" if st.st_ino else None
+    
+    def file_checksum(self, media_file):
+        """SHA1 of a scanned file, from the hash cache if it hasn't changed, or None"""
+        file_id = self.file_id(media_file.path, media_file.stat) if self.index else None
+        if file_id:
+            try:
+                checksum = self.index.cached_hash(file_id, media_file.stat)
+                if checksum:
+                    self.metrics.count_hash_cached()
+                    return checksum
+            except sqlite3.Error as e:
+                self.log(f"Error reading hash cache: {str(e)}")
+        
+        started = time.monotonic()
+        checksum = self.try_file_hash(media_file.path)
+        self.metrics.observe_hash(time.monotonic() - started, media_file.stat.st_size)
+        if checksum and file_id and not self.dry_run:
+            try:
+                self.index.record_hash(file_id, media_file.stat, checksum)
+            except sqlite3.Error as e:
+                self.log(f"Error updating hash cache: {str(e)}")
+        return checksum
+    
+    def file_created_at(self, media_file):
+        """fileCreatedAt for a file: when it was taken, else the earliest file time
+
+        The capture time comes from the EXIF or container header and is kept
+        in the index, so only new or changed files are read for it.
+        """
+        st = media_file.stat
+        file_id = self.file_id(media_file.path, st) if self.index else None
+        row = None
+        if file_id:
+            try:
+                row = self.index.cached_capture_time(file_id, st)
+            except sqlite3.Error as e:
+                self.log(f"Error reading capture time cache: {str(e)}")
+        
+        if row:
+            captured_at = row[0]
+        else:
+            captured = read_capture_time(media_file.path)
+            captured_at = utc_timestamp(captured) if captured else None
+            if file_id and not self.dry_run:
+                try:
+                    self.index.record_capture_time(file_id, st, captured_at)
+                except sqlite3.Error as e:
+                    self.log(f"Error updating capture time cache: {str(e)}")
+        
+        if captured_at:
+            return captured_at
+        # ctime is the inode change time on Unix, so only trusted as creation time on Windows
+        created = getattr(st, 'st_birthtime', None) or (st.st_ctime if os.name == 'nt' else st.st_mtime)
+        return utc_timestamp(datetime.fromtimestamp(min(created, st.st_mtime), timezone.utc))
+    
+    def calculate_file_hash(self, file_path):
+        """Calculate SHA1 hash of file"""
+        sha1 = hashlib.sha1()
+        buffer = memoryview(bytearray(HASH_CHUNK_BYTES))
+        with open(file_path, 'rb', buffering=0) as f:
+            while count := f.readinto(buffer):
+                sha1.update(buffer[:count])
+        return sha1.hexdigest()
+    
+    def try_file_hash(self, file_path):
+        """Calculate SHA1 hash, or None if the file can't be read"""
+        try:
+            return self.calculate_file_hash(file_path)
+        except OSError as e:
+            self.log(f"Error reading {os.path.basename(file_path)}: {str(e)}")
+            return None
@@ -0,0 +1,176 @@
+"""
+Immich Uploader - File Filters
+Decides which files under the selected folders are uploaded. The rules are
+compiled once, excluded folders are skipped during the directory walk
+without being listed, and sizes and dates are only checked for files whose
+names already passed.
+"""
+
+import os
+import re
+import fnmatch
+from datetime import datetime
+
+MEDIA_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.heic', '.heif',
+                    '.mp4', '.mov', '.avi', '.mkv', '.m4v', '.mpg', '.mpeg', '.3gp'}
+# Camera RAW formats Immich accepts, uploaded when 'raw' is on
+RAW_EXTENSIONS = {'.dng', '.cr2', '.cr3', '.crw', '.nef', '.nrw', '.arw', '.srf', '.sr2', '.orf',
+                  '.rw2', '.raf', '.pef', '.srw', '.x3f', '.3fr', '.iiq', '.erf', '.kdc', '.mrw'}
+
+# NAS thumbnail caches, recycle bins and OS metadata folders, never walked
+# into unless the default excludes are turned off
+DEFAULT_EXCLUDE_DIRS = ('@eaDir', '.@__thumb', '@Recycle', '#recycle', '#snapshot', '@Recently-Snapshot',
+                        '.AppleDouble', '.Trashes', '.Spotlight-V100', '$RECYCLE.BIN',
+                        'System Volume Information')
+# macOS resource forks left on shares carry the photo's own extension
+DEFAULT_EXCLUDE = ('._*',)
+
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+# Keys of the 'filters' config section
+FILTER_KEYS = ('exclude', 'exclude_regex', 'exclude_dirs', 'min_size', 'max_size',
+               'newer_than', 'older_than', 'raw', 'default_excludes')
+
+
+def parse_size(text):
+    """Bytes from a size such as 2000, '500k', '20MB' or '1.5G' (units of 1024)"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*', str(text).lower())
+    if not match:
+        raise ValueError(f"bad size {text!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def parse_date(text):
+    """POSIX timestamp of an ISO date ('2024-06-01') or date and time, in local time"""
+    try:
+        return datetime.fromisoformat(str(text).strip()).timestamp()
+    except ValueError:
+        raise ValueError(f"bad date {text!r}, expected YYYY-MM-DD")
+
+
+def has_wildcards(pattern):
+    return any(c in pattern for c in '*?[')
+
+
+def compile_globs(patterns):
+    """One case-insensitive regex matching any of the glob patterns, or None for none"""
+    patterns = list(patterns)
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns), re.IGNORECASE)
+
+
+def compile_regexes(patterns):
+    """One regex searching for any of the patterns, or None for none"""
+    patterns = list(patterns)
+    if not patterns:
+        return None
+    try:
+        return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns))
+    except re.error as e:
+        raise ValueError(f"bad regex in {patterns!r}: {str(e)}")
+
+
+def portable(path):
+    """path with '/' separators, which is what path patterns are written with"""
+    return path if os.sep == '/' else path.replace(os.sep, '/')
+
+
+class FileFilter:
+    """Compiled rules for which media files are uploaded
+
+    exclude holds glob patterns for files: matched against the file name,
+    or against the whole path when they contain a '/' ('*/Exports/*').
+    exclude_regex is searched for in the whole path. exclude_dirs are
+    folder names or globs (or path globs with a '/') whose folders are
+    not walked into at all. Sizes are in bytes and dates are timestamps
+    compared with the file's modification time.
+    """
+
+    def __init__(self, exclude=(), exclude_regex=(), exclude_dirs=(), min_size=0, max_size=0,
+                 newer_than=None, older_than=None, raw=False, default_excludes=True):
+        self.extensions = MEDIA_EXTENSIONS | RAW_EXTENSIONS if raw else MEDIA_EXTENSIONS
+        exclude = list(exclude) + (list(DEFAULT_EXCLUDE) if default_excludes else [])
+        exclude_dirs = list(exclude_dirs) + (list(DEFAULT_EXCLUDE_DIRS) if default_excludes else [])
+
+        # Plain folder names are a set lookup; only wildcards and paths need a regex
+        self.excluded_dir_names = {name.lower() for name in exclude_dirs
+                                   if '/' not in name and not has_wildcards(name)}
+        self.dir_name_pattern = compile_globs(name for name in exclude_dirs
+                                              if '/' not in name and has_wildcards(name))
+        self.dir_path_pattern = compile_globs(name for name in exclude_dirs if '/' in name)
+        self.name_pattern = compile_globs(pattern for pattern in exclude if '/' not in pattern)
+        self.path_pattern = compile_globs(pattern for pattern in exclude if '/' in pattern)
+        self.path_regex = compile_regexes(exclude_regex)
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.newer_than = newer_than
+        self.older_than = older_than
+        # Whether files must be stat'ed before they can be accepted
+        self.checks_stat = bool(min_size or max_size or newer_than is not None or older_than is not None)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a filter from the 'filters' config section, raising ValueError for bad values"""
+        if not isinstance(config, dict):
+            raise ValueError("expected a set of filter settings")
+        unknown = sorted(set(config) - set(FILTER_KEYS))
+        if unknown:
+            raise ValueError(f"unknown setting {', '.join(unknown)}")
+        for key in ('exclude', 'exclude_regex', 'exclude_dirs'):
+            if not isinstance(config.get(key, []), list):
+                raise ValueError(f"{key} should be a list of patterns")
+        newer_than = config.get('newer_than')
+        older_than = config.get('older_than')
+        return cls(exclude=config.get('exclude', ()),
+                   exclude_regex=config.get('exclude_regex', ()),
+                   exclude_dirs=config.get('exclude_dirs', ()),
+                   min_size=parse_size(config.get('min_size') or 0),
+                   max_size=parse_size(config.get('max_size') or 0),
+                   newer_than=parse_date(newer_than) if newer_than else None,
+                   older_than=parse_date(older_than) if older_than else None,
+                   raw=bool(config.get('raw', False)),
+                   default_excludes=bool(config.get('default_excludes', True)))
+
+    def wants_dir(self, name, path):
+        """Whether the walk should go into a folder"""
+        if name.lower() in self.excluded_dir_names:
+            return False
+        if self.dir_name_pattern and self.dir_name_pattern.match(name):
+            return False
+        if self.dir_path_pattern and self.dir_path_pattern.match(portable(path)):
+            return False
+        return True
+
+    def wants_name(self, name, path):
+        """Whether a file passes the extension and pattern rules"""
+        dot = name.rfind('.')
+        # A leading dot starts a hidden name, not an extension
+        if dot <= 0 or name[dot:].lower() not in self.extensions:
+            return False
+        if self.name_pattern and self.name_pattern.match(name):
+            return False
+        if self.path_pattern or self.path_regex:
+            path = portable(path)
+            if self.path_pattern and self.path_pattern.match(path):
+                return False
+            if self.path_regex and self.path_regex.search(path):
+                return False
+        return True
+
+    def wants_stat(self, st):
+        """Whether a file's size and modification time are within the limits"""
+        if not self.checks_stat:
+            return True
+        if st.st_size < self.min_size or (self.max_size and st.st_size > self.max_size):
+            return False
+        if self.newer_than is not None and st.st_mtime < self.newer_than:
+            return False
+        if self.older_than is not None and st.st_mtime >= self.older_than:
+            return False
+        return True
+
+
+# Every media file, apart from NAS and OS clutter
+DEFAULT_FILTER = FileFilter()
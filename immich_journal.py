@@ -0,0 +1,251 @@
+"""
+Immich Uploader - Job Journal
+An append-only record of each upload job's progress, replayed to resume a
+job that was cut short by a crash, a closed window or a sleeping machine
+"""
+
+import os
+import json
+import stat
+import threading
+from pathlib import Path
+from datetime import datetime
+
+JOURNAL_DIR = Path.home() / ".immich_uploader_jobs"
+
+# Records are written as they happen but only forced to disk this often, or
+# once this many are waiting; a crash loses at most that much, which is redone
+JOURNAL_SYNC_SECONDS = 1.0
+JOURNAL_SYNC_RECORDS = 1000
+
+# Final statuses of files that need nothing more from a resumed run
+DONE_STATUSES = ('indexed', 'existing', 'uploaded')
+
+
+def lock_file(f):
+    """Lock an open file for this process without waiting; False if another process holds it"""
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def recorded_stat(size, mtime_ns):
+    """A stat result holding the size and mtime a journal recorded, so a finished file needs no stat call"""
+    mtime = mtime_ns / 1e9
+    return os.stat_result((stat.S_IFREG, 0, 0, 1, 0, 0, size, int(mtime), int(mtime), int(mtime)),
+                          {'st_atime': mtime, 'st_mtime': mtime, 'st_ctime': mtime, 'st_mtime_ns': mtime_ns})
+
+
+class JobJournal:
+    """One upload job's journal: a JSON line per step, kept in memory as the current state
+
+    Steps are 'job' (folders and options, first line), then per file
+    'scanned', 'hashed', 'uploaded' (per server) and 'finished', 'album'
+    when asset ids were added to an album, 'scan_done' per folder and
+    'complete' when the job ended. The running job holds a lock on the
+    file, so several uploaders can run at once and only an abandoned job
+    is ever resumed.
+    """
+
+    def __init__(self, path, f):
+        self.path = Path(path)
+        self.file = f
+        self.header = None
+        # path → {'folder', 'size', 'mtime_ns', 'checksum', 'status'}
+        self.files = {}
+        # folder → its recorded paths in scan order
+        self.folder_files = {}
+        # (server, path) → asset id
+        self.assets = {}
+        # (server, album id, asset id) of assets known to be in an album
+        self.albums = set()
+        self.scanned_folders = set()
+        self.complete = False
+        self.pending = []
+        # lock guards the state and pending; write_lock the file, so the
+        # slow fsync never holds up record()
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.closed = threading.Event()
+        self.flusher = None
+
+    @classmethod
+    def create(cls, journal_dir, folders, album_name, check_duplicates):
+        """Start the journal of a new job"""
+        journal_dir = Path(journal_dir)
+        journal_dir.mkdir(parents=True, exist_ok=True)
+        started = datetime.now()
+        path = journal_dir / f"job-{started:%Y%m%d-%H%M%S}-{os.getpid()}.jsonl"
+        f = open(path, 'a', encoding='utf-8')
+        if not lock_file(f):
+            f.close()
+            raise OSError(f"{path} is in use by another uploader")
+        journal = cls(path, f)
+        journal.record('job', folders=list(folders), album_name=album_name,
+                       check_duplicates=check_duplicates, started=started.isoformat(timespec='seconds'))
+        journal.start()
+        return journal
+
+    @classmethod
+    def open(cls, path):
+        """Take over an interrupted job's journal, or None if it finished, is in use or can't be read"""
+        try:
+            f = open(path, 'a+', encoding='utf-8')
+        except OSError:
+            return None
+        if not lock_file(f):
+            f.close()
+            return None
+        journal = cls(path, f)
+        f.seek(0)
+        for line in f:
+            try:
+                journal.apply(json.loads(line))
+            except (ValueError, KeyError, TypeError):
+                # The last line of a crashed run may be cut off
+                continue
+        f.seek(0, os.SEEK_END)
+        if journal.complete or journal.header is None:
+            # Finished, or abandoned before its first line: nothing to resume
+            f.close()
+            try:
+                journal.path.unlink()
+            except OSError:
+                pass
+            return None
+        journal.start()
+        return journal
+
+    def start(self):
+        self.flusher = threading.Thread(target=self.sync_loop, name='immich-journal', daemon=True)
+        self.flusher.start()
+
+    def apply(self, record):
+        """Update the in-memory state with one record; False if it changes nothing"""
+        step = record['step']
+        if step == 'job':
+            self.header = record
+        elif step == 'scanned':
+            if record['path'] in self.files:
+                return False
+            self.files[record['path']] = {'folder': record['folder'], 'size': record['size'],
+                                          'mtime_ns': record['mtime_ns'], 'checksum': None,
+                                          'status': None}
+            self.folder_files.setdefault(record['folder'], []).append(record['path'])
+        elif step == 'scan_done':
+            self.scanned_folders.add(record['folder'])
+        elif step == 'hashed':
+            entry = self.files.get(record['path'])
+            if not entry or entry['checksum'] == record['checksum']:
+                return False
+            entry['checksum'] = record['checksum']
+        elif step == 'uploaded':
+            key = (record['server'], record['path'])
+            if self.assets.get(key) == record['asset_id']:
+                return False
+            self.assets[key] = record['asset_id']
+        elif step == 'album':
+            self.albums.update((record['server'], record['album_id'], asset_id)
+                               for asset_id in record['asset_ids'])
+        elif step == 'finished':
+            entry = self.files.get(record['path'])
+            if not entry:
+                return False
+            entry['status'] = record['status']
+        elif step == 'complete':
+            self.complete = True
+        return True
+
+    def record(self, step, **fields):
+        """Add a step to the journal; it reaches the disk within JOURNAL_SYNC_SECONDS"""
+        record = {'step': step, **fields}
+        with self.lock:
+            if not self.apply(record):
+                return
+            self.pending.append(json.dumps(record) + '\n')
+            full = len(self.pending) >= JOURNAL_SYNC_RECORDS
+        if full:
+            self.sync()
+
+    def sync(self):
+        """Write and fsync the waiting records, taking them from pending first
+        so other threads can keep recording while the disk catches up"""
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            if not pending or self.file.closed:
+                return
+            try:
+                self.file.write(''.join(pending))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except OSError:
+                # A full disk only costs the ability to resume
+                pass
+
+    def sync_loop(self):
+        while not self.closed.wait(JOURNAL_SYNC_SECONDS):
+            self.sync()
+
+    def close(self, complete=False):
+        """Stop journaling; a complete job's journal is deleted, any other is left to resume"""
+        if complete:
+            self.record('complete')
+        self.closed.set()
+        self.sync()
+        with self.write_lock:
+            self.file.close()
+        if complete:
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+    def known(self, path, st):
+        """The journal entry of a file if it hasn't changed since, else None"""
+        entry = self.files.get(path)
+        if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return entry
+        return None
+
+    def checksum(self, path, st):
+        entry = self.known(path, st)
+        return entry['checksum'] if entry else None
+
+    def asset_id(self, server, path, st):
+        """Asset id the file was uploaded to server as, if it hasn't changed since"""
+        if not self.known(path, st):
+            return None
+        return self.assets.get((server, path))
+
+    def in_album(self, server, album_id, asset_id):
+        return (server, album_id, asset_id) in self.albums
+
+    def files_in(self, folder):
+        """[(path, entry)] of the files recorded for a folder, in scan order"""
+        return [(path, self.files[path]) for path in self.folder_files.get(folder, [])]
+
+    def summary(self):
+        """(folders, files recorded, files finished) for asking whether to resume"""
+        finished = sum(1 for entry in self.files.values() if entry['status'] in DONE_STATUSES)
+        return len(self.header['folders']), len(self.files), finished
+
+
+def interrupted_job(journal_dir=JOURNAL_DIR):
+    """The newest job journal no running uploader holds, opened for resuming, or None"""
+    journal_dir = Path(journal_dir)
+    if not journal_dir.is_dir():
+        return None
+    for path in sorted(journal_dir.glob('job-*.jsonl'), reverse=True):
+        journal = JobJournal.open(path)
+        if journal:
+            return journal
+    return None
@@ -0,0 +1,285 @@
+"""
+Immich Uploader - Capture Time
+Reads when a photo or video was taken from its EXIF or container header,
+touching only the first few hundred KB of the file
+"""
+
+import struct
+from datetime import datetime, timedelta, timezone
+
+# Most EXIF and container headers fit well inside this; nothing past it is read
+HEADER_BYTES = 512 * 1024
+# Seconds between the QuickTime/MP4 epoch (1904) and the Unix epoch
+MP4_EPOCH_OFFSET = 2082844800
+
+# EXIF tags: (date, UTC offset, subseconds), best first
+EXIF_POINTER = 0x8769
+EXIF_DATE_TAGS = (
+    ('exif', 0x9003, 0x9011, 0x9291),  # DateTimeOriginal
+    ('exif', 0x9004, 0x9012, 0x9292),  # DateTimeDigitized
+    ('ifd0', 0x0132, 0x9010, 0x9290),  # DateTime
+)
+# TIFF field type of text values
+TIFF_ASCII = 2
+
+# ISO base media file brands that carry their capture time in an EXIF item
+HEIF_BRANDS = {b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1', b'avif', b'avis'}
+
+
+def read_capture_time(path):
+    """Capture time of a JPEG, TIFF-based RAW, HEIC/AVIF or MP4/MOV file as an
+    aware datetime, or None when it has none or can't be read"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(16)
+            if head[:2] == b'\xff\xd8':
+                return jpeg_capture_time(f)
+            if head[:4] in (b'II*\0', b'MM\0*'):
+                f.seek(0)
+                return exif_capture_time(f.read(HEADER_BYTES))
+            if len(head) >= 8 and head[4:8].isalpha():
+                return bmff_capture_time(f)
+    except (OSError, ValueError, IndexError, struct.error, OverflowError):
+        pass
+    return None
+
+
+def jpeg_capture_time(f):
+    """Walk JPEG segments up to the image data looking for the EXIF APP1 segment"""
+    f.seek(2)
+    while f.tell() < HEADER_BYTES:
+        marker = f.read(4)
+        if len(marker) < 4 or marker[0] != 0xff:
+            return None
+        kind = marker[1]
+        # Start of scan: the metadata is all before this
+        if kind == 0xda:
+            return None
+        length = struct.unpack('>H', marker[2:])[0]
+        if kind == 0xe1:
+            segment = f.read(length - 2)
+            if segment.startswith(b'Exif\0\0'):
+                return exif_capture_time(segment[6:])
+        else:
+            f.seek(length - 2, 1)
+    return None
+
+
+def exif_capture_time(tiff):
+    """Capture time from a TIFF-structured EXIF block"""
+    if tiff[:4] == b'II*\0':
+        endian = '<'
+    elif tiff[:4] == b'MM\0*':
+        endian = '>'
+    else:
+        return None
+    ifds = {'ifd0': ifd_entries(tiff, struct.unpack_from(endian + 'I', tiff, 4)[0], endian)}
+    pointer = ifds['ifd0'].get(EXIF_POINTER)
+    if pointer:
+        ifds['exif'] = ifd_entries(tiff, struct.unpack(endian + 'I', pointer[2])[0], endian)
+    else:
+        ifds['exif'] = {}
+
+    for ifd, date_tag, offset_tag, subsec_tag in EXIF_DATE_TAGS:
+        entries = ifds[ifd]
+        # Offset and subsecond tags always live in the EXIF IFD
+        captured = parse_exif_datetime(ascii_value(tiff, entries.get(date_tag), endian),
+                                       ascii_value(tiff, ifds['exif'].get(offset_tag), endian),
+                                       ascii_value(tiff, ifds['exif'].get(subsec_tag), endian))
+        if captured:
+            return captured
+    return None
+
+
+def ifd_entries(tiff, offset, endian):
+    """{tag: (type, count, raw value field)} of the IFD at offset"""
+    entries = {}
+    if not 8 <= offset <= len(tiff) - 2:
+        return entries
+    count = struct.unpack_from(endian + 'H', tiff, offset)[0]
+    for i in range(count):
+        start = offset + 2 + i * 12
+        if start + 12 > len(tiff):
+            break
+        tag, kind, values = struct.unpack_from(endian + 'HHI', tiff, start)
+        entries[tag] = (kind, values, tiff[start + 8:start + 12])
+    return entries
+
+
+def ascii_value(tiff, entry, endian):
+    """Text of an ASCII IFD entry, or None"""
+    if not entry or entry[0] != TIFF_ASCII:
+        return None
+    kind, count, field = entry
+    if count <= 4:
+        data = field[:count]
+    else:
+        offset = struct.unpack(endian + 'I', field)[0]
+        data = tiff[offset:offset + count]
+    return data.split(b'\0', 1)[0].decode('ascii', 'replace').strip()
+
+
+def parse_exif_datetime(text, offset=None, subsec=None):
+    """'YYYY:MM:DD HH:MM:SS' plus optional '+HH:MM' offset as an aware datetime
+
+    Without an offset the camera's clock is taken to be in this computer's
+    time zone, which is what most people shoot in.
+    """
+    if not text or text.startswith('0000'):
+        return None
+    try:
+        captured = datetime.strptime(text[:19], '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    if subsec and subsec.isdigit():
+        captured = captured.replace(microsecond=int(subsec[:6].ljust(6, '0')))
+    if offset and len(offset) == 6 and offset[0] in '+-' and offset[3] == ':':
+        try:
+            delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[4:6]))
+        except ValueError:
+            delta = None
+        if delta is not None:
+            return captured.replace(tzinfo=timezone(-delta if offset[0] == '-' else delta))
+    return captured.astimezone()
+
+
+def boxes(f, start, end):
+    """Yield (type, payload offset, payload size) of the ISO BMFF boxes between start and end"""
+    offset = start
+    while end is None or offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            # Runs to the end of the file
+            f.seek(0, 2)
+            size = f.tell() - offset
+        if size < header_size:
+            return
+        yield kind, offset + header_size, size - header_size
+        offset += size
+
+
+def bmff_capture_time(f):
+    """Capture time of a HEIF image (EXIF item) or MP4/MOV movie (mvhd creation time)"""
+    brands = set()
+    for kind, offset, size in boxes(f, 0, None):
+        if kind == b'ftyp':
+            f.seek(offset)
+            data = f.read(min(size, 256))
+            brands = {data[i:i + 4] for i in range(0, len(data) - 3, 4)}
+        elif kind == b'meta' and brands & HEIF_BRANDS and size <= HEADER_BYTES:
+            f.seek(offset)
+            captured = heif_capture_time(f, f.read(size))
+            if captured:
+                return captured
+        elif kind == b'moov':
+            return movie_capture_time(f, offset, size)
+    return None
+
+
+def heif_capture_time(f, meta):
+    """Find the EXIF item of a HEIF meta box and read its capture time"""
+    # meta is a full box: skip version and flags
+    children = {}
+    position = 4
+    while position + 8 <= len(meta):
+        size, kind = struct.unpack_from('>I4s', meta, position)
+        if size < 8:
+            break
+        children[kind] = meta[position + 8:position + size]
+        position += size
+    exif_id = exif_item_id(children.get(b'iinf', b''))
+    if exif_id is None:
+        return None
+    extent = item_extent(children.get(b'iloc', b''), exif_id)
+    if not extent:
+        return None
+    offset, length = extent
+    f.seek(offset)
+    data = f.read(min(length, HEADER_BYTES))
+    # The item starts with the offset of the TIFF header after this field
+    tiff_start = 4 + struct.unpack_from('>I', data)[0]
+    return exif_capture_time(data[tiff_start:])
+
+
+def exif_item_id(iinf):
+    """Item id of the 'Exif' entry in an iinf box"""
+    if len(iinf) < 6:
+        return None
+    version = iinf[0]
+    position = 6 if version == 0 else 8
+    while position + 8 <= len(iinf):
+        size, kind = struct.unpack_from('>I4s', iinf, position)
+        if size < 8:
+            break
+        if kind == b'infe':
+            infe = iinf[position + 8:position + size]
+            infe_version = infe[0]
+            if infe_version == 2 and infe[8:12] == b'Exif':
+                return struct.unpack_from('>H', infe, 4)[0]
+            if infe_version == 3 and infe[10:14] == b'Exif':
+                return struct.unpack_from('>I', infe, 4)[0]
+        position += size
+    return None
+
+
+def item_extent(iloc, item_id):
+    """(file offset, length) of the first extent of item_id in an iloc box"""
+    def number(size, position):
+        if size == 0:
+            return 0, position
+        value = int.from_bytes(iloc[position:position + size], 'big')
+        return value, position + size
+
+    version = iloc[0]
+    offset_size, length_size = iloc[4] >> 4, iloc[4] & 0xf
+    base_offset_size, index_size = iloc[5] >> 4, iloc[5] & 0xf
+    if version < 2:
+        count, position = number(2, 6)
+    else:
+        count, position = number(4, 6)
+    for _ in range(count):
+        current, position = number(2 if version < 2 else 4, position)
+        method = 0
+        if version in (1, 2):
+            method, position = number(2, position)
+            method &= 0xf
+        position += 2  # data_reference_index
+        base_offset, position = number(base_offset_size, position)
+        extents, position = number(2, position)
+        first = None
+        for _ in range(extents):
+            if version in (1, 2) and index_size:
+                position += index_size
+            extent_offset, position = number(offset_size, position)
+            extent_length, position = number(length_size, position)
+            if first is None:
+                first = (base_offset + extent_offset, extent_length)
+        if current == item_id:
+            # Only items stored in the file itself, not inside the meta box
+            return first if method == 0 else None
+    return None
+
+
+def movie_capture_time(f, moov_offset, moov_size):
+    """Creation time from the mvhd box of a moov box (UTC; 0 means unset)"""
+    for kind, offset, size in boxes(f, moov_offset, moov_offset + moov_size):
+        if kind != b'mvhd':
+            continue
+        f.seek(offset)
+        data = f.read(12)
+        if data[0] == 1:
+            seconds = struct.unpack_from('>Q', data, 4)[0]
+        else:
+            seconds = struct.unpack_from('>I', data, 4)[0]
+        if seconds <= MP4_EPOCH_OFFSET:
+            return None
+        return datetime.fromtimestamp(seconds - MP4_EPOCH_OFFSET, timezone.utc)
+    return None
@@ -0,0 +1,320 @@
+"""
+Immich Uploader - Metrics
+Throughput, latency and queue measurements for an upload run, as JSON or Prometheus text
+"""
+
+import re
+import time
+import threading
+from collections import Counter
+from urllib.parse import urlparse
+
+# Histogram bucket upper bounds in seconds, shared by request and hash timings
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+ALBUM_ASSETS_PATH = re.compile(r'/albums/[^/]+/assets$')
+
+
+def endpoint_name(method, url):
+    """Short label for the API endpoint a request went to"""
+    path = urlparse(url).path.rstrip('/')
+    if path.endswith('/assets/bulk-upload-check'):
+        return 'bulk_check'
+    if ALBUM_ASSETS_PATH.search(path):
+        return 'album_assets'
+    if path.endswith('/assets') and method == 'POST':
+        return 'assets'
+    if path.endswith('/albums'):
+        return 'albums'
+    return 'other'
+
+
+class Histogram:
+    """Counts observations into fixed buckets, like a Prometheus histogram"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket plus the +Inf overflow
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        # Largest observation, reported for quantiles past the last bucket
+        self.max = 0.0
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative(self):
+        """(upper bound, observations at or below it) pairs ending with +Inf"""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (None when empty)
+
+        Past the last bucket that is the largest value seen, so snapshots
+        never hold an infinity, which JSON can't represent.
+        """
+        if not self.count:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound if bound != float('inf') else round(self.max, 3)
+        return None
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 3),
+            'mean': round(self.sum / self.count, 3) if self.count else None,
+            'max': round(self.max, 3) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': {('+Inf' if bound == float('inf') else str(bound)): total
+                        for bound, total in self.cumulative()},
+        }
+
+
+class UploadMetrics:
+    """Thread-safe counters, histograms and gauges for one upload run
+
+    Stages count what they finish and how long they were busy; queue depths
+    and the in-flight limit are read from the running pipeline when a
+    snapshot is taken, so a slow stage shows up as a full queue in front of it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Start measuring a new run"""
+        with self.lock:
+            self.started = time.monotonic()
+            self.finished = None
+            self.files = Counter()
+            self.bytes = Counter()
+            self.busy = Counter()
+            self.requests = {}
+            self.request_errors = Counter()
+            self.hash_seconds = Histogram()
+            self.retries = 0
+            self.pipeline = None
+
+    def finish(self):
+        """Stop the clock so rates describe the run, not the time since"""
+        with self.lock:
+            self.finished = time.monotonic()
+
+    def watch(self, pipeline):
+        """Read queue depths from this pipeline until the next one"""
+        self.pipeline = pipeline
+
+    def count_scanned(self):
+        with self.lock:
+            self.files['scanned'] += 1
+
+    def count_file(self, status, size):
+        """A file left the pipeline with status"""
+        with self.lock:
+            self.files[status] += 1
+            if status == 'uploaded':
+                self.bytes['uploaded'] += size
+
+    def count_hash_cached(self):
+        """A checksum taken from the hash cache instead of reading the file"""
+        with self.lock:
+            self.files['hash_cached'] += 1
+
+    def observe_hash(self, seconds, size):
+        with self.lock:
+            self.files['hashed'] += 1
+            self.bytes['hashed'] += size
+            self.busy['hash'] += seconds
+            self.hash_seconds.observe(seconds)
+
+    def observe_upload(self, seconds):
+        """Time an upload worker spent on one file, retries included"""
+        with self.lock:
+            self.busy['upload'] += seconds
+
+    def count_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def observe_request(self, endpoint, seconds, error=False):
+        with self.lock:
+            histogram = self.requests.get(endpoint)
+            if histogram is None:
+                histogram = self.requests[endpoint] = Histogram()
+            histogram.observe(seconds)
+            if error:
+                self.request_errors[endpoint] += 1
+
+    def count_request_error(self, endpoint):
+        """A request that failed without a response (connection reset, timeout)"""
+        with self.lock:
+            self.request_errors[endpoint] += 1
+
+    def observe_response(self, method, url, status_code, seconds):
+        """Time an API call that got an answer, whichever transport made it"""
+        # A 409 is a duplicate the server turned away, not a failure
+        error = status_code >= 400 and status_code != 409
+        self.observe_request(endpoint_name(method, url), seconds, error)
+
+    def on_response(self, response, *args, **kwargs):
+        """requests response hook timing every call made through the session"""
+        self.observe_response(response.request.method, response.request.url, response.status_code,
+                              response.elapsed.total_seconds())
+
+    def gauges(self):
+        """Current queue depths and in-flight uploads of the watched pipeline"""
+        pipeline = self.pipeline
+        if pipeline is None:
+            return {}, {}
+        queues = {
+            'hash': pipeline.hash_queue.qsize(),
+            'check': pipeline.check_queue.qsize(),
+            'upload': pipeline.upload_queue.qsize(),
+            'results': pipeline.results.qsize(),
+        }
+        limiter = pipeline.limiter
+        in_flight = {'files': limiter.files, 'bytes': limiter.bytes, 'limit': limiter.max_files}
+        return queues, in_flight
+
+    def snapshot(self):
+        """All metrics as a JSON-ready dict"""
+        queues, in_flight = self.gauges()
+        with self.lock:
+            elapsed = max((self.finished or time.monotonic()) - self.started, 1e-9)
+            hash_busy = self.busy['hash']
+            return {
+                'elapsed_seconds': round(elapsed, 3),
+                'files': dict(self.files),
+                'bytes': dict(self.bytes),
+                'rates': {
+                    'files_per_second': round(self.files['uploaded'] / elapsed, 2),
+                    'upload_mb_per_second': round(self.bytes['uploaded'] / elapsed / 1048576, 2),
+                    # Per busy hash worker, so a slow disk isn't hidden by idle time
+                    'hash_mb_per_second': (round(self.bytes['hashed'] / hash_busy / 1048576, 2)
+                                           if hash_busy else None),
+                },
+                'busy_seconds': {stage: round(seconds, 3) for stage, seconds in self.busy.items()},
+                'requests': {endpoint: dict(histogram.snapshot(),
+                                            errors=self.request_errors[endpoint])
+                             for endpoint, histogram in self.requests.items()},
+                'request_errors': dict(self.request_errors),
+                'hash_seconds': self.hash_seconds.snapshot(),
+                'retries': self.retries,
+                'queues': queues,
+                'in_flight': in_flight,
+            }
+
+    def summary(self):
+        """One line for a progress display"""
+        snap = self.snapshot()
+        rates = snap['rates']
+        parts = [f"{rates['files_per_second']:.1f} files/s",
+                 f"{rates['upload_mb_per_second']:.1f} MB/s"]
+        assets = snap['requests'].get('assets')
+        if assets:
+            parts.append(f"/assets p50 {assets['p50']}s p95 {assets['p95']}s")
+        if rates['hash_mb_per_second'] is not None:
+            parts.append(f"hash {rates['hash_mb_per_second']:.0f} MB/s")
+        if snap['queues']:
+            depths = snap['queues']
+            parts.append(f"queues hash {depths['hash']} / check {depths['check']} / "
+                         f"upload {depths['upload']}")
+        if snap['retries']:
+            parts.append(f"{snap['retries']} retries")
+        return " · ".join(parts)
+
+    def prometheus_text(self):
+        """Metrics in the Prometheus text exposition format"""
+        snap = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP immich_uploader_{name} {help_text}")
+            lines.append(f"# TYPE immich_uploader_{name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"immich_uploader_{name}{{{label_text}}} {value}" if label_text
+                             else f"immich_uploader_{name} {value}")
+
+        def histogram(name, help_text, histograms):
+            lines.append(f"# HELP immich_uploader_{name} {help_text}")
+            lines.append(f"# TYPE immich_uploader_{name} histogram")
+            for labels, hist in histograms:
+                for bound, total in hist.cumulative():
+                    le = '+Inf' if bound == float('inf') else bound
+                    label_text = ','.join([f'{key}="{val}"' for key, val in labels.items()] +
+                                          [f'le="{le}"'])
+                    lines.append(f"immich_uploader_{name}_bucket{{{label_text}}} {total}")
+                label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+                suffix = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"immich_uploader_{name}_sum{suffix} {hist.sum}")
+                lines.append(f"immich_uploader_{name}_count{suffix} {hist.count}")
+
+        metric('elapsed_seconds', 'gauge', "Seconds since the run started",
+               [({}, snap['elapsed_seconds'])])
+        metric('files_total', 'counter', "Files by pipeline stage or final status",
+               [({'status': status}, count) for status, count in sorted(snap['files'].items())])
+        metric('bytes_total', 'counter', "Bytes hashed and uploaded",
+               [({'stage': stage}, count) for stage, count in sorted(snap['bytes'].items())])
+        metric('stage_busy_seconds_total', 'counter', "Worker time spent per stage",
+               [({'stage': stage}, seconds) for stage, seconds in sorted(snap['busy_seconds'].items())])
+        metric('retries_total', 'counter', "Upload attempts retried after a transient error",
+               [({}, snap['retries'])])
+        metric('request_errors_total', 'counter', "Failed API requests by endpoint",
+               [({'endpoint': endpoint}, count)
+                for endpoint, count in sorted(snap['request_errors'].items())])
+        metric('queue_depth', 'gauge', "Items waiting in front of each stage",
+               [({'queue': name}, depth) for name, depth in sorted(snap['queues'].items())])
+        metric('in_flight', 'gauge', "Uploads in flight and the current limit",
+               [({'measure': name}, value) for name, value in sorted(snap['in_flight'].items())])
+        with self.lock:
+            histogram('request_duration_seconds', "API request latency by endpoint",
+                      [({'endpoint': endpoint}, hist) for endpoint, hist in sorted(self.requests.items())])
+            histogram('hash_duration_seconds', "Time to checksum one file",
+                      [({}, self.hash_seconds)])
+        return '\n'.join(lines) + '\n'
+
+
+def serve_metrics(metrics, port, host='127.0.0.1'):
+    """Serve metrics as Prometheus text at /metrics on a background thread"""
+    # Only needed when metrics are served, so not loaded at startup
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
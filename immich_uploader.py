@@ -5,16 +5,22 @@ A beautiful GUI for uploading folders to Immich without external CLI dependencie
 
 import os
 import sys
-import json
-import hashlib
-import mimetypes
-from pathlib import Path
 from tkinter import Tk, filedialog, messagebox
 import tkinter as tk
 from tkinter import ttk
+import queue
 import threading
-import requests
 from datetime import datetime
+from immich_engine import UploadEngine, DEFAULT_ALBUM_NAME, METRICS_FILE, UPLOAD_ORDERS
+from immich_watch import watch_folders
+
+# Worker threads never touch Tk: their updates are queued and drawn in batches
+UI_REFRESH_MS = 50
+MAX_LOG_LINES = 5000
+# Throughput and latency figures change slowly, so they are redrawn less often
+METRICS_REFRESH_MS = 1000
+# Most parallel uploads offered per transport; async ones don't cost a thread each
+MAX_PARALLEL_UPLOADS = {'threads': 16, 'async': 256}
 
 class ImmichUploader:
     def __init__(self, root):
@@ -24,43 +30,38 @@ class ImmichUploader:
         self.root.configure(bg="#f8f9fa")
         
         # State
-        self.server_url = ""
-        self.api_key = ""
         self.selected_folders = []
+        # None while a folder is still being counted
+        self.folder_counts = {}
+        # Folder → Event that cancels its background count
+        self.counting = {}
         self.is_uploading = False
-        self.config_file = Path.home() / ".immich_uploader_config.json"
-        
-        # Load saved config
-        self.load_config()
+        self.ui_queue = queue.Queue()
+        self.upload_status = None
+        # Uploads in flight as set by adaptive concurrency
+        self.parallel_uploads = None
+        # Set to end watch mode
+        self.watch_stop = threading.Event()
+        
+        # Upload engine, with saved config
+        self.engine = UploadEngine(log=self.log, on_event=self.handle_event)
+        self.engine.load_config()
+        # Prometheus endpoint, when a metrics_port is set in the config file
+        self.engine.start_metrics_server()
         
         # Setup UI
         self.setup_ui()
         
         # Check if we need setup
-        if not self.server_url or not self.api_key:
+        if not self.engine.server_url or not self.engine.api_key:
             self.show_setup()
         else:
             self.show_main()
-    
-    def load_config(self):
-        """Load saved configuration"""
-        if self.config_file.exists():
-            try:
-                with open(self.config_file, 'r') as f:
-                    config = json.load(f)
-                    self.server_url = config.get('server_url', '')
-                    self.api_key = config.get('api_key', '')
-            except:
-                pass
-    
-    def save_config(self):
-        """Save configuration"""
-        config = {
-            'server_url': self.server_url,
-            'api_key': self.api_key
-        }
-        with open(self.config_file, 'w') as f:
-            json.dump(config, f)
+            # Reading the journal of a big job takes a moment, so it isn't done on the Tk thread
+            threading.Thread(target=self.find_interrupted_job, daemon=True).start()
+        
+        self.root.after(UI_REFRESH_MS, self.process_ui_queue)
+        self.root.after(METRICS_REFRESH_MS, self.refresh_metrics)
     
     def setup_ui(self):
         """Setup the user interface"""
@@ -99,7 +100,7 @@ class ImmichUploader:
                 font=("Helvetica", 11, "bold"), bg="#ffffff", fg="#374151").pack(anchor=tk.W, pady=(10, 5))
         self.server_url_entry = tk.Entry(form_frame, font=("Helvetica", 11), width=50)
         self.server_url_entry.pack(fill=tk.X, pady=(0, 5))
-        self.server_url_entry.insert(0, self.server_url or "http://192.168.1.100:2283/api")
+        self.server_url_entry.insert(0, self.engine.server_url or "http://192.168.1.100:2283/api")
         
         tk.Label(form_frame, text="⚠️ Must end with /api (no trailing slash)", 
                 font=("Helvetica", 9), bg="#ffffff", fg="#EF4444").pack(anchor=tk.W, pady=(0, 15))
@@ -109,7 +110,7 @@ class ImmichUploader:
                 font=("Helvetica", 11, "bold"), bg="#ffffff", fg="#374151").pack(anchor=tk.W, pady=(10, 5))
         self.api_key_entry = tk.Entry(form_frame, font=("Helvetica", 11), width=50, show="*")
         self.api_key_entry.pack(fill=tk.X, pady=(0, 5))
-        self.api_key_entry.insert(0, self.api_key)
+        self.api_key_entry.insert(0, self.engine.api_key)
         
         tk.Label(form_frame, text="Generate in Immich: Settings → Account Settings → API Keys", 
                 font=("Helvetica", 9), bg="#ffffff", fg="#9CA3AF").pack(anchor=tk.W, pady=(0, 20))
@@ -209,6 +210,50 @@ class ImmichUploader:
                       font=("Helvetica", 11), bg="#ffffff",
                       activebackground="#ffffff").pack(anchor=tk.W, pady=5)
         
+        self.watch_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(opts_content, text="Keep watching the folders and upload new files as they appear",
+                      variable=self.watch_var,
+                      font=("Helvetica", 11), bg="#ffffff",
+                      activebackground="#ffffff").pack(anchor=tk.W, pady=5)
+        
+        workers_row = tk.Frame(opts_content, bg="#ffffff")
+        workers_row.pack(anchor=tk.W, pady=5)
+        tk.Label(workers_row, text="Parallel uploads:",
+                font=("Helvetica", 11), bg="#ffffff").pack(side=tk.LEFT)
+        self.upload_workers_var = tk.IntVar(value=self.engine.upload_workers)
+        tk.Spinbox(workers_row, from_=1, to=MAX_PARALLEL_UPLOADS[self.engine.transport], width=4,
+                  textvariable=self.upload_workers_var,
+                  font=("Helvetica", 11)).pack(side=tk.LEFT, padx=5)
+        # Order of files when several folders are uploaded together
+        tk.Label(workers_row, text="Order:",
+                font=("Helvetica", 11), bg="#ffffff").pack(side=tk.LEFT, padx=(15, 0))
+        self.upload_order_var = tk.StringVar(value=self.engine.upload_order)
+        tk.OptionMenu(workers_row, self.upload_order_var, *UPLOAD_ORDERS).pack(side=tk.LEFT, padx=5)
+        
+        self.adaptive_var = tk.BooleanVar(value=self.engine.adaptive_concurrency)
+        tk.Checkbutton(opts_content, text="Adjust parallel uploads to server load (up to the number above)",
+                      variable=self.adaptive_var,
+                      font=("Helvetica", 11), bg="#ffffff",
+                      activebackground="#ffffff").pack(anchor=tk.W, pady=5)
+        
+        # Rate limits apply straight away, also to a running upload
+        limits_row = tk.Frame(opts_content, bg="#ffffff")
+        limits_row.pack(anchor=tk.W, pady=5)
+        tk.Label(limits_row, text="Limit to",
+                font=("Helvetica", 11), bg="#ffffff").pack(side=tk.LEFT)
+        self.max_upload_mbps_var = tk.DoubleVar(value=self.engine.max_upload_mbps)
+        tk.Spinbox(limits_row, from_=0, to=1000, increment=0.5, width=6,
+                  textvariable=self.max_upload_mbps_var, command=self.apply_limits,
+                  font=("Helvetica", 11)).pack(side=tk.LEFT, padx=5)
+        tk.Label(limits_row, text="MB/s and",
+                font=("Helvetica", 11), bg="#ffffff").pack(side=tk.LEFT)
+        self.max_requests_var = tk.DoubleVar(value=self.engine.max_requests_per_second)
+        tk.Spinbox(limits_row, from_=0, to=1000, width=6,
+                  textvariable=self.max_requests_var, command=self.apply_limits,
+                  font=("Helvetica", 11)).pack(side=tk.LEFT, padx=5)
+        tk.Label(limits_row, text="requests/s (0 = no limit)",
+                font=("Helvetica", 11), bg="#ffffff").pack(side=tk.LEFT)
+        
         # Upload button
         btn_container = tk.Frame(content, bg="#ffffff")
         btn_container.pack(fill=tk.X, pady=20)
@@ -221,6 +266,13 @@ class ImmichUploader:
                                     command=self.start_upload)
         self.upload_btn.pack()
         
+        self.retry_btn = tk.Button(btn_container, text="🔁 Retry Failed Uploads",
+                                   font=("Helvetica", 10), bg="#E5E7EB", fg="#374151",
+                                   activebackground="#D1D5DB", cursor="hand2",
+                                   bd=0, padx=15, pady=8,
+                                   command=self.start_retry_failed)
+        self.retry_btn.pack(pady=(10, 0))
+        
         # Progress area
         self.progress_frame = tk.LabelFrame(content, text="📊 Upload Progress", 
                                            font=("Helvetica", 12, "bold"),
@@ -236,6 +288,10 @@ class ImmichUploader:
                                        font=("Helvetica", 10), bg="#ffffff", fg="#6B7280")
         self.progress_label.pack(pady=5)
         
+        self.metrics_label = tk.Label(progress_content, text="",
+                                      font=("Helvetica", 9), bg="#ffffff", fg="#9CA3AF")
+        self.metrics_label.pack(pady=(0, 5))
+        
         # Log area
         log_container = tk.Frame(progress_content, bg="#ffffff")
         log_container.pack(fill=tk.BOTH, expand=True, pady=10)
@@ -261,6 +317,9 @@ class ImmichUploader:
     
     def connect(self):
         """Connect to Immich server"""
+        # Loaded here rather than at startup, which it would slow down
+        import requests
+        
         server_url = self.server_url_entry.get().strip()
         api_key = self.api_key_entry.get().strip()
         
@@ -271,21 +330,21 @@ class ImmichUploader:
         # Test connection
         self.connect_btn.config(text="Connecting...", state=tk.DISABLED)
         self.root.update()
+        session = None
         
         try:
             # Remove trailing slash if present
             server_url = server_url.rstrip('/')
             
-            # Test API connection
-            headers = {'x-api-key': api_key}
+            # Test API connection on a fresh session, kept only if it works
+            session = self.engine.create_session(api_key)
             
             # First, test if server is reachable at all
             test_url = f"{server_url}/server/about"
             
             print(f"DEBUG: Testing connection to: {test_url}")
-            print(f"DEBUG: Using headers: {headers}")
             
-            response = requests.get(test_url, headers=headers, timeout=10)
+            response = session.get(test_url, timeout=10)
             
             print(f"DEBUG: Response status: {response.status_code}")
             print(f"DEBUG: Response text: {response.text[:200]}")
@@ -293,17 +352,17 @@ class ImmichUploader:
             if response.status_code == 200:
                 # Now test user authentication - try both endpoints for compatibility
                 user_url = f"{server_url}/users/me"  # Try plural first (newer versions)
-                user_response = requests.get(user_url, headers=headers, timeout=10)
+                user_response = session.get(user_url, timeout=10)
                 
                 if user_response.status_code == 404:
                     # Try singular version (older versions)
                     user_url = f"{server_url}/user/me"
-                    user_response = requests.get(user_url, headers=headers, timeout=10)
+                    user_response = session.get(user_url, timeout=10)
                 
                 if user_response.status_code == 200:
-                    self.server_url = server_url
-                    self.api_key = api_key
-                    self.save_config()
+                    self.engine.set_server(server_url, api_key, session)
+                    self.engine.save_config()
+                    session = None
                     messagebox.showinfo("Success", 
                                       f"Connected successfully!\n\nServer URL: {server_url}\n\nYou can now upload photos.")
                     self.show_main()
@@ -341,6 +400,8 @@ class ImmichUploader:
                                f"Unexpected error:\n{str(e)}\n\n"
                                f"URL: {server_url}")
         finally:
+            if session is not None:
+                session.close()
             self.connect_btn.config(text="Connect to Immich", state=tk.NORMAL)
     
     def select_folder(self):
@@ -363,15 +424,55 @@ class ImmichUploader:
         """Add folder to upload list"""
         if folder_path not in self.selected_folders:
             self.selected_folders.append(folder_path)
-            folder_name = os.path.basename(folder_path)
-            
-            # Count files
-            file_count = self.count_media_files(folder_path)
-            
-            self.folders_listbox.insert(tk.END, f"{folder_name} ({file_count} files) - {folder_path}")
+            self.folder_counts[folder_path] = None
+            self.folders_listbox.insert(tk.END, self.folder_label(folder_path, None))
             
             if not self.folders_frame.winfo_ismapped():
                 self.folders_frame.pack(fill=tk.BOTH, expand=True, pady=20)
+            
+            # Count files in the background (reused as the progress total when uploading),
+            # so a big network share doesn't freeze the window
+            cancel = threading.Event()
+            self.counting[folder_path] = cancel
+            thread = threading.Thread(target=self.count_folder, args=(folder_path, cancel))
+            thread.daemon = True
+            thread.start()
+    
+    def count_folder(self, folder_path, cancel):
+        """Count a folder's media files on a worker thread, showing running totals"""
+        def on_progress(count):
+            self.call_in_ui(self.show_folder_count, folder_path, cancel, count, False)
+        
+        count = self.engine.count_media_files(folder_path, on_progress, cancel)
+        if count is not None:
+            self.call_in_ui(self.show_folder_count, folder_path, cancel, count, True)
+    
+    def show_folder_count(self, folder_path, cancel, count, done):
+        """Update a folder's line in the list with its (running) file count"""
+        # Removed, or removed and added again, since the count started
+        if self.counting.get(folder_path) is not cancel:
+            return
+        if done:
+            del self.counting[folder_path]
+            self.folder_counts[folder_path] = count
+        
+        index = self.selected_folders.index(folder_path)
+        selected = index in self.folders_listbox.curselection()
+        self.folders_listbox.delete(index)
+        self.folders_listbox.insert(index, self.folder_label(folder_path, count, done))
+        if selected:
+            self.folders_listbox.selection_set(index)
+    
+    def folder_label(self, folder_path, count, done=False):
+        """Text of a folder's line in the list"""
+        folder_name = os.path.basename(folder_path)
+        if count is None:
+            files = "counting files..."
+        elif done:
+            files = f"{count} files"
+        else:
+            files = f"{count}+ files, counting..."
+        return f"{folder_name} ({files}) - {folder_path}"
     
     def remove_selected_folder(self):
         """Remove selected folder from list"""
@@ -379,31 +480,85 @@ class ImmichUploader:
         if selection:
             index = selection[0]
             self.folders_listbox.delete(index)
-            self.selected_folders.pop(index)
+            folder_path = self.selected_folders.pop(index)
+            self.folder_counts.pop(folder_path, None)
+            cancel = self.counting.pop(folder_path, None)
+            if cancel:
+                cancel.set()
             
             if not self.selected_folders:
                 self.folders_frame.pack_forget()
     
-    def count_media_files(self, folder_path):
-        """Count media files in folder"""
-        count = 0
-        media_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.heic', '.heif',
-                          '.mp4', '.mov', '.avi', '.mkv', '.m4v', '.mpg', '.mpeg', '.3gp'}
-        
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                ext = os.path.splitext(file)[1].lower()
-                if ext in media_extensions:
-                    count += 1
-        
-        return count
-    
     def log(self, message):
-        """Add message to log"""
+        """Add message to log (safe to call from any thread)"""
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.log_text.see(tk.END)
-        self.root.update()
+        self.ui_queue.put(('log', f"[{timestamp}] {message}\n"))
+    
+    def call_in_ui(self, func, *args):
+        """Run func on the Tk thread at the next refresh"""
+        self.ui_queue.put(('call', (func, args)))
+    
+    def process_ui_queue(self):
+        """Apply queued log lines, engine events and calls in one redraw
+
+        Events and calls are applied in the order they were queued, all on
+        the Tk thread, so progress state is only ever touched here.
+        """
+        lines = []
+        try:
+            while True:
+                kind, value = self.ui_queue.get_nowait()
+                if kind == 'log':
+                    lines.append(value)
+                elif kind == 'event':
+                    self.apply_event(*value)
+                else:
+                    func, args = value
+                    func(*args)
+        except queue.Empty:
+            pass
+        
+        if lines:
+            self.log_text.insert(tk.END, ''.join(lines))
+            # Keep the log bounded on long runs
+            excess = int(self.log_text.index('end-1c').split('.')[0]) - MAX_LOG_LINES
+            if excess > 0:
+                self.log_text.delete('1.0', f'{excess + 1}.0')
+            self.log_text.see(tk.END)
+        
+        status = self.upload_status
+        if status and status['changed']:
+            status['changed'] = False
+            self.show_progress(status)
+        
+        self.root.after(UI_REFRESH_MS, self.process_ui_queue)
+    
+    def refresh_metrics(self):
+        """Show throughput, latency and queue depths while uploading"""
+        if self.is_uploading:
+            self.metrics_label.config(text=self.engine.metrics.summary())
+        self.root.after(METRICS_REFRESH_MS, self.refresh_metrics)
+    
+    def show_progress(self, status):
+        """Draw the progress bar and label for the whole job"""
+        done = status['done']
+        expected = status['expected']
+        if expected:
+            self.progress_bar['value'] = int(min(done / expected, 1.0) * 100)
+        else:
+            self.progress_bar['value'] = int(status['finished'] / status['total'] * 100)
+        
+        counts = f"{done}/{expected}" if expected else f"{done}"
+        text = (f"Uploading {status['total']} folders, {status['finished']} done "
+                f"({counts} files)")
+        if status['folder']:
+            text += f" - {status['folder']}"
+        if self.parallel_uploads:
+            text += f" - {self.parallel_uploads} parallel"
+        if status['current']:
+            name, sent, size = status['current']
+            text += f"\n{name}: {sent // (1024 * 1024)} of {size // (1024 * 1024)} MB"
+        self.progress_label.config(text=text)
     
     def start_upload(self):
         """Start uploading folders"""
@@ -415,6 +570,47 @@ class ImmichUploader:
             messagebox.showwarning("Upload in Progress", "An upload is already in progress")
             return
         
+        self.watch_stop.clear()
+        # Read on the Tk thread: the worker must not touch Tk variables or the folder list
+        album_name = None if self.use_folder_name_var.get() else DEFAULT_ALBUM_NAME
+        self.begin_run(lambda: self.upload_folders(list(self.selected_folders), album_name,
+                                                   self.skip_duplicates_var.get(), self.watch_var.get(),
+                                                   dict(self.folder_counts)))
+    
+    def start_retry_failed(self):
+        """Upload only the files that failed in earlier runs"""
+        if self.is_uploading:
+            messagebox.showwarning("Upload in Progress", "An upload is already in progress")
+            return
+        
+        if not self.engine.failed_count():
+            messagebox.showinfo("Nothing to Retry", "There are no failed uploads to retry")
+            return
+        
+        check_duplicates = self.skip_duplicates_var.get()
+        self.begin_run(lambda: self.retry_failed(check_duplicates))
+    
+    def find_interrupted_job(self):
+        """Look for an upload that was cut short last time and offer to finish it"""
+        journal = self.engine.interrupted_job()
+        if journal:
+            self.call_in_ui(self.offer_resume, journal)
+    
+    def offer_resume(self, journal):
+        if self.is_uploading:
+            # Kept for the next start
+            journal.close()
+            return
+        folders, recorded, finished = journal.summary()
+        if messagebox.askyesno("Resume Upload?",
+                               f"An upload of {folders} folders was interrupted with {finished} of "
+                               f"{recorded} files done.\n\nFinish it now? (No forgets it)"):
+            self.begin_run(lambda: self.resume_job(journal))
+        else:
+            self.engine.discard_job(journal)
+    
+    def begin_run(self, target):
+        """Prepare the progress area and run target on a worker thread"""
         # Show progress frame
         if not self.progress_frame.winfo_ismapped():
             self.progress_frame.pack(fill=tk.BOTH, expand=True, pady=20)
@@ -422,180 +618,170 @@ class ImmichUploader:
         # Clear log
         self.log_text.delete(1.0, tk.END)
         
-        # Disable upload button
+        # Remember the pool size for next time
+        try:
+            self.engine.upload_workers = max(1, min(MAX_PARALLEL_UPLOADS[self.engine.transport],
+                                                    int(self.upload_workers_var.get())))
+        except (tk.TclError, ValueError):
+            pass
+        self.upload_workers_var.set(self.engine.upload_workers)
+        self.engine.adaptive_concurrency = self.adaptive_var.get()
+        self.engine.upload_order = self.upload_order_var.get()
+        self.apply_limits()
+        self.engine.save_config()
+        # Albums may have been made, renamed or deleted in Immich since the last run
+        self.engine.forget_albums()
+        self.parallel_uploads = None
+        
+        # Disable upload buttons
         self.upload_btn.config(state=tk.DISABLED, text="Uploading...")
+        self.retry_btn.config(state=tk.DISABLED)
         self.is_uploading = True
         
         # Start upload in thread
-        thread = threading.Thread(target=self.upload_folders)
+        thread = threading.Thread(target=target)
         thread.daemon = True
         thread.start()
     
-    def upload_folders(self):
-        """Upload all selected folders"""
-        total_folders = len(self.selected_folders)
-        success_count = 0
-        fail_count = 0
-        
+    def apply_limits(self):
+        """Pass the bandwidth and request limits to the engine"""
         try:
-            for i, folder_path in enumerate(self.selected_folders):
-                folder_name = os.path.basename(folder_path)
-                album_name = folder_name if self.use_folder_name_var.get() else "Uploaded Photos"
-                
-                # Update progress
-                progress = int((i / total_folders) * 100)
-                self.progress_bar['value'] = progress
-                self.progress_label.config(text=f"Uploading folder {i+1} of {total_folders}: {folder_name}")
-                
-                self.log(f"Starting upload: {folder_name} → Album: {album_name}")
-                
-                # Upload folder
-                if self.upload_folder(folder_path, album_name):
-                    success_count += 1
-                    self.log(f"✓ Successfully uploaded {folder_name}")
-                else:
-                    fail_count += 1
-                    self.log(f"✗ Failed to upload {folder_name}")
-            
-            # Complete
-            self.progress_bar['value'] = 100
-            self.progress_label.config(text=f"Complete! {success_count} successful, {fail_count} failed")
-            self.log(f"\n=== Upload Complete ===")
-            self.log(f"Success: {success_count}, Failed: {fail_count}")
-            
-            messagebox.showinfo("Upload Complete", 
-                              f"Upload finished!\n\nSuccessful: {success_count}\nFailed: {fail_count}")
+            self.engine.set_limits(float(self.max_upload_mbps_var.get()),
+                                   float(self.max_requests_var.get()))
+        except (tk.TclError, ValueError):
+            pass
+        self.max_upload_mbps_var.set(self.engine.max_upload_mbps)
+        self.max_requests_var.set(self.engine.max_requests_per_second)
+    
+    def upload_folders(self, folders, album_name, check_duplicates, watch, expected_counts):
+        """Upload the selected folders (on a worker thread)"""
+        try:
+            if watch:
+                self.call_in_ui(self.show_watching)
+                success_count, fail_count = watch_folders(
+                    self.engine, folders, album_name=album_name,
+                    check_duplicates=check_duplicates, stop=self.watch_stop)
+            else:
+                success_count, fail_count = self.engine.upload_folders(
+                    folders, album_name=album_name, check_duplicates=check_duplicates,
+                    expected_counts=expected_counts)
+            self.call_in_ui(self.finish_upload, success_count, fail_count)
         
         except Exception as e:
             self.log(f"ERROR: {str(e)}")
-            messagebox.showerror("Upload Error", f"An error occurred:\n{str(e)}")
+            self.call_in_ui(messagebox.showerror, "Upload Error", f"An error occurred:\n{str(e)}")
         
         finally:
-            self.is_uploading = False
-            self.upload_btn.config(state=tk.NORMAL, text="🚀 Start Upload")
+            self.call_in_ui(self.reset_upload_button)
     
-    def upload_folder(self, folder_path, album_name):
-        """Upload a single folder"""
+    def retry_failed(self, check_duplicates):
+        """Re-drive the failed uploads list"""
         try:
-            # First, create or get album
-            album_id = self.get_or_create_album(album_name)
-            if not album_id:
-                self.log(f"Failed to create/find album: {album_name}")
-                return False
-            
-            # Get all media files
-            media_files = []
-            media_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.heic', '.heif',
-                              '.mp4', '.mov', '.avi', '.mkv', '.m4v', '.mpg', '.mpeg', '.3gp'}
-            
-            for root, dirs, files in os.walk(folder_path):
-                for file in files:
-                    ext = os.path.splitext(file)[1].lower()
-                    if ext in media_extensions:
-                        media_files.append(os.path.join(root, file))
-            
-            self.log(f"Found {len(media_files)} media files to upload")
-            
-            # Upload each file
-            uploaded_count = 0
-            for file_path in media_files:
-                if self.upload_file(file_path, album_id):
-                    uploaded_count += 1
-                    if uploaded_count % 10 == 0:
-                        self.log(f"Uploaded {uploaded_count}/{len(media_files)} files...")
-            
-            self.log(f"Uploaded {uploaded_count}/{len(media_files)} files to album '{album_name}'")
-            return True
+            uploaded, failed = self.engine.retry_failed(check_duplicates=check_duplicates)
+            self.call_in_ui(self.finish_upload, uploaded, failed)
         
         except Exception as e:
-            self.log(f"Error uploading folder: {str(e)}")
-            return False
+            self.log(f"ERROR: {str(e)}")
+            self.call_in_ui(messagebox.showerror, "Upload Error", f"An error occurred:\n{str(e)}")
+        
+        finally:
+            self.call_in_ui(self.reset_upload_button)
     
-    def get_or_create_album(self, album_name):
-        """Get existing album or create new one"""
+    def resume_job(self, journal):
+        """Finish an interrupted upload"""
         try:
-            headers = {'x-api-key': self.api_key}
-            server_url = self.server_url.rstrip('/')
-            
-            # Try to find existing album
-            response = requests.get(f"{server_url}/albums", headers=headers, timeout=10)
-            if response.status_code == 200:
-                albums = response.json()
-                for album in albums:
-                    if album.get('albumName') == album_name:
-                        return album.get('id')
-            
-            # Create new album
-            data = {'albumName': album_name}
-            response = requests.post(f"{server_url}/albums", 
-                                   headers=headers, json=data, timeout=10)
-            if response.status_code == 201:
-                return response.json().get('id')
-            
-            return None
+            success_count, fail_count = self.engine.resume_job(journal)
+            self.call_in_ui(self.finish_upload, success_count, fail_count)
+        
         except Exception as e:
-            self.log(f"Error with album: {str(e)}")
-            return None
+            self.log(f"ERROR: {str(e)}")
+            self.call_in_ui(messagebox.showerror, "Upload Error", f"An error occurred:\n{str(e)}")
+        
+        finally:
+            self.call_in_ui(self.reset_upload_button)
     
-    def upload_file(self, file_path, album_id):
-        """Upload a single file"""
+    def finish_upload(self, success_count, fail_count):
+        """Show the final result"""
+        self.upload_status = None
+        self.progress_bar['value'] = 100
+        self.progress_label.config(text=f"Complete! {success_count} successful, {fail_count} failed")
+        self.log(f"\n=== Upload Complete ===")
+        self.log(f"Success: {success_count}, Failed: {fail_count}")
+        self.metrics_label.config(text=self.engine.metrics.summary())
         try:
-            headers = {'x-api-key': self.api_key}
-            server_url = self.server_url.rstrip('/')
-            
-            # Prepare file upload
-            with open(file_path, 'rb') as f:
-                file_name = os.path.basename(file_path)
-                mime_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
-                
-                # Create multipart form data
-                files = {
-                    'assetData': (file_name, f, mime_type)
-                }
-                
-                # Prepare form data (not JSON for multipart upload)
-                data = {
-                    'deviceAssetId': f"{file_name}-{os.path.getmtime(file_path)}",
-                    'deviceId': 'ImmichUploader',
-                    'fileCreatedAt': datetime.fromtimestamp(os.path.getctime(file_path)).isoformat() + 'Z',
-                    'fileModifiedAt': datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat() + 'Z',
+            self.engine.dump_metrics(METRICS_FILE)
+            self.log(f"Metrics saved to {METRICS_FILE}")
+        except OSError as e:
+            self.log(f"Could not save metrics: {str(e)}")
+        
+        retry_note = ""
+        failed_files = self.engine.failed_count()
+        if failed_files:
+            retry_note = f"\n\n{failed_files} files failed and can be sent again with Retry Failed Uploads."
+        messagebox.showinfo("Upload Complete", 
+                          f"Upload finished!\n\nSuccessful: {success_count}\nFailed: {fail_count}{retry_note}")
+    
+    def show_watching(self):
+        """Turn the upload button into a stop button while watching"""
+        self.upload_btn.config(state=tk.NORMAL, text="⏹ Stop Watching", command=self.stop_watching)
+    
+    def stop_watching(self):
+        self.watch_stop.set()
+        self.upload_btn.config(state=tk.DISABLED, text="Stopping...")
+    
+    def reset_upload_button(self):
+        self.is_uploading = False
+        self.upload_btn.config(state=tk.NORMAL, text="🚀 Start Upload", command=self.start_upload)
+        self.retry_btn.config(state=tk.NORMAL)
+    
+    def handle_event(self, event, fields):
+        """Queue an engine progress event (called on engine worker threads)"""
+        self.ui_queue.put(('event', (event, fields)))
+    
+    def apply_event(self, event, fields):
+        """Track engine progress on the Tk thread; drawn by process_ui_queue"""
+        if event == 'folder_start':
+            # All folders start together, so progress covers the whole job
+            if fields['index'] == 0 or not self.upload_status:
+                self.upload_status = {
+                    'total': fields['total'],
+                    'finished': 0,
+                    'folder': None,
+                    'expected': 0,
+                    'done': 0,
+                    'current': None,
+                    'changed': True,
                 }
-                
-                # Upload asset - note: no 'upload' in path, just /assets
-                response = requests.post(f"{server_url}/assets",
-                                       headers=headers, files=files, data=data, timeout=120)
-                
-                if response.status_code in [200, 201]:
-                    result = response.json()
-                    asset_id = result.get('id')
-                    
-                    if asset_id:
-                        # Add to album
-                        album_data = {'ids': [asset_id]}
-                        album_headers = {**headers, 'Content-Type': 'application/json'}
-                        album_response = requests.put(f"{server_url}/albums/{album_id}/assets",
-                                   headers=album_headers, json=album_data, timeout=10)
-                        
-                        return album_response.status_code in [200, 201]
-                    return True
-                elif response.status_code == 409:
-                    # Duplicate - that's okay if we're skipping
-                    return True
-                else:
-                    self.log(f"Upload failed: {response.status_code} - {response.text}")
-                    return False
-        
-        except Exception as e:
-            self.log(f"Error uploading file: {str(e)}")
-            return False
-    
-    def calculate_file_hash(self, file_path):
-        """Calculate SHA1 hash of file"""
-        sha1 = hashlib.sha1()
-        with open(file_path, 'rb') as f:
-            while chunk := f.read(8192):
-                sha1.update(chunk)
-        return sha1.hexdigest()
+            status = self.upload_status
+            expected = self.folder_counts.get(fields['folder'])
+            if expected is None or status['expected'] is None:
+                # One folder still being counted makes the total unknown
+                status['expected'] = None
+            else:
+                status['expected'] += expected
+            status['changed'] = True
+        elif event == 'file' and self.upload_status:
+            self.upload_status['done'] += 1
+            if fields.get('folder'):
+                self.upload_status['folder'] = os.path.basename(fields['folder'])
+            self.upload_status['current'] = None
+            self.upload_status['changed'] = True
+        elif event == 'file_progress' and self.upload_status:
+            # Byte progress of a large video
+            self.upload_status['current'] = (os.path.basename(fields['path']), fields['sent'], fields['size'])
+            self.upload_status['changed'] = True
+        elif event == 'concurrency':
+            self.parallel_uploads = fields['limit']
+            if self.upload_status:
+                self.upload_status['changed'] = True
+        elif event == 'folder_done':
+            if self.upload_status:
+                self.upload_status['finished'] += 1
+                self.upload_status['changed'] = True
+            # Scanned totals are the better estimate next time
+            found = sum(fields.get(status, 0) for status in ('indexed', 'existing', 'uploaded', 'failed'))
+            if fields['ok'] and fields['folder'] in self.folder_counts:
+                self.folder_counts[fields['folder']] = found
 
 
 def main():
@@ -0,0 +1,273 @@
+"""
+Immich Uploader - Watch Mode
+Keeps uploading new and changed files from the selected folders as they appear
+"""
+
+import os
+import sys
+import stat
+import time
+import errno
+import select
+import struct
+import threading
+from immich_engine import MediaFile, scan_media_files
+from immich_filter import DEFAULT_FILTER
+
+# A file is uploaded once its size and mtime have stayed the same this long,
+# so cards still being copied aren't sent half written
+SETTLE_SECONDS = 5.0
+# How often the polling fallback rescans the folders
+POLL_SECONDS = 30.0
+# Longest sleep while idle, which bounds how long a stop request takes
+IDLE_WAKEUP_SECONDS = 1.0
+
+# inotify(7) event bits
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_DONT_FOLLOW = 0x2000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE |
+              IN_ONLYDIR | IN_DONT_FOLLOW)
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """Reports changed media files under some folders using Linux inotify
+
+    Folders the filter excludes aren't watched, so changes in them cost nothing.
+    """
+
+    def __init__(self, folders, file_filter=DEFAULT_FILTER):
+        # ctypes.util pulls in subprocess, so it is only loaded when watching starts
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        self.file_filter = file_filter
+        self.overflowed = False
+        try:
+            for folder in folders:
+                self.add_tree(folder, [])
+        except OSError:
+            self.close()
+            raise
+
+    def add_tree(self, folder, found):
+        """Watch folder and its subfolders, adding media files already in them to found"""
+        import ctypes
+        dirs = [folder]
+        while dirs:
+            current = dirs.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(current), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    raise OSError(error, "too many folders to watch (raise fs.inotify.max_user_watches)")
+                # Gone or unreadable
+                continue
+            self.dirs[wd] = current
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.file_filter.wants_dir(entry.name, entry.path):
+                                dirs.append(entry.path)
+                        elif self.file_filter.wants_name(entry.name, entry.path):
+                            found.append(entry.path)
+            except OSError:
+                continue
+
+    def wait(self, timeout):
+        """Return media files changed within timeout seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        changed = []
+        if not ready:
+            return changed
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    self.overflowed = True
+                elif mask & IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                elif wd in self.dirs and name:
+                    path = os.path.join(self.dirs[wd], name)
+                    if mask & IN_ISDIR:
+                        # A new or moved-in folder may already hold files
+                        if mask & (IN_CREATE | IN_MOVED_TO) and self.file_filter.wants_dir(name, path):
+                            self.add_tree(path, changed)
+                    elif self.file_filter.wants_name(name, path):
+                        changed.append(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    """Finds changed media files by rescanning the folders; works on every platform"""
+
+    def __init__(self, folders, interval=POLL_SECONDS, file_filter=DEFAULT_FILTER):
+        self.folders = folders
+        self.interval = interval
+        self.file_filter = file_filter
+        self.overflowed = False
+        self.seen = self.snapshot()
+        self.next_scan = time.monotonic() + interval
+
+    def snapshot(self):
+        return {media_file.path: (media_file.stat.st_size, media_file.stat.st_mtime_ns)
+                for folder in self.folders for media_file in scan_media_files(folder, self.file_filter)}
+
+    def wait(self, timeout):
+        """Return media files changed within timeout seconds"""
+        remaining = self.next_scan - time.monotonic()
+        if remaining > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(0.0, remaining))
+        current = self.snapshot()
+        changed = [path for path, state in current.items() if self.seen.get(path) != state]
+        self.seen = current
+        self.next_scan = time.monotonic() + self.interval
+        return changed
+
+    def close(self):
+        pass
+
+
+def make_watcher(folders, log=print, poll_seconds=POLL_SECONDS, file_filter=DEFAULT_FILTER):
+    """inotify on Linux, polling anywhere else or when inotify can't be used"""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(folders, file_filter)
+        except (OSError, AttributeError) as e:
+            log(f"inotify unavailable ({str(e)}), checking folders every {poll_seconds:.0f}s")
+    return PollingWatcher(folders, poll_seconds, file_filter)
+
+
+class SettleTracker:
+    """Holds changed files back until their size and mtime stop changing"""
+
+    def __init__(self, settle_seconds=SETTLE_SECONDS):
+        self.settle_seconds = settle_seconds
+        # path → (size, mtime_ns, unchanged since)
+        self.pending = {}
+
+    def touch(self, paths):
+        now = time.monotonic()
+        for path in paths:
+            self.pending[path] = (None, None, now)
+
+    def ready(self):
+        """Remove and return the MediaFiles that have settled"""
+        now = time.monotonic()
+        settled = []
+        for path, (size, mtime_ns, since) in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Deleted or moved away before it settled
+                del self.pending[path]
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                del self.pending[path]
+            elif (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                self.pending[path] = (st.st_size, st.st_mtime_ns, now)
+            elif now - since >= self.settle_seconds:
+                del self.pending[path]
+                settled.append(MediaFile(path, st))
+        return settled
+
+
+def settled_files(folder, tracker, file_filter=DEFAULT_FILTER):
+    """Scan folder, passing recently modified files to tracker instead of yielding them"""
+    for media_file in scan_media_files(folder, file_filter):
+        if time.time() - media_file.stat.st_mtime < tracker.settle_seconds:
+            tracker.touch([media_file.path])
+        else:
+            yield media_file
+
+
+def root_of(path, folders):
+    """The deepest of the (absolute) folders holding path, which decides its album, or None"""
+    roots = []
+    for folder in folders:
+        try:
+            # Unlike a prefix test this also works for / and drive roots
+            if folder != path and os.path.commonpath([folder, path]) == folder:
+                roots.append(folder)
+        except ValueError:
+            # On another drive
+            continue
+    return max(roots, key=len) if roots else None
+
+
+def watch_folders(engine, folders, album_name=None, check_duplicates=True, stop=None,
+                  settle_seconds=SETTLE_SECONDS, poll_seconds=POLL_SECONDS):
+    """Upload folders, then keep uploading new and changed files until stop is set
+
+    Files go to the album of the selected folder they are under, and the
+    upload index skips anything already sent. Returns the (successful,
+    failed) folder counts summed over every pass.
+    """
+    stop = stop or threading.Event()
+    folders = [os.path.abspath(folder) for folder in folders]
+    tracker = SettleTracker(settle_seconds)
+    totals = [0, 0]
+
+    def upload(files_by_folder):
+        success, failed = engine.upload_folders(list(files_by_folder), album_name, check_duplicates,
+                                                files_by_folder=files_by_folder)
+        totals[0] += success
+        totals[1] += failed
+
+    # Start watching before the first pass so nothing copied during it is missed
+    watcher = make_watcher(folders, engine.log, poll_seconds, engine.file_filter)
+    try:
+        upload({folder: settled_files(folder, tracker, engine.file_filter) for folder in folders})
+        engine.log(f"Watching {len(folders)} folders for new files (stop to finish)")
+
+        while not stop.is_set():
+            tracker.touch(watcher.wait(IDLE_WAKEUP_SECONDS))
+            if watcher.overflowed:
+                # Events were lost: look at everything again, still waiting for files to settle
+                watcher.overflowed = False
+                engine.log("Too many changes at once, rescanning the folders")
+                for folder in folders:
+                    tracker.touch(media_file.path for media_file in scan_media_files(folder, engine.file_filter))
+
+            batch = {}
+            for media_file in tracker.ready():
+                root = root_of(media_file.path, folders)
+                # Sizes and dates are only known once the file has settled
+                if root and engine.file_filter.wants_stat(media_file.stat):
+                    batch.setdefault(root, []).append(media_file)
+            if batch and not stop.is_set():
+                upload(batch)
+    finally:
+        watcher.close()
+    return tuple(totals)
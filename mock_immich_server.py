@@ -0,0 +1,325 @@
+"""
+Immich Uploader - Mock Immich Server
+A local stand-in for the Immich API endpoints the uploader uses, for benchmarks
+and trying changes without touching a real library. Latency, bandwidth,
+errors and dropped connections can be injected to see how the uploader
+behaves on a bad link.
+
+Run it on its own with:
+    python mock_immich_server.py --port 2283 --latency 0.05 --bandwidth-mbps 20
+then point the uploader at http://127.0.0.1:2283/api with any API key.
+"""
+
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+READ_CHUNK_BYTES = 256 * 1024
+
+ALBUM_ASSETS_PATH = re.compile(r'^/api/albums/([^/]+)/assets$')
+
+
+class Bandwidth:
+    """Caps how fast all connections together may send request bodies (0 = unlimited)"""
+
+    def __init__(self, bytes_per_second=0):
+        self.rate = bytes_per_second
+        self.next_free = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self, nbytes):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.next_free = max(self.next_free, now) + nbytes / self.rate
+            delay = self.next_free - now
+        time.sleep(delay)
+
+
+class MockImmich:
+    """In-memory albums and assets plus the injected faults"""
+
+    def __init__(self, latency=0.0, jitter=0.0, bandwidth_mbps=0, error_rate=0.0,
+                 error_status=503, retry_after=None, seed=None, drop_rate=0.0, drop_after_store=True,
+                 failing_uploads=0, duplicate_status=200):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = Bandwidth(bandwidth_mbps * 1024 * 1024)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        # Uploads whose connection is closed once the whole body arrived, with
+        # no answer; the asset is stored first unless drop_after_store is off
+        self.drop_rate = drop_rate
+        self.drop_after_store = drop_after_store
+        # This many uploads are answered with the injected error before any succeed
+        self.failing_uploads = failing_uploads
+        # Status of an upload the server already has: 200 like Immich, 409 like
+        # servers that refuse duplicates outright
+        self.duplicate_status = duplicate_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.albums = {}
+        self.album_assets = {}
+        self.assets = {}
+        self.stats = Counter()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def delay(self):
+        """Server think time before answering"""
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+    def should_fail(self):
+        with self.lock:
+            return self.error_rate and self.random.random() < self.error_rate
+
+    def take_failing_upload(self):
+        with self.lock:
+            if self.failing_uploads > 0:
+                self.failing_uploads -= 1
+                return True
+            return False
+
+    def should_drop(self):
+        with self.lock:
+            return self.drop_rate and self.random.random() < self.drop_rate
+
+    def store_asset(self, checksum):
+        """Return (asset id, duplicate) for an uploaded file's checksum"""
+        with self.lock:
+            if checksum in self.assets:
+                return self.assets[checksum], True
+            asset_id = str(uuid.uuid4())
+            self.assets[checksum] = asset_id
+            return asset_id, False
+
+    def delete_album(self, name):
+        """Remove an album, as a user deleting it in the web app would"""
+        with self.lock:
+            self.album_assets.pop(self.albums.pop(name), None)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_chunks(self):
+        """Yield the request body in chunks at the configured bandwidth"""
+        remaining = int(self.headers.get('Content-Length') or 0)
+        while remaining > 0:
+            chunk = self.rfile.read(min(READ_CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            self.mock.bandwidth.wait(len(chunk))
+            remaining -= len(chunk)
+            self.mock.count('bytes_received', len(chunk))
+            yield chunk
+
+    def read_json(self):
+        return json.loads(b''.join(self.read_chunks()) or b'{}')
+
+    def read_upload(self):
+        """SHA1 of the file part of a multipart upload, streamed without buffering the file"""
+        match = re.search(r'boundary=([^;]+)', self.headers.get('Content-Type', ''))
+        if not match:
+            for _ in self.read_chunks():
+                pass
+            return None
+        # The file is the last part, followed only by the closing delimiter
+        trailer = len(f'\r\n--{match.group(1).strip()}--\r\n')
+        sha1 = hashlib.sha1()
+        buffer = b''
+        in_file = False
+        for chunk in self.read_chunks():
+            buffer += chunk
+            if not in_file:
+                start = buffer.find(b'filename=')
+                end = buffer.find(b'\r\n\r\n', start) if start >= 0 else -1
+                if end < 0:
+                    continue
+                buffer = buffer[end + 4:]
+                in_file = True
+            # Hold back what may be the closing delimiter
+            if len(buffer) > trailer:
+                sha1.update(buffer[:-trailer])
+                buffer = buffer[-trailer:]
+        return sha1.hexdigest() if in_file else None
+
+    def fail(self):
+        """Answer with the injected error"""
+        self.mock.count('errors')
+        headers = {'Retry-After': str(self.mock.retry_after)} if self.mock.retry_after else None
+        self.send_json(self.mock.error_status, {'message': 'injected failure'}, headers)
+
+    def drop(self):
+        """Close the connection without answering, as a proxy timeout or network fault would"""
+        self.mock.count('dropped')
+        self.close_connection = True
+
+    def do_GET(self):
+        self.mock.count(f'GET {self.path}')
+        self.mock.delay()
+        if self.path == '/api/server/about':
+            self.send_json(200, {'version': 'mock'})
+        elif self.path in ('/api/users/me', '/api/user/me'):
+            self.send_json(200, {'email': 'mock@example.com', 'name': 'Mock'})
+        elif self.path == '/api/albums':
+            with self.mock.lock:
+                albums = [{'id': album_id, 'albumName': name} for name, album_id in self.mock.albums.items()]
+            self.send_json(200, albums)
+        else:
+            self.send_json(404, {'message': 'not found'})
+
+    def do_POST(self):
+        if self.path == '/api/assets':
+            self.mock.count('POST /assets')
+            checksum = self.read_upload()
+            self.mock.delay()
+            if self.mock.should_fail() or self.mock.take_failing_upload():
+                return self.fail()
+            if checksum is None:
+                return self.send_json(400, {'message': 'no file part'})
+            if self.mock.should_drop():
+                if self.mock.drop_after_store:
+                    self.mock.store_asset(checksum)
+                return self.drop()
+            asset_id, duplicate = self.mock.store_asset(checksum)
+            self.send_json(self.mock.duplicate_status if duplicate else 201,
+                           {'id': asset_id, 'status': 'duplicate' if duplicate else 'created'})
+        elif self.path == '/api/assets/bulk-upload-check':
+            self.mock.count('POST /assets/bulk-upload-check')
+            assets = self.read_json().get('assets', [])
+            self.mock.delay()
+            if self.mock.should_fail():
+                return self.fail()
+            results = []
+            with self.mock.lock:
+                for asset in assets:
+                    asset_id = self.mock.assets.get(asset.get('checksum'))
+                    if asset_id:
+                        results.append({'id': asset['id'], 'action': 'reject',
+                                        'reason': 'duplicate', 'assetId': asset_id})
+                    else:
+                        results.append({'id': asset['id'], 'action': 'accept'})
+            self.send_json(200, {'results': results})
+        elif self.path == '/api/albums':
+            self.mock.count('POST /albums')
+            name = self.read_json().get('albumName', '')
+            self.mock.delay()
+            with self.mock.lock:
+                album_id = self.mock.albums.setdefault(name, str(uuid.uuid4()))
+                self.mock.album_assets.setdefault(album_id, set())
+            self.send_json(201, {'id': album_id, 'albumName': name})
+        else:
+            for _ in self.read_chunks():
+                pass
+            self.send_json(404, {'message': 'not found'})
+
+    def do_PUT(self):
+        match = ALBUM_ASSETS_PATH.match(self.path)
+        ids = self.read_json().get('ids', [])
+        if not match:
+            return self.send_json(404, {'message': 'not found'})
+        self.mock.count('PUT /albums/{id}/assets')
+        self.mock.delay()
+        if self.mock.should_fail():
+            return self.fail()
+        with self.mock.lock:
+            members = self.mock.album_assets.get(match.group(1))
+            if members is None:
+                return self.send_json(400, {'message': 'unknown album'})
+            results = [{'id': asset_id, 'success': asset_id not in members} for asset_id in ids]
+            members.update(ids)
+        self.send_json(200, results)
+
+
+class MockImmichServer(ThreadingHTTPServer):
+    """Threaded HTTP server around a MockImmich"""
+
+    daemon_threads = True
+    # socketserver's default backlog of 5 resets bursts of new connections
+    request_queue_size = 1024
+
+    def __init__(self, mock, host='127.0.0.1', port=0):
+        super().__init__((host, port), MockHandler)
+        self.mock = mock
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def start(self):
+        """Serve on a background thread, returning the API URL"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local mock Immich API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2283)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random extra seconds per request")
+    parser.add_argument('--bandwidth-mbps', type=float, default=0, help="total upload MB/s (0 = unlimited)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument('--error-status', type=int, default=503, help="status of injected failures")
+    parser.add_argument('--retry-after', type=float, help="Retry-After seconds sent with failures")
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help="fraction of uploads stored and then left unanswered (connection closed)")
+    parser.add_argument('--drop-before-store', action='store_true',
+                        help="with --drop-rate, lose the dropped uploads instead of storing them")
+    args = parser.parse_args(argv)
+
+    mock = MockImmich(args.latency, args.jitter, args.bandwidth_mbps, args.error_rate,
+                      args.error_status, args.retry_after, drop_rate=args.drop_rate,
+                      drop_after_store=not args.drop_before_store)
+    server = MockImmichServer(mock, args.host, args.port)
+    print(f"Mock Immich API at {server.url} (any API key works). Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Assets: {len(mock.assets)}, albums: {len(mock.albums)}")
+        for name, count in sorted(mock.stats.items()):
+            print(f"  {name}: {count}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""Shared fixtures: a mock Immich server and an engine pointed at it"""
+
+import os
+import pytest
+from immich_engine import UploadEngine, RetryScheduler, UPLOAD_TRANSPORTS
+from mock_immich_server import MockImmich, MockImmichServer
+
+
+@pytest.fixture
+def mock():
+    """A MockImmich served on a free local port; set its fault options in the test"""
+    mock = MockImmich(seed=1)
+    server = MockImmichServer(mock)
+    mock.url = server.start()
+    yield mock
+    server.stop()
+
+
+@pytest.fixture(params=UPLOAD_TRANSPORTS)
+def transport(request):
+    """Run the test once with each upload transport"""
+    return request.param
+
+
+@pytest.fixture
+def make_engine(mock, tmp_path):
+    """Build UploadEngines for the mock server with short retry backoff"""
+    engines = []
+
+    def make_engine(transport='threads', index_name='index.db'):
+        engine = UploadEngine(log=lambda message: None, config_file=tmp_path / 'config.json',
+                              index_file=tmp_path / index_name, journal_dir=None)
+        engine.set_server(mock.url, 'test-key')
+        engine.transport = transport
+        # Retry-After from the server is still honoured up to the default cap
+        engine.retry = RetryScheduler(attempts=3, base=0.01)
+        engines.append(engine)
+        return engine
+
+    yield make_engine
+    for engine in engines:
+        engine.set_server('', '')
+
+
+@pytest.fixture
+def photos(tmp_path):
+    """A folder of a few small files with distinct contents"""
+    folder = tmp_path / 'Trip'
+    folder.mkdir()
+    for i in range(3):
+        (folder / f'IMG_{i}.jpg').write_bytes(os.urandom(2048 + i))
+    return folder
@@ -0,0 +1,93 @@
+"""AlbumBatcher: one PUT per batch of uploaded assets, sent on size, on age and on close"""
+
+import time
+import threading
+from immich_engine import AlbumBatcher
+
+
+class Recorder:
+    """A flush_fn that records the batches it is given"""
+
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.batches = []
+        self.sent = threading.Event()
+
+    def __call__(self, album_id, ids):
+        self.batches.append((album_id, list(ids)))
+        self.sent.set()
+        return self.ok
+
+
+def test_flushes_when_a_batch_is_full():
+    flush = Recorder()
+    batcher = AlbumBatcher(flush, batch_size=3, max_delay=60)
+
+    for asset_id in ('a1', 'a2', 'a3', 'a4'):
+        batcher.add('album', asset_id)
+
+    assert flush.batches == [('album', ['a1', 'a2', 'a3'])]
+    assert batcher.close()
+    assert flush.batches == [('album', ['a1', 'a2', 'a3']), ('album', ['a4'])]
+
+
+def test_batches_are_per_album():
+    flush = Recorder()
+    batcher = AlbumBatcher(flush, batch_size=2, max_delay=60)
+
+    batcher.add('one', 'a1')
+    batcher.add('two', 'b1')
+    assert flush.batches == []
+    batcher.add('two', 'b2')
+
+    assert flush.batches == [('two', ['b1', 'b2'])]
+    batcher.close()
+    assert flush.batches == [('two', ['b1', 'b2']), ('one', ['a1'])]
+
+
+def test_timer_flushes_a_partial_batch():
+    flush = Recorder()
+    batcher = AlbumBatcher(flush, batch_size=100, max_delay=0.1)
+    started = time.monotonic()
+
+    batcher.add('album', 'a1')
+
+    assert flush.sent.wait(5)
+    assert time.monotonic() - started >= 0.1
+    assert flush.batches == [('album', ['a1'])]
+    assert batcher.close()
+    assert flush.batches == [('album', ['a1'])]
+
+
+def test_flush_sends_one_album_now():
+    flush = Recorder()
+    batcher = AlbumBatcher(flush, batch_size=100, max_delay=60)
+    batcher.add('one', 'a1')
+    batcher.add('two', 'b1')
+
+    assert batcher.flush('one')
+
+    assert flush.batches == [('one', ['a1'])]
+    batcher.close()
+    assert flush.batches == [('one', ['a1']), ('two', ['b1'])]
+
+
+def test_close_stops_the_timer():
+    batcher = AlbumBatcher(Recorder(), max_delay=0.1)
+
+    assert batcher.close()
+
+    assert not batcher.timer.is_alive()
+
+
+def test_failed_batch_is_retried_then_reported(monkeypatch):
+    monkeypatch.setattr('immich_engine.time.sleep', lambda seconds: None)
+    flush = Recorder(ok=False)
+    batcher = AlbumBatcher(flush, batch_size=100, max_delay=60)
+    batcher.add('album', 'a1')
+
+    assert not batcher.flush('album')
+
+    assert len(flush.batches) == 3
+    assert not batcher.close()
+    assert batcher.failed_albums == {'album'}
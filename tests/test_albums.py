@@ -0,0 +1,67 @@
+"""The album name → id cache: loaded once, and found again when an album is deleted on the server"""
+
+import os
+
+
+def add_photo(folder, name):
+    (folder / name).write_bytes(os.urandom(4096))
+
+
+def test_album_list_is_loaded_once_per_connection(mock, make_engine, photos):
+    engine = make_engine()
+
+    for i in range(3):
+        add_photo(photos, f'NEW_{i}.jpg')
+        assert engine.upload_folders([str(photos)]) == (1, 0)
+
+    assert mock.stats['GET /api/albums'] == 1
+    assert mock.stats['POST /albums'] == 1
+
+
+def test_deleted_album_is_created_again(mock, make_engine, photos):
+    engine = make_engine()
+    engine.upload_folders([str(photos)])
+    old_id = mock.albums['Trip']
+    mock.delete_album('Trip')
+    add_photo(photos, 'NEW.jpg')
+
+    assert engine.upload_folders([str(photos)]) == (1, 0)
+
+    new_id = mock.albums['Trip']
+    assert new_id != old_id
+    assert mock.stats['GET /api/albums'] == 2
+    assert len(mock.album_assets[new_id]) == 1
+    assert engine.album_cache['Trip'] == new_id
+    # Later batches for the stale id go to the new album without another lookup
+    assert engine.add_to_album(old_id, list(mock.assets.values()))
+    assert mock.album_assets[new_id] == set(mock.assets.values())
+    assert mock.stats['GET /api/albums'] == 2
+
+
+def test_forget_albums_reloads_the_list(mock, make_engine, photos):
+    engine = make_engine()
+    engine.upload_folders([str(photos)])
+    mock.delete_album('Trip')
+    add_photo(photos, 'NEW.jpg')
+
+    engine.forget_albums()
+    assert engine.upload_folders([str(photos)]) == (1, 0)
+
+    assert mock.stats['GET /api/albums'] == 2
+    # Found missing up front, so no album update was sent to the deleted one
+    assert mock.stats['PUT /albums/{id}/assets'] == 2
+    assert mock.album_assets[mock.albums['Trip']] == set(mock.assets.values())
+
+
+def test_each_cli_run_loads_the_album_list(mock, photos, tmp_path):
+    import immich_cli
+    argv = ['--server', mock.url, '--api-key', 'test-key', '--config', str(tmp_path / 'config.json'),
+            '--index', str(tmp_path / 'index.db'), '--journal-dir', '', str(photos)]
+
+    assert immich_cli.main(argv) == 0
+    mock.delete_album('Trip')
+    add_photo(photos, 'NEW.jpg')
+    assert immich_cli.main(argv) == 0
+
+    assert mock.stats['GET /api/albums'] == 2
+    assert mock.album_assets[mock.albums['Trip']] == set(mock.assets.values())
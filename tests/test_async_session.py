@@ -0,0 +1,259 @@
+"""AsyncSession on its own: which requests are resent on a dead pooled connection,
+and the proxy and CA settings it takes from the environment"""
+
+import ssl
+import shutil
+import socket
+import threading
+import subprocess
+import pytest
+import immich_async
+from immich_async import AsyncSession, ca_bundle
+
+
+class DropSecondRequest:
+    """A raw HTTP server that answers the first request on each connection and
+    drops the connection on the second, as a server closing idle keep-alives does"""
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen()
+        self.url = f"http://127.0.0.1:{self.sock.getsockname()[1]}/api"
+        self.requests = []
+        self.hosts = []
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def read_request(self, f):
+        line = f.readline()
+        if not line:
+            return None
+        length = 0
+        while (header := f.readline()) not in (b'\r\n', b''):
+            name, _, value = header.decode('latin-1').partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+            elif name.lower() == 'host':
+                self.hosts.append(value.strip())
+        f.read(length)
+        return ' '.join(line.decode('latin-1').split()[:2])
+
+    def handle(self, conn):
+        with conn, conn.makefile('rb') as f:
+            for answered in (True, False):
+                request = self.read_request(f)
+                if request is None:
+                    return
+                self.requests.append(request)
+                if answered:
+                    conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                                 b'Content-Length: 2\r\n\r\n{}')
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def server():
+    server = DropSecondRequest()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def session():
+    session = AsyncSession('test-key', 4)
+    yield session
+    session.close()
+
+
+@pytest.mark.parametrize('method', ['GET', 'PUT'])
+def test_idempotent_request_is_resent_on_a_fresh_connection(server, session, method):
+    session.get(f"{server.url}/albums")
+
+    response = session.request_sync(method, f"{server.url}/albums/1/assets", json={'ids': []})
+
+    assert response.status_code == 200
+    assert server.requests == ['GET /api/albums', f'{method} /api/albums/1/assets',
+                               f'{method} /api/albums/1/assets']
+
+
+def test_post_is_not_resent(server, session):
+    session.get(f"{server.url}/albums")
+
+    with pytest.raises(session.network_errors):
+        session.post(f"{server.url}/albums", json={'albumName': 'Trip'})
+
+    # The server may have made the album already, so a second one isn't risked
+    assert server.requests == ['GET /api/albums', 'POST /api/albums']
+
+
+class RecordingProxy:
+    """A raw HTTP proxy that answers plain requests itself, recording what it was
+    sent, and tunnels CONNECT requests to the target port"""
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen()
+        self.url = f"http://127.0.0.1:{self.sock.getsockname()[1]}"
+        self.requests = []
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        with conn, conn.makefile('rb') as f:
+            line = f.readline().decode('latin-1').strip()
+            headers = {}
+            while (header := f.readline()) not in (b'\r\n', b''):
+                name, _, value = header.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            self.requests.append((line, headers.get('host'), headers.get('proxy-authorization')))
+            method, target, _ = line.split()
+            if method != 'CONNECT':
+                f.read(int(headers.get('content-length', 0)))
+                conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: 2\r\nConnection: close\r\n\r\n{}')
+                return
+            host, _, port = target.rpartition(':')
+            if port == '1':
+                conn.sendall(b'HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n')
+                return
+            upstream = socket.create_connection((host, int(port)))
+            conn.sendall(b'HTTP/1.1 200 Connection established\r\n\r\n')
+            threading.Thread(target=self.pipe, args=(upstream, conn), daemon=True).start()
+            self.pipe(conn, upstream)
+
+    def pipe(self, source, target):
+        try:
+            while data := source.recv(65536):
+                target.sendall(data)
+        except OSError:
+            pass
+        finally:
+            try:
+                target.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def proxy(monkeypatch):
+    proxy = RecordingProxy()
+    for name in ('http_proxy', 'https_proxy', 'all_proxy', 'no_proxy'):
+        monkeypatch.delenv(name, raising=False)
+        monkeypatch.delenv(name.upper(), raising=False)
+    yield proxy
+    proxy.close()
+
+
+def test_host_header_has_no_user_info(server, session):
+    session.get(server.url.replace('http://', 'http://user:secret@') + '/albums')
+
+    assert server.hosts == [server.url.split('/')[2]]
+    assert immich_async.host_header(immich_async.urlsplit('http://u@[::1]:8080/api')) == '[::1]:8080'
+    assert immich_async.host_header(immich_async.urlsplit('https://nas.local/api')) == 'nas.local'
+
+
+def test_http_request_goes_through_the_proxy(proxy, monkeypatch):
+    monkeypatch.setenv('HTTP_PROXY', proxy.url.replace('http://', 'http://me:p%40ss@'))
+    session = AsyncSession('test-key', 4)
+    try:
+        response = session.get('http://nas.invalid:2283/api/albums')
+    finally:
+        session.close()
+
+    assert response.status_code == 200
+    assert proxy.requests == [('GET http://nas.invalid:2283/api/albums HTTP/1.1', 'nas.invalid:2283',
+                               'Basic bWU6cEBzcw==')]
+
+
+def test_no_proxy_connects_directly(server, proxy, monkeypatch):
+    monkeypatch.setenv('HTTP_PROXY', proxy.url)
+    monkeypatch.setenv('NO_PROXY', '127.0.0.1')
+    session = AsyncSession('test-key', 4)
+    try:
+        assert session.get(f"{server.url}/albums").status_code == 200
+    finally:
+        session.close()
+
+    assert proxy.requests == []
+    assert server.requests == ['GET /api/albums']
+
+
+def test_refused_connect_is_a_network_error(proxy, monkeypatch):
+    monkeypatch.setenv('HTTPS_PROXY', proxy.url)
+    session = AsyncSession('test-key', 4)
+    try:
+        with pytest.raises(session.network_errors, match='403'):
+            session.get('https://127.0.0.1:1/api/albums')
+    finally:
+        session.close()
+
+    assert proxy.requests[0][0] == 'CONNECT 127.0.0.1:1 HTTP/1.1'
+
+
+def test_https_proxy_url_is_refused_with_a_reason(monkeypatch):
+    monkeypatch.delenv('no_proxy', raising=False)
+    monkeypatch.delenv('NO_PROXY', raising=False)
+    monkeypatch.setenv('HTTPS_PROXY', 'https://proxy.invalid:3128')
+    session = AsyncSession('test-key', 4)
+    try:
+        with pytest.raises(OSError, match='threads transport'):
+            session.get('https://nas.invalid/api/albums')
+    finally:
+        session.close()
+
+
+def test_ca_bundle_follows_requests(monkeypatch):
+    monkeypatch.delenv('CURL_CA_BUNDLE', raising=False)
+    monkeypatch.setenv('REQUESTS_CA_BUNDLE', '/etc/custom-ca.pem')
+    assert ca_bundle() == '/etc/custom-ca.pem'
+
+    monkeypatch.delenv('REQUESTS_CA_BUNDLE')
+    certifi = pytest.importorskip('certifi')
+    assert ca_bundle() == certifi.where()
+
+
+@pytest.mark.skipif(shutil.which('openssl') is None, reason='needs the openssl command')
+def test_https_through_the_proxy_trusts_the_ca_bundle(proxy, tmp_path, monkeypatch):
+    cert, key = tmp_path / 'cert.pem', tmp_path / 'key.pem'
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+                    '-keyout', str(key), '-out', str(cert)], check=True, capture_output=True)
+    server = DropSecondRequest()
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    handle = server.handle
+    server.handle = lambda conn: handle(context.wrap_socket(conn, server_side=True))
+    monkeypatch.setenv('HTTPS_PROXY', proxy.url)
+    monkeypatch.setenv('REQUESTS_CA_BUNDLE', str(cert))
+    session = AsyncSession('test-key', 4)
+    try:
+        response = session.get(server.url.replace('http://', 'https://') + '/albums')
+    finally:
+        session.close()
+        server.close()
+
+    assert response.status_code == 200
+    assert server.requests == ['GET /api/albums']
+    port = server.url.split(':')[2].split('/')[0]
+    assert proxy.requests == [(f'CONNECT 127.0.0.1:{port} HTTP/1.1', f'127.0.0.1:{port}', None)]
@@ -0,0 +1,99 @@
+"""Saved settings: bad values are reported by key and the rest still load; dry runs leave no files"""
+
+import json
+import immich_cli
+from immich_engine import UploadEngine
+
+
+def load(tmp_path, config):
+    path = tmp_path / 'config.json'
+    path.write_text(json.dumps(config) if isinstance(config, dict) else config)
+    lines = []
+    engine = UploadEngine(log=lines.append, config_file=path, index_file=None, journal_dir=None)
+    engine.load_config()
+    return engine, lines
+
+
+def test_good_config_loads(tmp_path):
+    engine, lines = load(tmp_path, {'server_url': 'http://nas/api', 'upload_workers': 8, 'transport': 'async',
+                                    'mirrors': [{'server_url': 'http://backup/api', 'api_key': 'k'}],
+                                    'filters': {'exclude': ['*_thumb.jpg'], 'min_size': '10k'}})
+
+    assert lines == []
+    assert engine.upload_workers == 8
+    assert engine.transport == 'async'
+    assert [mirror.server_url for mirror in engine.mirrors] == ['http://backup/api']
+    assert engine.file_filter.min_size == 10 * 1024
+
+
+def test_bad_value_is_reported_by_key(tmp_path):
+    engine, lines = load(tmp_path, {'server_url': 'http://nas/api', 'upload_workers': 'many',
+                                    'upload_order': 'biggest-first', 'hash_workers': 3})
+
+    assert len(lines) == 2
+    assert 'upload_workers' in lines[0]
+    assert 'upload_order' in lines[1]
+    assert engine.upload_workers == 4
+    assert engine.upload_order == 'folders'
+    # Everything else still loads
+    assert engine.server_url == 'http://nas/api'
+    assert engine.hash_workers == 3
+
+
+def test_bad_mirrors_are_reported(tmp_path):
+    engine, lines = load(tmp_path, {'mirrors': {'server_url': 'http://backup/api', 'api_key': 'k'},
+                                    'filters': {'raw': True}})
+
+    assert len(lines) == 1
+    assert 'mirrors' in lines[0]
+    assert engine.mirrors == []
+    assert engine.file_filter.wants_name('IMG_1.cr2', '/photos/IMG_1.cr2')
+
+
+def test_filter_typo_is_reported(tmp_path):
+    engine, lines = load(tmp_path, {'filters': {'exlude': ['*.png']}})
+
+    assert len(lines) == 1
+    assert 'filters' in lines[0] and 'exlude' in lines[0]
+
+
+def test_unreadable_config_is_reported(tmp_path):
+    engine, lines = load(tmp_path, '{"server_url": ')
+
+    assert len(lines) == 1
+    assert 'config.json' in lines[0]
+
+
+def test_dry_run_creates_no_index(mock, photos, tmp_path):
+    index = tmp_path / 'index.db'
+    code = immich_cli.main(['--server', mock.url, '--api-key', 'test-key', '--config', str(tmp_path / 'config.json'),
+                            '--index', str(index), '--journal-dir', str(tmp_path / 'jobs'), '--dry-run',
+                            str(photos)])
+
+    assert code == 0
+    assert not index.exists()
+    assert not (tmp_path / 'jobs').exists()
+    assert mock.stats['POST /assets'] == 0
+    assert mock.albums == {}
+
+
+def test_dry_run_reads_but_does_not_change_the_index(mock, photos, tmp_path):
+    index = tmp_path / 'index.db'
+    argv = ['--server', mock.url, '--api-key', 'test-key', '--config', str(tmp_path / 'config.json'),
+            '--index', str(index), '--journal-dir', '', str(photos)]
+    assert immich_cli.main(argv) == 0
+    (photos / 'NEW.jpg').write_bytes(b'new photo')
+    files = [index, tmp_path / 'index.db-wal']
+    before = [path.read_bytes() if path.exists() else None for path in files]
+    events = []
+    engine = UploadEngine(log=lambda message: None, on_event=lambda event, fields: events.append((event, fields)),
+                          config_file=tmp_path / 'config.json', index_file=index, journal_dir=None)
+    engine.set_server(mock.url, 'test-key')
+    engine.dry_run = True
+
+    assert engine.upload_folders([str(photos)]) == (1, 0)
+
+    statuses = sorted(fields['status'] for event, fields in events if event == 'file')
+    assert statuses == ['indexed'] * 3 + ['pending']
+    assert [path.read_bytes() if path.exists() else None for path in files] == before
+    assert mock.stats['POST /assets'] == 3
@@ -0,0 +1,155 @@
+"""File filters: name, path and regex excludes, pruned folders, size and date limits and RAW files"""
+
+import os
+import pytest
+import immich_engine
+from datetime import datetime
+from immich_engine import media_entries
+from immich_filter import FileFilter, parse_size, parse_date
+
+
+def make_tree(root, paths):
+    for path in paths:
+        path = root / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'x')
+
+
+def found(root, file_filter):
+    return sorted(os.path.relpath(entry.path, root).replace(os.sep, '/')
+                  for entry in media_entries(str(root), file_filter))
+
+
+def test_only_media_extensions_in_any_case():
+    file_filter = FileFilter()
+
+    assert file_filter.wants_name('IMG_1.JPG', '/photos/IMG_1.JPG')
+    assert file_filter.wants_name('clip.Mov', '/photos/clip.Mov')
+    assert not file_filter.wants_name('notes.txt', '/photos/notes.txt')
+    assert not file_filter.wants_name('.jpg', '/photos/.jpg')
+    assert not file_filter.wants_name('jpg', '/photos/jpg')
+
+
+def test_raw_files_only_when_asked_for():
+    assert not FileFilter().wants_name('IMG_1.CR2', '/photos/IMG_1.CR2')
+    assert FileFilter(raw=True).wants_name('IMG_1.CR2', '/photos/IMG_1.CR2')
+    assert FileFilter(raw=True).wants_name('IMG_1.dng', '/photos/IMG_1.dng')
+
+
+def test_name_globs_match_the_file_name_case_insensitively():
+    file_filter = FileFilter(exclude=['*_thumb.jpg', 'IMG_?.png'])
+
+    assert not file_filter.wants_name('IMG_1_THUMB.JPG', '/photos/IMG_1_THUMB.JPG')
+    assert not file_filter.wants_name('IMG_2.png', '/photos/IMG_2.png')
+    assert file_filter.wants_name('IMG_22.png', '/photos/IMG_22.png')
+    # A name glob doesn't look at the folders
+    assert file_filter.wants_name('IMG_1.jpg', '/photos/x_thumb.jpg/IMG_1.jpg')
+
+
+def test_path_globs_match_the_whole_path():
+    file_filter = FileFilter(exclude=['*/Exports/*'])
+
+    assert not file_filter.wants_name('IMG_1.jpg', '/photos/Exports/IMG_1.jpg')
+    assert not file_filter.wants_name('IMG_1.jpg', '/photos/Exports/2024/IMG_1.jpg')
+    assert file_filter.wants_name('IMG_1.jpg', '/photos/Exported/IMG_1.jpg')
+
+
+def test_regexes_are_searched_for_in_the_path():
+    file_filter = FileFilter(exclude_regex=[r'/\d{4}-draft/', r'copy\.jpe?g$'])
+
+    assert not file_filter.wants_name('IMG_1.jpg', '/photos/2024-draft/IMG_1.jpg')
+    assert not file_filter.wants_name('IMG_1 copy.jpeg', '/photos/IMG_1 copy.jpeg')
+    assert file_filter.wants_name('IMG_1.jpg', '/photos/draft/IMG_1.jpg')
+
+
+def test_bad_regex_is_a_value_error():
+    with pytest.raises(ValueError, match='bad regex'):
+        FileFilter(exclude_regex=['(unclosed'])
+
+
+def test_excluded_dirs_by_name_glob_and_path():
+    file_filter = FileFilter(exclude_dirs=['Private', 'tmp-*', '*/Archive/Old'])
+
+    assert not file_filter.wants_dir('private', '/photos/private')
+    assert not file_filter.wants_dir('tmp-2024', '/photos/tmp-2024')
+    assert not file_filter.wants_dir('Old', '/photos/Archive/Old')
+    assert file_filter.wants_dir('Old', '/photos/Old')
+    assert file_filter.wants_dir('Archive', '/photos/Archive')
+
+
+def test_default_excludes_can_be_turned_off():
+    assert not FileFilter().wants_dir('@eaDir', '/volume1/photos/@eaDir')
+    assert not FileFilter().wants_name('._IMG_1.jpg', '/photos/._IMG_1.jpg')
+
+    file_filter = FileFilter(default_excludes=False)
+
+    assert file_filter.wants_dir('@eaDir', '/volume1/photos/@eaDir')
+    assert file_filter.wants_name('._IMG_1.jpg', '/photos/._IMG_1.jpg')
+
+
+def test_excluded_folders_are_never_listed(tmp_path, monkeypatch):
+    make_tree(tmp_path, ['IMG_1.jpg', 'notes.txt', '@eaDir/IMG_1.jpg/SYNOPHOTO_THUMB_XL.jpg',
+                         'Trip/IMG_2.jpg', 'Trip/Private/IMG_3.jpg', 'Trip/._IMG_2.jpg'])
+    listed = []
+    scandir = os.scandir
+
+    def recording_scandir(path):
+        listed.append(os.path.relpath(path, tmp_path).replace(os.sep, '/'))
+        return scandir(path)
+
+    monkeypatch.setattr(immich_engine.os, 'scandir', recording_scandir)
+
+    assert found(tmp_path, FileFilter(exclude_dirs=['Private'])) == ['IMG_1.jpg', 'Trip/IMG_2.jpg']
+    assert sorted(listed) == ['.', 'Trip']
+
+
+def test_size_and_date_limits(tmp_path):
+    file_filter = FileFilter(min_size=parse_size('1k'), max_size=parse_size('1m'),
+                             newer_than=parse_date('2024-01-01'), older_than=parse_date('2025-01-01'))
+    in_range = datetime(2024, 6, 1).timestamp()
+    sizes = {'small.jpg': 100, 'ok.jpg': 4096, 'big.jpg': 2 * 1024 * 1024, 'old.jpg': 4096, 'new.jpg': 4096}
+    times = {'old.jpg': datetime(2023, 6, 1).timestamp(), 'new.jpg': datetime(2025, 1, 1).timestamp()}
+    for name, size in sizes.items():
+        path = tmp_path / name
+        path.write_bytes(b'x' * size)
+        os.utime(path, (times.get(name, in_range),) * 2)
+
+    assert file_filter.checks_stat
+    assert found(tmp_path, file_filter) == ['ok.jpg']
+
+
+def test_no_limits_needs_no_stat():
+    file_filter = FileFilter(exclude=['*.png'])
+
+    assert not file_filter.checks_stat
+    assert file_filter.wants_stat(None)
+
+
+@pytest.mark.parametrize('text, size', [(2000, 2000), ('500k', 500 * 1024), ('20MB', 20 * 1024 ** 2),
+                                        ('1.5G', int(1.5 * 1024 ** 3)), (' 3 KiB ', 3 * 1024)])
+def test_parse_size(text, size):
+    assert parse_size(text) == size
+
+
+@pytest.mark.parametrize('text', ['', 'big', '10x', '-5k'])
+def test_bad_sizes(text):
+    with pytest.raises(ValueError, match='bad size'):
+        parse_size(text)
+
+
+def test_parse_date():
+    assert parse_date('2024-06-01') == datetime(2024, 6, 1).timestamp()
+    assert parse_date('2024-06-01T12:30') == datetime(2024, 6, 1, 12, 30).timestamp()
+    with pytest.raises(ValueError, match='YYYY-MM-DD'):
+        parse_date('01/06/2024')
+
+
+def test_from_config():
+    file_filter = FileFilter.from_config({'exclude': ['*.png'], 'min_size': '10k', 'newer_than': '2024-01-01',
+                                          'raw': True, 'default_excludes': False})
+
+    assert file_filter.min_size == 10 * 1024
+    assert file_filter.newer_than == datetime(2024, 1, 1).timestamp()
+    assert file_filter.wants_name('IMG_1.nef', '/photos/IMG_1.nef')
+    assert not file_filter.wants_name('IMG_1.png', '/photos/IMG_1.png')
+    assert file_filter.wants_dir('@eaDir', '/photos/@eaDir')
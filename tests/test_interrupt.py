@@ -0,0 +1,92 @@
+"""An upload cut short by Ctrl+C doesn't report the unfinished folders as done"""
+
+import pytest
+
+
+def interrupt_after(engine, files):
+    """Make the engine's progress reporting raise KeyboardInterrupt once files have finished"""
+    report_result = engine.report_result
+    finished = []
+
+    def report(*args, **kwargs):
+        finished.append(args)
+        if len(finished) == files:
+            raise KeyboardInterrupt
+        return report_result(*args, **kwargs)
+
+    engine.report_result = report
+
+
+def test_interrupted_folders_are_not_reported_as_uploaded(mock, make_engine, photos):
+    engine = make_engine()
+    events = []
+    engine.on_event = lambda event, fields: events.append((event, fields))
+    interrupt_after(engine, 2)
+
+    with pytest.raises(KeyboardInterrupt):
+        engine.upload_folders([str(photos)])
+
+    done = [fields for event, fields in events if event == 'folder_done']
+    assert len(done) == 1
+    assert done[0]['ok'] is False
+
+
+def test_interrupted_job_is_kept_for_resume(mock, make_engine, photos, tmp_path):
+    engine = make_engine()
+    engine.journal_dir = tmp_path / 'jobs'
+    interrupt_after(engine, 2)
+
+    with pytest.raises(KeyboardInterrupt):
+        engine.upload_folders([str(photos)])
+
+    assert len(list(engine.journal_dir.iterdir())) == 1
+    resumed = make_engine()
+    resumed.journal_dir = engine.journal_dir
+    journal = resumed.interrupted_job()
+    assert journal is not None
+    assert resumed.resume_job(journal) == (1, 0)
+    assert len(mock.assets) == 3
+    assert mock.album_assets[mock.albums['Trip']] == set(mock.assets.values())
+    # Finished, so nothing is left to resume
+    assert not list(engine.journal_dir.iterdir())
+
+
+def test_cli_exits_cleanly_on_ctrl_c(mock, photos, tmp_path, monkeypatch, capsys):
+    import immich_cli
+    from immich_engine import UploadEngine
+
+    def upload_folders(self, *args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(UploadEngine, 'upload_folders', upload_folders)
+    code = immich_cli.main(['--server', mock.url, '--api-key', 'test-key',
+                            '--config', str(tmp_path / 'config.json'), '--index', '',
+                            '--journal-dir', str(tmp_path / 'jobs'), str(photos)])
+
+    assert code == 130
+    assert '--resume' in capsys.readouterr().out
+
+
+def test_interrupt_stops_every_stage(mock, make_engine, tmp_path, transport):
+    import os
+    import time
+    folder = tmp_path / 'Big'
+    folder.mkdir()
+    for i in range(40):
+        (folder / f'IMG_{i}.jpg').write_bytes(os.urandom(1024 + i))
+    mock.latency = 0.02
+    engine = make_engine(transport)
+    interrupt_after(engine, 5)
+
+    with pytest.raises(KeyboardInterrupt):
+        engine.upload_folders([str(folder)])
+
+    # Nothing is still uploading once the call returns
+    sent = mock.stats['POST /assets']
+    time.sleep(0.3)
+    assert mock.stats['POST /assets'] == sent
+    assert sent < 40
+    # Uploads that were in flight finished properly: recorded, not failed
+    assert engine.failed_count() == 0
+    recorded = [engine.index.lookup(engine.server_url, str(path), path.stat()) for path in folder.iterdir()]
+    assert sum(1 for row in recorded if row and row[1]) == len(mock.assets)
@@ -0,0 +1,76 @@
+"""Job journals: replayed to resume a job, locked while in use, never fsynced under the record lock"""
+
+import os
+import threading
+import pytest
+import immich_journal
+from immich_journal import JobJournal, interrupted_job
+
+
+def new_job(tmp_path):
+    return JobJournal.create(tmp_path, ['/photos/Trip'], 'Trip', True)
+
+
+def test_interrupted_job_is_replayed(tmp_path):
+    journal = new_job(tmp_path)
+    journal.record('scanned', folder='/photos/Trip', path='/photos/Trip/a.jpg', size=10, mtime_ns=5)
+    journal.record('hashed', path='/photos/Trip/a.jpg', checksum='abc')
+    journal.record('uploaded', server='http://nas/api', path='/photos/Trip/a.jpg', asset_id='asset-1')
+    journal.record('finished', path='/photos/Trip/a.jpg', status='uploaded')
+    journal.close()
+
+    resumed = interrupted_job(tmp_path)
+
+    assert resumed.header['album_name'] == 'Trip'
+    assert resumed.summary() == (1, 1, 1)
+    st = immich_journal.recorded_stat(10, 5)
+    assert resumed.checksum('/photos/Trip/a.jpg', st) == 'abc'
+    assert resumed.asset_id('http://nas/api', '/photos/Trip/a.jpg', st) == 'asset-1'
+    resumed.close(complete=True)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_running_job_is_not_resumed(tmp_path):
+    journal = new_job(tmp_path)
+
+    assert interrupted_job(tmp_path) is None
+    journal.close()
+
+
+def test_create_refuses_a_journal_in_use(tmp_path, monkeypatch):
+    monkeypatch.setattr(immich_journal, 'lock_file', lambda f: False)
+
+    with pytest.raises(OSError, match='in use'):
+        new_job(tmp_path)
+
+
+def test_records_are_not_held_up_by_fsync(tmp_path, monkeypatch):
+    journal = new_job(tmp_path)
+    syncing = threading.Event()
+    release = threading.Event()
+    fsync = os.fsync
+
+    def slow_fsync(fd):
+        syncing.set()
+        release.wait(5)
+        fsync(fd)
+
+    monkeypatch.setattr(immich_journal.os, 'fsync', slow_fsync)
+    journal.record('scanned', folder='/photos/Trip', path='/photos/Trip/a.jpg', size=10, mtime_ns=5)
+    writer = threading.Thread(target=journal.sync)
+    writer.start()
+    assert syncing.wait(5)
+
+    recorded = threading.Thread(target=journal.record, args=('scanned',),
+                                kwargs={'folder': '/photos/Trip', 'path': '/photos/Trip/b.jpg',
+                                        'size': 20, 'mtime_ns': 6})
+    recorded.start()
+    recorded.join(1)
+    assert not recorded.is_alive()
+
+    release.set()
+    writer.join()
+    journal.close()
+    resumed = interrupted_job(tmp_path)
+    assert len(resumed.files) == 2
+    resumed.close()
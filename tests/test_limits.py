@@ -0,0 +1,129 @@
+"""Rate limits, the in-flight limiter and adaptive concurrency"""
+
+import time
+import threading
+from immich_engine import TokenBucket, InFlightLimiter, AdaptiveConcurrency, ADAPTIVE_BACKOFF
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(0)
+
+    assert all(bucket.reserve(10 ** 9) == 0 for _ in range(5))
+
+
+def test_bucket_allows_a_burst_then_paces():
+    bucket = TokenBucket(100)
+
+    assert bucket.reserve(100) == 0
+    # The burst is spent: the next 50 units are half a second away
+    assert abs(bucket.reserve(50) - 0.5) < 0.05
+    assert abs(bucket.reserve(50) - 1.0) < 0.05
+
+
+def test_bucket_refills_over_time():
+    bucket = TokenBucket(1000)
+    bucket.reserve(1000)
+
+    time.sleep(0.1)
+
+    assert bucket.reserve(50) == 0
+
+
+def test_bucket_take_sleeps_for_its_debt():
+    bucket = TokenBucket(20)
+    bucket.reserve(20)
+    started = time.monotonic()
+
+    bucket.take(4)
+
+    assert time.monotonic() - started >= 0.15
+
+
+def test_lowering_the_rate_caps_the_burst():
+    bucket = TokenBucket(1000)
+
+    bucket.set_rate(10)
+
+    assert bucket.reserve(10) == 0
+    assert bucket.reserve(10) > 0.5
+
+
+def test_limiter_bounds_files():
+    limiter = InFlightLimiter(max_bytes=10 ** 9, max_files=2)
+    limiter.acquire(1)
+    limiter.acquire(1)
+    acquired = threading.Event()
+    threading.Thread(target=lambda: (limiter.acquire(1), acquired.set()), daemon=True).start()
+
+    assert not acquired.wait(0.2)
+    limiter.release(1)
+    assert acquired.wait(2)
+    assert limiter.files == 2
+
+
+def test_limiter_bounds_bytes_but_lets_a_huge_file_through_alone():
+    limiter = InFlightLimiter(max_bytes=100, max_files=10)
+    limiter.acquire(80)
+    acquired = threading.Event()
+    threading.Thread(target=lambda: (limiter.acquire(500), acquired.set()), daemon=True).start()
+
+    assert not acquired.wait(0.2)
+    limiter.release(80)
+    assert acquired.wait(2)
+    assert limiter.bytes == 500
+
+
+def test_raising_max_files_wakes_waiters():
+    limiter = InFlightLimiter(max_bytes=10 ** 9, max_files=1)
+    limiter.acquire(1)
+    acquired = threading.Event()
+    threading.Thread(target=lambda: (limiter.acquire(1), acquired.set()), daemon=True).start()
+    assert not acquired.wait(0.2)
+
+    limiter.set_max_files(2)
+
+    assert acquired.wait(2)
+
+
+def test_adaptive_starts_in_the_middle():
+    limiter = InFlightLimiter(10 ** 9, 16)
+
+    AdaptiveConcurrency(limiter, max_limit=16)
+
+    assert limiter.max_files == 8
+
+
+def test_adaptive_grows_while_uploads_stay_fast():
+    limiter = InFlightLimiter(10 ** 9, 16)
+    changes = []
+    concurrency = AdaptiveConcurrency(limiter, max_limit=16, on_change=changes.append)
+
+    for _ in range(100):
+        concurrency.on_success(0.1, 1024 * 1024)
+
+    assert limiter.max_files == 16
+    assert changes == sorted(changes)
+
+
+def test_adaptive_settles_lower_when_uploads_slow_down():
+    limiter = InFlightLimiter(10 ** 9, 16)
+    concurrency = AdaptiveConcurrency(limiter, max_limit=16)
+    for _ in range(100):
+        concurrency.on_success(0.1, 1024 * 1024)
+
+    for _ in range(100):
+        concurrency.on_success(1.0, 1024 * 1024)
+
+    assert limiter.max_files < 16
+
+
+def test_adaptive_backs_off_on_errors_down_to_the_minimum():
+    limiter = InFlightLimiter(10 ** 9, 16)
+    concurrency = AdaptiveConcurrency(limiter, max_limit=16, min_limit=2)
+
+    concurrency.on_error()
+    assert limiter.max_files == int(8 * ADAPTIVE_BACKOFF)
+    for _ in range(20):
+        concurrency.on_error()
+
+    assert limiter.max_files == 2
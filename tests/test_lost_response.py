@@ -0,0 +1,39 @@
+"""An upload whose answer never arrives is looked up on the server before it is sent again"""
+
+
+def test_stored_upload_is_recorded_without_resending(mock, make_engine, photos, transport):
+    mock.drop_rate = 1.0
+    engine = make_engine(transport)
+
+    assert engine.upload_folders([str(photos)]) == (1, 0)
+
+    assert mock.stats['dropped'] == 3
+    # One POST per file: the lost answers were recovered from the duplicate check
+    assert mock.stats['POST /assets'] == 3
+    # The check before uploading, then one per lost answer
+    assert mock.stats['POST /assets/bulk-upload-check'] == 1 + 3
+    assert len(mock.assets) == 3
+    assert engine.failed_count() == 0
+    album_id = mock.albums['Trip']
+    assert mock.album_assets[album_id] == set(mock.assets.values())
+    for path in photos.iterdir():
+        assert engine.index.lookup(engine.server_url, str(path), path.stat())[1] in mock.assets.values()
+
+
+def test_lost_upload_is_retried(mock, make_engine, photos, transport):
+    mock.drop_rate = 1.0
+    mock.drop_after_store = False
+    engine = make_engine(transport)
+
+    engine.upload_folders([str(photos)])
+
+    # Every attempt was checked for, found missing and sent again
+    assert mock.stats['POST /assets'] == 3 * engine.retry.attempts
+    assert mock.stats['POST /assets/bulk-upload-check'] == 1 + 3 * engine.retry.attempts
+    assert not mock.assets
+    assert engine.failed_count() == 3
+
+    mock.drop_rate = 0.0
+    assert engine.retry_failed() == (3, 0)
+    assert len(mock.assets) == 3
+    assert engine.failed_count() == 0
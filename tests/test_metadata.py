@@ -0,0 +1,190 @@
+"""Capture times read from EXIF (JPEG, TIFF), HEIF and MP4/MOV headers, including broken ones"""
+
+import struct
+import pytest
+from datetime import datetime, timedelta, timezone
+from immich_metadata import read_capture_time, MP4_EPOCH_OFFSET
+
+TAKEN = '2023:07:14 18:30:05'
+TAKEN_AT = datetime(2023, 7, 14, 18, 30, 5)
+
+
+def tiff(endian='<', tags=None, exif_tags=None):
+    """A TIFF/EXIF block with ASCII tags in IFD0 and the EXIF IFD"""
+    tags = dict(tags or {})
+    exif_tags = dict(exif_tags or {})
+
+    def ifd(entries, offset, pointer=None):
+        """IFD bytes at offset, with values longer than 4 bytes stored after it"""
+        count = len(entries) + (1 if pointer is not None else 0)
+        data_offset = offset + 2 + count * 12 + 4
+        table = struct.pack(endian + 'H', count)
+        data = b''
+        rows = sorted(entries.items())
+        if pointer is not None:
+            rows.append((0x8769, pointer))
+        for tag, value in rows:
+            if isinstance(value, int):
+                table += struct.pack(endian + 'HHII', tag, 4, 1, value)
+                continue
+            value = value.encode('ascii') + b'\0'
+            if len(value) <= 4:
+                table += struct.pack(endian + 'HHI', tag, 2, len(value)) + value.ljust(4, b'\0')
+            else:
+                table += struct.pack(endian + 'HHII', tag, 2, len(value), data_offset + len(data))
+                data += value
+        return table + b'\0\0\0\0' + data
+
+    header = (b'II*\0' if endian == '<' else b'MM\0*') + struct.pack(endian + 'I', 8)
+    # Lay out IFD0 once to learn where the EXIF IFD goes
+    size0 = len(ifd(tags, 8, pointer=0 if exif_tags else None))
+    block = header + ifd(tags, 8, pointer=8 + size0 if exif_tags else None)
+    if exif_tags:
+        block += ifd(exif_tags, 8 + size0)
+    return block
+
+
+def jpeg(exif):
+    app0 = b'JFIF\0\x01\x01\0\0\x01\0\x01\0\0'
+    app1 = b'Exif\0\0' + exif
+    return (b'\xff\xd8' + b'\xff\xe0' + struct.pack('>H', len(app0) + 2) + app0 +
+            b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 +
+            b'\xff\xda\0\x08' + b'\0' * 200)
+
+
+def box(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def heic(exif, iloc_version=0):
+    """ftyp, meta (iinf + iloc) and an mdat holding the EXIF item"""
+    ftyp = box(b'ftyp', b'heic' + b'\0\0\0\0' + b'mif1heic')
+    infe = box(b'infe', bytes([2, 0, 0, 0]) + struct.pack('>HH', 2, 0) + b'Exif' + b'\0')
+    hvc1 = box(b'infe', bytes([2, 0, 0, 0]) + struct.pack('>HH', 1, 0) + b'hvc1' + b'\0')
+    iinf = box(b'iinf', bytes([0, 0, 0, 0]) + struct.pack('>H', 2) + hvc1 + infe)
+    item = struct.pack('>I', 0) + exif
+
+    def iloc(exif_offset):
+        entries = b''
+        for item_id, offset, length in ((1, 0, 0), (2, exif_offset, len(item))):
+            entries += struct.pack('>H', item_id)
+            if iloc_version == 1:
+                entries += struct.pack('>H', 0)
+            entries += struct.pack('>HHII', 0, 1, offset, length)
+        return box(b'iloc', bytes([iloc_version, 0, 0, 0, 0x44, 0x00]) + struct.pack('>H', 2) + entries)
+
+    def meta(exif_offset):
+        return box(b'meta', bytes(4) + box(b'hdlr', bytes(24)) + iinf + iloc(exif_offset))
+
+    head = ftyp + meta(0)
+    return ftyp + meta(len(head) + 8) + box(b'mdat', item)
+
+
+def mp4(seconds, version=0):
+    if version == 1:
+        mvhd = bytes([1, 0, 0, 0]) + struct.pack('>QQIQ', seconds, seconds, 1000, 0)
+    else:
+        mvhd = bytes([0, 0, 0, 0]) + struct.pack('>IIII', seconds, seconds, 1000, 0)
+    return (box(b'ftyp', b'isom\0\0\0\0isomavc1') + box(b'free', bytes(16)) +
+            box(b'moov', box(b'mvhd', mvhd + bytes(80)) + box(b'trak', bytes(32))) +
+            box(b'mdat', bytes(64)))
+
+
+def capture_time(tmp_path, data, name='file'):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return read_capture_time(str(path))
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_exif_date_with_offset_and_subseconds(tmp_path, endian):
+    exif = tiff(endian, exif_tags={0x9003: TAKEN, 0x9011: '+02:00', 0x9291: '12'})
+
+    captured = capture_time(tmp_path, jpeg(exif))
+
+    assert captured == TAKEN_AT.replace(microsecond=120000, tzinfo=timezone(timedelta(hours=2)))
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_raw_tiff_without_offset_is_local_time(tmp_path, endian):
+    captured = capture_time(tmp_path, tiff(endian, exif_tags={0x9003: TAKEN}))
+
+    assert captured == TAKEN_AT.astimezone()
+
+
+def test_falls_back_to_digitized_then_ifd0_date(tmp_path):
+    digitized = tiff(exif_tags={0x9004: TAKEN, 0x9012: '-05:00'})
+    modified = tiff(tags={0x0132: '2020:01:02 03:04:05'})
+
+    assert capture_time(tmp_path, jpeg(digitized)) == TAKEN_AT.replace(tzinfo=timezone(timedelta(hours=-5)))
+    assert capture_time(tmp_path, jpeg(modified)) == datetime(2020, 1, 2, 3, 4, 5).astimezone()
+
+
+def test_blank_or_bad_exif_dates_are_ignored(tmp_path):
+    assert capture_time(tmp_path, jpeg(tiff(exif_tags={0x9003: '0000:00:00 00:00:00'}))) is None
+    assert capture_time(tmp_path, jpeg(tiff(exif_tags={0x9003: 'not a date at all!!'}))) is None
+    # A bad offset is dropped, the date is kept
+    captured = capture_time(tmp_path, jpeg(tiff(exif_tags={0x9003: TAKEN, 0x9011: '+2:000'})))
+    assert captured == TAKEN_AT.astimezone()
+
+
+@pytest.mark.parametrize('iloc_version', [0, 1])
+def test_heic_exif_item(tmp_path, iloc_version):
+    exif = tiff('>', exif_tags={0x9003: TAKEN, 0x9011: '+09:00'})
+
+    captured = capture_time(tmp_path, heic(exif, iloc_version))
+
+    assert captured == TAKEN_AT.replace(tzinfo=timezone(timedelta(hours=9)))
+
+
+@pytest.mark.parametrize('version', [0, 1])
+def test_mp4_mvhd_creation_time(tmp_path, version):
+    taken = datetime(2022, 12, 31, 23, 59, 58, tzinfo=timezone.utc)
+
+    captured = capture_time(tmp_path, mp4(int(taken.timestamp()) + MP4_EPOCH_OFFSET, version))
+
+    assert captured == taken
+
+
+def test_mp4_without_creation_time(tmp_path):
+    assert capture_time(tmp_path, mp4(0)) is None
+
+
+@pytest.mark.parametrize('cut', [3, 10, 30, 60])
+def test_truncated_jpeg(tmp_path, cut):
+    data = jpeg(tiff(exif_tags={0x9003: TAKEN}))
+
+    assert capture_time(tmp_path, data[:cut]) is None
+
+
+def test_truncated_exif_block(tmp_path):
+    exif = tiff(exif_tags={0x9003: TAKEN})
+
+    # Cut inside the EXIF IFD: its entries and the date text are gone
+    assert capture_time(tmp_path, exif[:40]) is None
+
+
+@pytest.mark.parametrize('cut', [12, 40, 100, -20])
+def test_truncated_heic(tmp_path, cut):
+    data = heic(tiff('>', exif_tags={0x9003: TAKEN}))
+
+    assert capture_time(tmp_path, data[:cut]) is None
+
+
+def test_malformed_boxes(tmp_path):
+    # A box claiming to be smaller than its own header ends the walk
+    bad_size = box(b'ftyp', b'isom\0\0\0\0') + struct.pack('>I4s', 4, b'moov') + bytes(32)
+    # A 64-bit size running past the end of the file
+    huge = box(b'ftyp', b'isom\0\0\0\0') + struct.pack('>I4sQ', 1, b'moov', 2 ** 40)
+    # An mvhd cut off after its version byte
+    short_mvhd = box(b'ftyp', b'isom\0\0\0\0') + box(b'moov', box(b'mvhd', b'\0'))
+
+    assert capture_time(tmp_path, bad_size, 'bad_size') is None
+    assert capture_time(tmp_path, huge, 'huge') is None
+    assert capture_time(tmp_path, short_mvhd, 'short_mvhd') is None
+
+
+def test_unknown_and_empty_files(tmp_path):
+    assert capture_time(tmp_path, b'', 'empty') is None
+    assert capture_time(tmp_path, b'GIF89a' + bytes(100), 'gif') is None
+    assert read_capture_time(str(tmp_path / 'missing.jpg')) is None
@@ -0,0 +1,53 @@
+"""Histograms and snapshots: valid JSON whatever was measured"""
+
+import json
+from immich_metrics import Histogram, UploadMetrics, LATENCY_BUCKETS
+
+
+def test_quantiles_are_bucket_bounds():
+    histogram = Histogram()
+    for seconds in (0.02, 0.03, 0.04, 0.2, 3.0):
+        histogram.observe(seconds)
+
+    assert histogram.quantile(0.5) == 0.05
+    assert histogram.quantile(0.95) == 5
+    assert Histogram().quantile(0.5) is None
+
+
+def test_overflow_quantile_is_the_largest_value_seen():
+    histogram = Histogram()
+    histogram.observe(1.0)
+    histogram.observe(420.0)
+    histogram.observe(900.5)
+
+    assert histogram.quantile(0.3) == 1
+    assert histogram.quantile(0.5) == 900.5
+    assert histogram.cumulative()[-2] == (LATENCY_BUCKETS[-1], 1)
+    assert histogram.snapshot()['max'] == 900.5
+
+
+def test_slow_request_keeps_snapshot_valid_json():
+    metrics = UploadMetrics()
+    metrics.observe_request('assets', 420.0)
+    metrics.finish()
+
+    snapshot = json.loads(json.dumps(metrics.snapshot(), allow_nan=False))
+
+    assert snapshot['requests']['assets']['p50'] == 420.0
+    assert snapshot['requests']['assets']['buckets']['+Inf'] == 1
+    assert 'inf' not in metrics.summary()
+    assert 'le="+Inf"' in metrics.prometheus_text()
+
+
+def test_dump_metrics_writes_strict_json(tmp_path):
+    from immich_engine import UploadEngine
+    engine = UploadEngine(log=lambda message: None, config_file=tmp_path / 'config.json',
+                          index_file=None, journal_dir=None)
+    engine.metrics.observe_request('assets', 420.0)
+    engine.metrics.observe_hash(350.0, 1024)
+
+    engine.dump_metrics(tmp_path / 'metrics.json')
+
+    def no_constants(name):
+        raise ValueError(f"{name} in metrics file")
+    json.loads((tmp_path / 'metrics.json').read_text(), parse_constant=no_constants)
@@ -0,0 +1,52 @@
+"""Both upload transports against the mock server: the same outcomes for the same answers"""
+
+import time
+
+
+def test_upload(mock, make_engine, photos, transport):
+    engine = make_engine(transport)
+
+    assert engine.upload_folders([str(photos)]) == (1, 0)
+
+    assert mock.stats['POST /assets'] == 3
+    assert len(mock.assets) == 3
+    assert mock.album_assets[mock.albums['Trip']] == set(mock.assets.values())
+    assert engine.failed_count() == 0
+    for path in photos.iterdir():
+        assert engine.index.lookup(engine.server_url, str(path), path.stat())[1] in mock.assets.values()
+
+
+def test_409_duplicate_counts_as_done(mock, make_engine, photos, transport):
+    make_engine(transport).upload_folders([str(photos)])
+    mock.duplicate_status = 409
+    # A fresh index and no duplicate check, so every file is sent again
+    engine = make_engine(transport, index_name='other.db')
+    events = []
+    engine.on_event = lambda event, fields: events.append((event, fields))
+
+    assert engine.upload_folders([str(photos)], check_duplicates=False) == (1, 0)
+
+    assert mock.stats['POST /assets'] == 6
+    assert len(mock.assets) == 3
+    assert engine.failed_count() == 0
+    assert sorted(fields['status'] for event, fields in events if event == 'file') == ['uploaded'] * 3
+    # Both transports time responses the same way: a 409 is not a request error
+    assert engine.metrics.snapshot()['requests']['assets']['count'] == 3
+    assert 'assets' not in engine.metrics.snapshot()['request_errors']
+
+
+def test_503_with_retry_after_is_retried(mock, make_engine, photos, transport):
+    mock.failing_uploads = 2
+    mock.retry_after = 0.3
+    engine = make_engine(transport)
+    started = time.monotonic()
+
+    assert engine.upload_folders([str(photos)]) == (1, 0)
+
+    assert time.monotonic() - started >= 0.3
+    assert mock.stats['errors'] == 2
+    assert mock.stats['POST /assets'] == 3 + 2
+    assert engine.retry.retries == 2
+    assert engine.metrics.snapshot()['request_errors']['assets'] == 2
+    assert len(mock.assets) == 3
+    assert engine.failed_count() == 0
@@ -0,0 +1,31 @@
+"""Several selected folders uploaded as one job: every folder is credited with its own files"""
+
+import os
+import pytest
+from immich_engine import UPLOAD_ORDERS
+
+
+@pytest.mark.parametrize('order', UPLOAD_ORDERS)
+def test_nested_folders_each_count_their_files(mock, make_engine, tmp_path, order):
+    parent = tmp_path / 'Photos'
+    child = parent / 'Trip'
+    child.mkdir(parents=True)
+    for i in range(30):
+        (parent / f'P_{i}.jpg').write_bytes(os.urandom(1024 + i))
+        (child / f'C_{i}.jpg').write_bytes(os.urandom(2048 + i))
+    engine = make_engine()
+    engine.upload_order = order
+    events = []
+    engine.on_event = lambda event, fields: events.append((event, fields))
+
+    assert engine.upload_folders([str(parent), str(child)]) == (2, 0)
+
+    done = {fields['folder']: fields for event, fields in events if event == 'folder_done'}
+    counted = {folder: sum(fields.get(status, 0) for status in ('indexed', 'existing', 'uploaded'))
+               for folder, fields in done.items()}
+    assert counted == {str(parent): 60, str(child): 30}
+    files = [fields for event, fields in events if event == 'file']
+    assert sum(1 for fields in files if fields['folder'] == str(child)) == 30
+    # The child's files are in both albums
+    assert len(mock.album_assets[mock.albums['Photos']]) == 60
+    assert len(mock.album_assets[mock.albums['Trip']]) == 30
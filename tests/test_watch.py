@@ -0,0 +1,85 @@
+"""Watch mode: files wait until they settle, and go to the album of the folder they are under"""
+
+import os
+import time
+from immich_watch import SettleTracker, root_of, settled_files
+
+
+def test_root_of_picks_the_deepest_selected_folder():
+    folders = ['/photos', '/photos/2024', '/videos']
+
+    assert root_of('/photos/2024/IMG_1.jpg', folders) == '/photos/2024'
+    assert root_of('/photos/2023/IMG_1.jpg', folders) == '/photos'
+    assert root_of('/videos/a/b/clip.mp4', folders) == '/videos'
+
+
+def test_root_of_needs_a_whole_folder_name():
+    assert root_of('/photos-old/IMG_1.jpg', ['/photos']) is None
+    assert root_of('/elsewhere/IMG_1.jpg', ['/photos']) is None
+
+
+def test_root_of_filesystem_root():
+    assert root_of('/IMG_1.jpg', ['/']) == '/'
+    assert root_of('/photos/IMG_1.jpg', ['/', '/photos']) == '/photos'
+    assert root_of('/mnt/card/DCIM/IMG_1.jpg', ['/']) == '/'
+
+
+def test_file_settles_once_unchanged(tmp_path):
+    path = tmp_path / 'IMG_1.jpg'
+    path.write_bytes(b'x' * 100)
+    tracker = SettleTracker(settle_seconds=0.2)
+    tracker.touch([str(path)])
+
+    # The first look only records size and mtime
+    assert tracker.ready() == []
+    assert tracker.ready() == []
+    time.sleep(0.25)
+    settled = tracker.ready()
+
+    assert [media_file.path for media_file in settled] == [str(path)]
+    assert settled[0].stat.st_size == 100
+    assert tracker.pending == {}
+
+
+def test_growing_file_is_held_back(tmp_path):
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(b'x' * 100)
+    tracker = SettleTracker(settle_seconds=0.2)
+    tracker.touch([str(path)])
+    tracker.ready()
+
+    for size in (200, 300):
+        time.sleep(0.15)
+        path.write_bytes(b'x' * size)
+        assert tracker.ready() == []
+    time.sleep(0.25)
+
+    assert [media_file.stat.st_size for media_file in tracker.ready()] == [300]
+
+
+def test_deleted_files_and_folders_are_dropped(tmp_path):
+    gone = tmp_path / 'gone.jpg'
+    gone.write_bytes(b'x')
+    folder = tmp_path / 'Album.jpg'
+    folder.mkdir()
+    tracker = SettleTracker(settle_seconds=0)
+    tracker.touch([str(gone), str(folder)])
+    gone.unlink()
+
+    assert tracker.ready() == []
+    assert tracker.pending == {}
+
+
+def test_settled_files_holds_back_recent_files(tmp_path):
+    old = tmp_path / 'old.jpg'
+    new = tmp_path / 'new.jpg'
+    old.write_bytes(b'old')
+    new.write_bytes(b'new')
+    hour_ago = time.time() - 3600
+    os.utime(old, (hour_ago, hour_ago))
+    tracker = SettleTracker(settle_seconds=60)
+
+    ready = [media_file.path for media_file in settled_files(str(tmp_path), tracker)]
+
+    assert ready == [str(old)]
+    assert list(tracker.pending) == [str(new)]